@@ -1,15 +1,32 @@
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import time
 import json
-import random
-import threading
 import os
-from datetime import datetime
+import uuid
+import hmac
+from datetime import datetime, timedelta
 import logging
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from queue_events import QueueEventBus, patient_topic, doctor_topic, PHARMACY_TOPIC, WAITING_TOPIC
+from queue_engine import QueueEngine, PatientRecord, StaffRecord
+from id_pool import PatientIdPool, PatientIdPoolExhausted
+from system_stats import SystemStats
+from snapshot_cache import SnapshotCache
+from queue_deltas import QueueDeltaLog
+from mutex_log_writer import MutexLogWriter
+from distributed_mutex import HttpTransport, MutexTimeout, PartitionedMutex, parse_peers
+from replication import ChangeLog, PeerReplicator, APPLY, GAP, newer
+from patient_journal import PatientJournal, lifecycle_events, apply_event, replay, encode_fields, decode_fields, encode_snapshot, decode_snapshot
+from storage import Storage, database_url, redacted_url, storage_config
+from migrate_db import upgrade_schema
+from service_times import ServiceTimes
+from user_cache import UserCache, session_user
+from password_pool import PasswordVerifier, VerifiedLogins, LoginBusy
+import math
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -17,22 +34,90 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital_queue.db'
+# Each node owns its database; patient changes are replicated between them (see replication.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url(os.environ.get('DATABASE_URL'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool and SQLite pragmas (see storage.py)
+app.config.update(storage_config())
+app.config['SSE_HEARTBEAT_SECONDS'] = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+# Queue streams send a full snapshot every this many events, and keep this many for Last-Event-ID resumes
+app.config['SSE_SNAPSHOT_EVERY'] = int(os.environ.get('SSE_SNAPSHOT_EVERY', 100))
+app.config['SSE_REPLAY_BUFFER'] = int(os.environ.get('SSE_REPLAY_BUFFER', 256))
+# How long a checked-out patient's ID is held back before it can be reissued
+app.config['PATIENT_ID_QUIET_PERIOD_HOURS'] = float(os.environ.get('PATIENT_ID_QUIET_PERIOD_HOURS', 24))
+# Mutex log entries are group-committed in the background (see mutex_log_writer)
+app.config['MUTEX_LOG_FLUSH_INTERVAL'] = float(os.environ.get('MUTEX_LOG_FLUSH_INTERVAL', 0.5))
+app.config['MUTEX_LOG_BATCH_SIZE'] = int(os.environ.get('MUTEX_LOG_BATCH_SIZE', 100))
+app.config['MUTEX_LOG_QUEUE_SIZE'] = int(os.environ.get('MUTEX_LOG_QUEUE_SIZE', 10000))
+# Other nodes taking part in mutual exclusion, as "node_2=http://host:5001,node_3=http://host:5002"
+app.config['PEERS'] = parse_peers(os.environ.get('PEERS', ''))
+# Shared secret peers send with mutex and replication messages; required when there are peers
+app.config['PEER_TOKEN'] = os.environ.get('PEER_TOKEN')
+if app.config['PEERS'] and not app.config['PEER_TOKEN']:
+    raise RuntimeError("PEER_TOKEN must be set when PEERS lists other nodes")
+app.config['MUTEX_TIMEOUT_SECONDS'] = float(os.environ.get('MUTEX_TIMEOUT_SECONDS', 10))
+# ricart-agrawala or maekawa; every node of a deployment must use the same one
+app.config['MUTEX_ALGORITHM'] = os.environ.get('MUTEX_ALGORITHM', 'ricart-agrawala')
+# How long a write waits for the peers to apply its change before moving on
+app.config['REPLICATION_TIMEOUT_SECONDS'] = float(os.environ.get('REPLICATION_TIMEOUT_SECONDS', 2))
+# How often each node pulls the changes it missed from the peers
+app.config['REPLICATION_SYNC_SECONDS'] = float(os.environ.get('REPLICATION_SYNC_SECONDS', 5))
+app.config['REPLICATION_BATCH_SIZE'] = int(os.environ.get('REPLICATION_BATCH_SIZE', 500))
+# Journal events between snapshots of the queue views (see patient_journal)
+app.config['JOURNAL_SNAPSHOT_EVERY'] = int(os.environ.get('JOURNAL_SNAPSHOT_EVERY', 500))
+# Wait time estimates start from these service times and adapt to the measured ones (see service_times)
+app.config['DEFAULT_CONSULTATION_MINUTES'] = float(os.environ.get('DEFAULT_CONSULTATION_MINUTES', 5))
+app.config['DEFAULT_PHARMACY_MINUTES'] = float(os.environ.get('DEFAULT_PHARMACY_MINUTES', 5))
+# Weight of the latest service in the moving average
+app.config['SERVICE_TIME_ALPHA'] = float(os.environ.get('SERVICE_TIME_ALPHA', 0.2))
+# Largest list /api/receptionist/register-batch accepts
+app.config['REGISTER_BATCH_MAX'] = int(os.environ.get('REGISTER_BATCH_MAX', 500))
+# Logged-in staff accounts kept in memory, and for how long before they are reloaded (see user_cache)
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL_SECONDS'] = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+# Login password checks run in a process pool of this size (0 checks in the request thread), with this
+# many more waiting for a worker; later logins wait up to the timeout and then fail with 503 (see password_pool)
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['PASSWORD_QUEUE_SIZE'] = int(os.environ.get('PASSWORD_QUEUE_SIZE', 64))
+app.config['PASSWORD_QUEUE_TIMEOUT_SECONDS'] = float(os.environ.get('PASSWORD_QUEUE_TIMEOUT_SECONDS', 5))
+# How long a verified login can be repeated without checking the password hash again; 0 disables
+app.config['VERIFIED_LOGIN_TTL_SECONDS'] = float(os.environ.get('VERIFIED_LOGIN_TTL_SECONDS', 300))
 app.debug = True  # Enable debug mode
 
-db = SQLAlchemy(app)
+db = Storage(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-# Global variables for Ricart-Agrawala algorithm
 node_id = os.environ.get('NODE_ID', 'node_1')  # Default node ID
-logical_clock = 0
-request_queue = []
-replied_nodes = set()
-state = "RELEASED"  # RELEASED, WANTED, HELD
-mutex = threading.Lock()
-deferred_replies = []
+
+# Change notifications for the SSE endpoints; write paths publish after commit
+queue_bus = QueueEventBus()
+
+# Builds of the shared queue views, one per change
+snapshot_cache = SnapshotCache()
+
+# Numbered delta events of the queue views, recorded by those builds (see queue_deltas)
+queue_deltas = QueueDeltaLog(snapshot_every=app.config['SSE_SNAPSHOT_EVERY'],
+                             buffer_size=app.config['SSE_REPLAY_BUFFER'])
+
+# Service-time estimates behind the wait time predictions, fed from the patient journal
+service_times = ServiceTimes(
+    consultation_seconds=app.config['DEFAULT_CONSULTATION_MINUTES'] * 60,
+    pharmacy_seconds=app.config['DEFAULT_PHARMACY_MINUTES'] * 60,
+    alpha=app.config['SERVICE_TIME_ALPHA']
+)
+
+# In-memory queues serving the queue reads; write paths update it after commit
+queue_engine = QueueEngine(consultation_seconds=service_times.consultation_seconds)
+
+# Admin dashboard counters, maintained alongside the queue engine
+system_stats = SystemStats()
+
+# Shown for doctors created before specialties were recorded
+DEFAULT_SPECIALTY = "General Medicine"
+
+# Free-list of 4-digit patient IDs
+patient_id_pool = PatientIdPool(quiet_period=timedelta(hours=app.config['PATIENT_ID_QUIET_PERIOD_HOURS']))
 
 # Database models
 class User(UserMixin, db.Model):
@@ -43,6 +128,7 @@ class User(UserMixin, db.Model):
     name = db.Column(db.String(100), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # receptionist, doctor, pharmacist, admin
     node_id = db.Column(db.String(10), nullable=True)  # For receptionists
+    specialty = db.Column(db.String(100), nullable=True)  # For doctors
     active = db.Column(db.Boolean, default=True)
 
     def set_password(self, password):
@@ -54,26 +140,79 @@ class User(UserMixin, db.Model):
 class Patient(db.Model):
     __tablename__ = 'patients'
     id = db.Column(db.Integer, primary_key=True)
-    unique_4digit = db.Column(db.String(4), unique=True, nullable=False)
+    # Unique among patients still in the hospital; IDs are recycled after checkout (see id_pool)
+    unique_4digit = db.Column(db.String(4), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     contact = db.Column(db.String(20), nullable=True)
     status = db.Column(db.String(20), default='Waiting for Doctor')  # Waiting for Doctor, In Consultation, Ready for Pharmacy, Checked Out
     assigned_doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     registration_time = db.Column(db.DateTime, default=datetime.utcnow)
+    # Sequence number within the patient's current queue; the displayed position is its rank (see queue_engine)
     queue_position = db.Column(db.Integer, default=0)
+    checkout_time = db.Column(db.DateTime, nullable=True)
+    # Identifies the patient on every node; the row id is local to each node's database
+    global_id = db.Column(db.String(32), nullable=True, index=True)
     
     # Relationships
     assigned_doctor = db.relationship('User', backref='patients')
     prescriptions = db.relationship('Prescription', backref='patient', lazy=True)
+    
+    # Indexes for the hot query shapes; existing databases get them at startup (migrate_db.py)
+    __table_args__ = (
+        # A doctor's waiting queue, ordered by position
+        db.Index('ix_patients_doctor_status_position', 'assigned_doctor_id', 'status', 'queue_position'),
+        # Pharmacy queue and per-status counts
+        db.Index('ix_patients_status_position', 'status', 'queue_position'),
+        # Patients registered today
+        db.Index('ix_patients_registration_time', 'registration_time'),
+        # No two patients in the hospital may share an ID
+        db.Index('uq_patients_active_unique_4digit', 'unique_4digit', unique=True,
+                 sqlite_where=db.text("status != 'Checked Out'"),
+                 postgresql_where=db.text("status != 'Checked Out'")),
+    )
 
 class Prescription(db.Model):
     __tablename__ = 'prescriptions'
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
     medicine = db.Column(db.String(200), nullable=False)
     dosage = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class PatientChange(db.Model):
+    __tablename__ = 'patient_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    origin_node = db.Column(db.String(10), nullable=False)  # Node the change was made on
+    sequence = db.Column(db.Integer, nullable=False)  # Per origin node, 1, 2, 3, ... without gaps
+    lamport = db.Column(db.Integer, nullable=False)  # Lamport timestamp; orders concurrent changes
+    patient_key = db.Column(db.String(32), nullable=False)  # Patient.global_id
+    payload = db.Column(db.Text, nullable=False)  # Patient state after the change, as JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('origin_node', 'sequence', name='uq_patient_changes_origin_sequence'),
+        # Latest change per patient, for last-writer-wins
+        db.Index('ix_patient_changes_patient_lamport', 'patient_key', 'lamport'),
+    )
+
+class PatientEvent(db.Model):
+    __tablename__ = 'patient_events'
+    id = db.Column(db.Integer, primary_key=True)  # Position in the journal
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True)
+    event_type = db.Column(db.String(30), nullable=False)  # REGISTERED, CONSULTATION_STARTED, etc.
+    data = db.Column(db.Text, nullable=False)  # Fields of the patient record the event changed, as JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class JournalSnapshot(db.Model):
+    __tablename__ = 'journal_snapshots'
+    id = db.Column(db.Integer, primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False)  # Last journal event included
+    patients = db.Column(db.Text, nullable=False)  # Records of the patients still in the hospital, as JSON
+    day = db.Column(db.Date, nullable=False)
+    patients_today = db.Column(db.Integer, nullable=False)  # Registrations on that day
+    service_times = db.Column(db.Text, nullable=True)  # Service-time estimator state, as JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
 class MutexLog(db.Model):
     __tablename__ = 'mutex_logs'
     id = db.Column(db.Integer, primary_key=True)
@@ -81,95 +220,732 @@ class MutexLog(db.Model):
     event = db.Column(db.String(20), nullable=False)  # REQUEST, REPLY, CRITICAL_SECTION, etc.
     timestamp = db.Column(db.Integer, nullable=False)  # Lamport logical timestamp
     target_node = db.Column(db.String(10), nullable=True)  # Target node for REQUEST/REPLY
+    resource = db.Column(db.String(50), nullable=True)  # Lock the event belongs to, e.g. doctor:3
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+def write_mutex_logs(entries):
+    """Insert a batch of mutex log rows in one transaction"""
+    with app.app_context():
+        try:
+            db.session.execute(MutexLog.__table__.insert(), entries)
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+mutex_log_writer = MutexLogWriter(
+    write_mutex_logs,
+    batch_size=app.config['MUTEX_LOG_BATCH_SIZE'],
+    flush_interval=app.config['MUTEX_LOG_FLUSH_INTERVAL'],
+    max_pending=app.config['MUTEX_LOG_QUEUE_SIZE']
+)
+
+def queue_mutex_log(event_type, timestamp, target_node=None, resource=None):
+    created_at = datetime.utcnow()  # Use UTC time for consistency
+    mutex_log_writer.log({
+        "node_id": node_id,
+        "event": event_type,
+        "timestamp": timestamp,
+        "target_node": target_node,
+        "resource": resource,
+        "created_at": created_at
+    })
+    logger.info(f"Mutex event logged: {event_type} on {resource} from {node_id} to {target_node} at {created_at}")
+
+# Mutual exclusion with the peer nodes, one lock per resource; queue writes run
+# in the critical sections of the queues they touch
+distributed_mutex = PartitionedMutex(
+    app.config['MUTEX_ALGORITHM'],
+    node_id,
+    app.config['PEERS'],
+    HttpTransport(app.config['PEERS'], token=app.config['PEER_TOKEN']),
+    log=queue_mutex_log,
+    timeout=app.config['MUTEX_TIMEOUT_SECONDS']
+)
+
+# Lifecycle events the in-memory views are folded from, with periodic snapshots
+patient_journal = PatientJournal(snapshot_every=app.config['JOURNAL_SNAPSHOT_EVERY'])
+
+# Patient changes are logged locally and replicated to the peer nodes
+change_log = ChangeLog(node_id)
+replicator = PeerReplicator(
+    node_id,
+    app.config['PEERS'],
+    token=app.config['PEER_TOKEN'],
+    timeout=app.config['REPLICATION_TIMEOUT_SECONDS']
+)
+
+# Session users, invalidated by the staff routes
+user_cache = UserCache(max_size=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL_SECONDS'])
+
+# Password checks for /login, off the request threads
+password_verifier = PasswordVerifier(
+    workers=app.config['PASSWORD_WORKERS'],
+    queue_size=app.config['PASSWORD_QUEUE_SIZE'],
+    admission_timeout=app.config['PASSWORD_QUEUE_TIMEOUT_SECONDS']
+)
+verified_logins = VerifiedLogins(ttl=app.config['VERIFIED_LOGIN_TTL_SECONDS'])
+# Cookie carrying the token of the last successful login, sent back to /login only
+VERIFIED_LOGIN_COOKIE = 'verified_login'
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """The session's account from the cache; deactivated accounts are logged out"""
+    user = user_cache.get(int(user_id), lambda user_id: session_user(User.query.get(user_id)))
+    return user if user is not None and user.active else None
 
-# Ricart-Agrawala algorithm functions
-def log_mutex_event(event_type, target_node=None):
-    """Helper function to log mutex events with proper timestamps"""
-    global logical_clock
-    with mutex:
-        try:
-            logical_clock += 1
-            log_entry = MutexLog(
-                node_id=node_id,
-                event=event_type,
-                timestamp=logical_clock,
-                target_node=target_node,
-                created_at=datetime.utcnow()  # Use UTC time for consistency
-            )
-            db.session.add(log_entry)
-            db.session.commit()
-            logger.info(f"Mutex event logged: {event_type} from {node_id} to {target_node} at {log_entry.created_at}")
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Failed to log mutex event: {str(e)}")
-            raise  # Re-raise the exception to handle it in the calling function
-
-def request_critical_section():
-    """Request access to critical section"""
-    global state, logical_clock, replied_nodes
-    with mutex:
-        state = "WANTED"
-        logical_clock += 1
-        request_timestamp = logical_clock
-        
-        # Log the request event
-        log_mutex_event("REQUEST")
-        
-        # In single-node mode, we automatically grant access to critical section
-        state = "HELD"
-        log_mutex_event("CRITICAL_SECTION")
-        
+def verify_login(user, password, token=None):
+    """user.check_password() for /login, skipped for a token from this account's last login;
+    raises LoginBusy when the hashing workers are saturated"""
+    if verified_logins.check(token, user.id, user.password_hash):
         return True
+    return bool(password) and password_verifier.verify(user.password_hash, password)
+
+# Distributed mutex functions
+ID_ALLOCATOR_RESOURCE = "id_allocator"
+PHARMACY_RESOURCE = "pharmacy"
 
-def release_critical_section():
-    """Release critical section"""
-    global state, deferred_replies
-    with mutex:
-        state = "RELEASED"
-        log_mutex_event("RELEASE")
+def doctor_resource(doctor_id):
+    return f"doctor:{doctor_id}"
+
+def log_mutex_event(event_type, resource, target_node=None):
+    """Log a local event at the resource's next Lamport timestamp"""
+    queue_mutex_log(event_type, distributed_mutex.tick(resource), target_node, resource)
+
+def request_critical_section(resource):
+    """Request access to a resource's critical section; raises MutexTimeout if the peers do not all reply in time"""
+    distributed_mutex.mutex(resource).acquire()
+    return True
+
+def release_critical_section(resource):
+    """Release a resource's critical section and answer the deferred requests"""
+    distributed_mutex.mutex(resource).release()
+
+def critical_section(*resources):
+    """Context manager holding the critical sections of the given resources for a queue write"""
+    return distributed_mutex.critical_section(*resources)
+
+@app.errorhandler(MutexTimeout)
+def mutex_timeout(e):
+    logger.error(f"Could not enter critical section: {str(e)}")
+    return jsonify({"success": False, "error": "The queue is busy on another node, please try again"}), 503
+
+# Queue order is stored as monotonic sequence numbers in queue_position, so
+# enqueue and dequeue touch only the moving patient's row. Displayed positions
+# are derived by rank, which the queue engine maintains in memory.
+def patient_record(patient):
+    """Queue engine record for a Patient row"""
+    return PatientRecord(
+        id=patient.id,
+        unique_id=patient.unique_4digit,
+        name=patient.name,
+        contact=patient.contact,
+        status=patient.status,
+        doctor_id=patient.assigned_doctor_id,
+        queue_position=patient.queue_position,
+        registration_time=patient.registration_time,
+        prescriptions=tuple(p.medicine for p in patient.prescriptions)
+    )
+
+def staff_record(user):
+    specialty = (user.specialty or DEFAULT_SPECIALTY) if user.role == 'doctor' else None
+    return StaffRecord(id=user.id, name=user.name, role=user.role, active=user.active, specialty=specialty)
+
+def load_queue_engine():
+    """Load every queued patient and the staff roster into the queue engine,
+    and rebuild the system statistics from the same records.
+    
+    The records come from the latest journal snapshot and the events after
+    it; without a snapshot they are queried from the patients table and a
+    first snapshot is saved.
+    """
+    def loader():
+        today = datetime.utcnow().date()
+        snapshot = JournalSnapshot.query.order_by(JournalSnapshot.id.desc()).first()
+        if snapshot is None:
+            # Prescriptions for all patients in one extra query rather than one per patient
+            patients = Patient.query.options(selectinload(Patient.prescriptions))\
+                .filter(Patient.status != "Checked Out").all()
+            records = [patient_record(p) for p in patients]
+            
+            today_start = datetime.combine(today, datetime.min.time())
+            patients_today = Patient.query.filter(
+                Patient.registration_time >= today_start,
+                Patient.registration_time < today_start + timedelta(days=1)
+            ).count()
+            last_event_id = db.session.query(func.max(PatientEvent.id)).scalar() or 0
+            save_journal_snapshot(records, last_event_id, today, patients_today)
+            patient_journal.loaded(last_event_id, 0)
+        else:
+            events = PatientEvent.query.filter(PatientEvent.id > snapshot.last_event_id)\
+                .order_by(PatientEvent.id).all()
+            if snapshot.service_times:
+                service_times.load(json.loads(snapshot.service_times))
+            folded, registered_today, missing = replay(
+                decode_snapshot(snapshot.patients),
+                [(event.patient_id, event.event_type, decode_fields(event.data), event.created_at) for event in events],
+                today,
+                observe=service_times.observe
+            )
+            if missing:
+                for patient in Patient.query.options(selectinload(Patient.prescriptions))\
+                        .filter(Patient.id.in_(missing)).all():
+                    folded[patient.id] = patient_record(patient)
+            records = [record for record in folded.values() if record.status != "Checked Out"]
+            
+            patients_today = (snapshot.patients_today if snapshot.day == today else 0) + registered_today
+            patient_journal.loaded(events[-1].id if events else snapshot.last_event_id, len(events))
+        system_stats.load(records, patients_today, today)
         
-        # Process and log deferred replies
-        for deferred_node in deferred_replies:
-            log_mutex_event("REPLY", deferred_node)
+        return records, [staff_record(u) for u in User.query.all()]
+    queue_engine.load_once(loader)
+
+def apply_patient_record(record):
+    """Write a patient state through to the in-memory views"""
+    previous = queue_engine.put_patient(record)
+    system_stats.apply(previous, record)
+
+# Journal of patient lifecycle events (see patient_journal)
+def journal_patient_change(patient, registered=False, at=None):
+    """Add the journal events of the patient's pending change, made at the given
+    time (now by default), to the session before the commit.
+    
+    Returns the engine record the events apply to and the events, for
+    fold_patient_events() once the commit succeeded.
+    """
+    return journal_patient_changes([patient], [registered], at)[0]
+
+def journal_patient_changes(patients, registered, at=None):
+    """journal_patient_change() for several patients, flushing their events together"""
+    db.session.flush()
+    at = at or datetime.utcnow()
+    journaled = []
+    for patient, is_new in zip(patients, registered):
+        current = patient_record(patient)
+        previous = queue_engine.get_patient(current.unique_id)
+        if previous is not None and previous.id != current.id:
+            previous = None  # An earlier holder of the ID, who has checked out
         
-        deferred_replies = []
+        changes = lifecycle_events(previous, current, is_new)
+        rows = [PatientEvent(patient_id=patient.id, event_type=event_type, data=encode_fields(fields), created_at=at)
+                for event_type, fields in changes]
+        db.session.add_all(rows)
+        journaled.append((previous, rows, changes))
+    db.session.flush()
+    return [(previous, [(row.id, event_type, fields, at) for row, (event_type, fields) in zip(rows, changes)])
+            for previous, rows, changes in journaled]
+
+def fold_patient_events(previous, events):
+    """Apply committed journal events to the in-memory views, snapshotting them when one is due"""
+    if not events:
+        return
+    record = previous
+    for _, event_type, fields, _ in events:
+        record = apply_event(record, event_type, fields)
+    apply_patient_record(record)
+    doctor_id = service_times.observe(previous, record, events[-1][3])
+    if doctor_id is not None:
+        queue_engine.refresh_doctor_load(doctor_id)
+    
+    if patient_journal.advance(events[-1][0], len(events)):
+        save_journal_snapshot(queue_engine.active_patients(), patient_journal.last_event_id,
+                              *system_stats.registrations())
+
+def save_journal_snapshot(records, last_event_id, day, patients_today):
+    """Save the state of the views as of a journal event and drop the older snapshots.
+    
+    Runs on its own connection, outside the caller's session.
+    """
+    table = JournalSnapshot.__table__
+    with db.engine.begin() as connection:
+        result = connection.execute(table.insert(), {
+            "last_event_id": last_event_id,
+            "patients": encode_snapshot(records),
+            "day": day,
+            "patients_today": patients_today,
+            "service_times": json.dumps(service_times.state()),
+            "created_at": datetime.utcnow()
+        })
+        connection.execute(table.delete().where(table.c.id < result.inserted_primary_key[0]))
+    patient_journal.snapshot_taken()
+    logger.info(f"Saved journal snapshot of {len(records)} patients at event {last_event_id}")
+
+def find_patient(unique_id):
+    """The patient currently holding an ID; older holders have checked out"""
+    return Patient.query.filter_by(unique_4digit=unique_id).order_by(Patient.id.desc()).first()
+
+def load_patient_id_pool():
+    """Mark IDs of patients in the hospital, or checked out within the quiet period, as taken"""
+    def loader():
+        released_at = func.max(func.coalesce(Patient.checkout_time, Patient.registration_time))
+        still_here = func.max(db.case((Patient.status != "Checked Out", 1), else_=0))
+        cutoff = datetime.utcnow() - patient_id_pool.quiet_period
+        rows = db.session.query(Patient.unique_4digit, still_here, released_at)\
+            .group_by(Patient.unique_4digit)\
+            .having(db.or_(still_here == 1, released_at >= cutoff)).all()
+        in_use = [code for code, active, _ in rows if active]
+        released = [(code, checkout_time) for code, active, checkout_time in rows if not active]
+        return in_use, released
+    patient_id_pool.load_once(loader)
+
+def find_patient_record(unique_id):
+    """Engine record for a patient, falling back to the database for patients
+    that were already checked out when the engine was loaded"""
+    load_queue_engine()
+    record = queue_engine.get_patient(unique_id)
+    if record is None:
+        patient = find_patient(unique_id)
+        if patient is None:
+            return None
+        record = patient_record(patient)
+        apply_patient_record(record)
+    return record
+
+# Replication of patient changes between nodes
+def patient_state(patient):
+    """Everything about a patient that is replicated; row ids are local to each node"""
+    return {
+        "globalId": patient.global_id,
+        "uniqueId": patient.unique_4digit,
+        "name": patient.name,
+        "contact": patient.contact,
+        "status": patient.status,
+        "doctorId": patient.assigned_doctor_id,
+        "queuePosition": patient.queue_position,
+        "registrationTime": patient.registration_time.isoformat(),
+        "checkoutTime": patient.checkout_time.isoformat() if patient.checkout_time else None,
+        "prescriptions": [[p.medicine, p.dosage] for p in sorted(patient.prescriptions, key=lambda p: p.id)]
+    }
+
+def change_row(change):
+    return PatientChange(
+        origin_node=change["origin"],
+        sequence=change["sequence"],
+        lamport=change["lamport"],
+        patient_key=change["patient"]["globalId"],
+        payload=json.dumps(change["patient"]),
+        created_at=change_time(change)
+    )
+
+def change_message(row):
+    return {
+        "origin": row.origin_node,
+        "sequence": row.sequence,
+        "lamport": row.lamport,
+        "changedAt": row.created_at.isoformat(),
+        "patient": json.loads(row.payload)
+    }
+
+def change_time(change):
+    """When a change was made on its origin node; now for peers that do not send it"""
+    return datetime.fromisoformat(change["changedAt"]) if change.get("changedAt") else datetime.utcnow()
+
+def load_change_log():
+    """Pick up the last sequence applied from every origin and the Lamport clock"""
+    def loader():
+        return db.session.query(PatientChange.origin_node, func.max(PatientChange.sequence),
+                                func.max(PatientChange.lamport))\
+            .group_by(PatientChange.origin_node).all()
+    change_log.load_once(loader)
+
+def commit_patient_change(patient):
+    """Commit the session with the patient's lifecycle events appended to the journal
+    and their new state to the change log, fold the events into the in-memory
+    views, then push the change to the peers"""
+    return commit_patient_changes([patient])[0]
+
+def commit_patient_changes(patients):
+    """commit_patient_change() for several patients in one transaction and one push"""
+    registered = [patient.id is None for patient in patients]
+    for patient in patients:
+        if patient.global_id is None:
+            patient.global_id = uuid.uuid4().hex
+    db.session.flush()
+    for patient, is_new in zip(patients, registered):
+        if not is_new:
+            # Prescriptions added in this transaction are not in the loaded collection yet
+            db.session.expire(patient, ['prescriptions'])
+    load_queue_engine()
+    load_change_log()
+    with change_log.local_changes(len(patients)) as numbers:
+        changed_at = datetime.utcnow()
+        changes = []
+        for patient, (sequence, lamport) in zip(patients, numbers):
+            change = {"origin": node_id, "sequence": sequence, "lamport": lamport,
+                      "changedAt": changed_at.isoformat(), "patient": patient_state(patient)}
+            db.session.add(change_row(change))
+            changes.append(change)
+        journaled = journal_patient_changes(patients, registered, changed_at)
+        db.session.commit()
+        for previous, events in journaled:
+            fold_patient_events(previous, events)
+    
+    # Still inside the caller's critical section, so the next node to enter has the changes
+    replicator.push(changes)
+    return changes
+
+def apply_remote_change(change):
+    """Log a change from a peer and write it to the patient row and the in-memory
+    views if it is the newest for that patient. Returns the patient, or None if
+    a newer change won."""
+    state = change["patient"]
+    latest = db.session.query(PatientChange.lamport, PatientChange.origin_node)\
+        .filter_by(patient_key=state["globalId"])\
+        .order_by(PatientChange.lamport.desc(), PatientChange.origin_node.desc()).first()
+    db.session.add(change_row(change))
+    if not newer(change, latest):
+        db.session.commit()
+        return None
+    
+    patient = Patient.query.filter_by(global_id=state["globalId"]).first()
+    registered = patient is None
+    if registered:
+        patient = Patient(global_id=state["globalId"])
+        db.session.add(patient)
+    patient.unique_4digit = state["uniqueId"]
+    patient.name = state["name"]
+    patient.contact = state["contact"]
+    patient.status = state["status"]
+    patient.assigned_doctor_id = state["doctorId"]
+    patient.queue_position = state["queuePosition"]
+    patient.registration_time = datetime.fromisoformat(state["registrationTime"])
+    patient.checkout_time = datetime.fromisoformat(state["checkoutTime"]) if state["checkoutTime"] else None
+    
+    prescriptions = [[p.medicine, p.dosage] for p in sorted(patient.prescriptions, key=lambda p: p.id or 0)]
+    if prescriptions != state["prescriptions"]:
+        for prescription in list(patient.prescriptions):
+            db.session.delete(prescription)
+        patient.prescriptions = [Prescription(medicine=medicine, dosage=dosage)
+                                 for medicine, dosage in state["prescriptions"]]
+    
+    try:
+        # Timed as on the origin node, so service times are measured the same everywhere
+        previous, events = journal_patient_change(patient, registered, change_time(change))
+        db.session.commit()
+    except IntegrityError as e:
+        # E.g. the ID is still held here by a patient whose checkout has not arrived;
+        # keep the change logged so later changes from its origin still apply
+        db.session.rollback()
+        logger.error(f"Could not apply change {change['origin']}:{change['sequence']} "
+                     f"to patient {state['uniqueId']}: {str(e)}")
+        db.session.add(change_row(change))
+        db.session.commit()
+        return None
+    fold_patient_events(previous, events)
+    return patient
 
-def handle_request(request_node, request_timestamp):
-    """Handle incoming request for critical section"""
-    global state, logical_clock
-    with mutex:
-        logical_clock = max(logical_clock, request_timestamp) + 1
+def apply_remote_changes(changes):
+    """Apply changes from a peer, each origin's in sequence order, and write the
+    updated patients through to the in-memory views.
+    
+    Returns False if some were held back because earlier changes from their
+    origin have not arrived yet.
+    """
+    load_queue_engine()
+    load_patient_id_pool()
+    load_change_log()
+    complete = True
+    for change in sorted(changes, key=lambda c: (c["origin"], c["sequence"])):
+        with change_log.remote_change(change) as action:
+            if action == GAP:
+                complete = False
+            if action != APPLY:
+                continue
+            previous = queue_engine.get_patient(change["patient"]["uniqueId"])
+            patient = apply_remote_change(change)
+        if patient is None:
+            continue
         
-        if state == "HELD" or (state == "WANTED" and (logical_clock, node_id) < (request_timestamp, request_node)):
-            deferred_replies.append(request_node)
-            log_mutex_event("DEFER", request_node)
-            return False
+        if patient.status == "Checked Out":
+            patient_id_pool.release(patient.unique_4digit, patient.checkout_time)
         else:
-            log_mutex_event("REPLY", request_node)
-            return True
-
-def handle_reply(reply_node):
-    """Handle reply from other node"""
-    global replied_nodes
-    with mutex:
-        replied_nodes.add(reply_node)
-        log_mutex_event("RECEIVED_REPLY", reply_node)
-
-# Helper function to get the next queue position for a doctor
-def get_next_queue_position(doctor_id):
-    # Find the highest queue number for this doctor and add 1
-    highest_queue = db.session.query(func.max(Patient.queue_position))\
-        .filter(Patient.assigned_doctor_id == doctor_id, Patient.status == "Waiting for Doctor").scalar()
-    
-    # If no patients in queue, start at 1
-    if highest_queue is None:
-        return 1
-    return highest_queue + 1
+            patient_id_pool.take(patient.unique_4digit)
+        topics = {patient_topic(patient.unique_4digit), doctor_topic(patient.assigned_doctor_id),
+                  PHARMACY_TOPIC, WAITING_TOPIC}
+        if previous is not None:
+            topics.add(doctor_topic(previous.doctor_id))
+        queue_bus.publish(*topics)
+    return complete
+
+def sync_with_peers():
+    """Pull the changes this node has missed from each peer (runs on the replication thread)"""
+    with app.app_context():
+        load_change_log()
+        for peer in app.config['PEERS']:
+            more = True
+            while more:
+                applied = change_log.applied()
+                changes, more = replicator.pull(peer, applied)
+                apply_remote_changes(changes)
+                if change_log.applied() == applied:
+                    break  # Nothing new could be applied from this peer
+                logger.info(f"Caught up on {len(changes)} changes from {peer}")
+
+# Wait time estimates from the measured service times (see service_times)
+def service_minutes(record):
+    """Expected minutes per patient in the record's current queue"""
+    if record.status == "Ready for Pharmacy":
+        return service_times.pharmacy_seconds() / 60
+    return service_times.consultation_seconds(record.doctor_id) / 60
+
+def estimated_wait_minutes(record, queue_position):
+    """Whole minutes, rounded up; the averaged service times carry float noise, so 4.00005 is 4"""
+    return math.ceil(round(queue_position * service_minutes(record), 2))
+
+def average_estimated_waits(pharmacy_queue):
+    """Average estimated wait in minutes of the patients waiting for a doctor, and
+    of the given number of patients in the pharmacy queue, in O(doctors)"""
+    total_minutes = 0.0
+    total_waiting = 0
+    for doctor_id, (queued, waiting) in queue_engine.doctor_queue_sizes().items():
+        # Patients in consultation rank first, so the waiting ones hold the ranks after them
+        in_consultation = queued - waiting
+        rank_sum = waiting * in_consultation + waiting * (waiting + 1) / 2
+        total_minutes += rank_sum * service_times.consultation_seconds(doctor_id) / 60
+        total_waiting += waiting
+    doctor_wait = total_minutes / total_waiting if total_waiting else 0
+    pharmacy_wait = (pharmacy_queue + 1) / 2 * service_times.pharmacy_seconds() / 60 if pharmacy_queue else 0
+    return round(doctor_wait), round(pharmacy_wait)
+
+# Queue views shared by the REST endpoints and their SSE twins
+def serialize_patient_status(record):
+    queue_position = queue_engine.rank(record)
+    estimated_wait_time = estimated_wait_minutes(record, queue_position)
+
+    return {
+        "patientName": record.name,
+        "stage": record.status,
+        "queuePosition": queue_position,
+        "totalInQueue": queue_engine.waiting_count(record.doctor_id),
+        "estimatedWaitTime": estimated_wait_time,
+        "assignedDoctor": queue_engine.staff_name(record.doctor_id),
+        "prescriptions": list(record.prescriptions)
+    }
+
+def serialize_waiting_patients():
+    load_queue_engine()
+
+    patient_list = []
+    for queue_position, record in queue_engine.waiting_list():
+        estimated_wait_time = estimated_wait_minutes(record, queue_position)
+
+        patient_list.append({
+            "id": record.unique_id,
+            "name": record.name,
+            "assignedDoctor": queue_engine.staff_name(record.doctor_id) or "Unassigned",
+            "queuePosition": queue_position,
+            "estimatedWaitTime": estimated_wait_time,
+            "status": record.status
+        })
+
+    return patient_list
+
+def serialize_doctor_queue(doctor_id):
+    load_queue_engine()
+    now = datetime.utcnow()
+
+    # The patient in consultation is in the engine's queue and counts towards the ranks
+    patient_list = []
+    for queue_position, record in queue_engine.doctor_queue(doctor_id):
+        if record.status != "Waiting for Doctor":
+            continue
+        wait_time = (now - record.registration_time).total_seconds() // 60
+
+        patient_list.append({
+            "id": record.unique_id,
+            "name": record.name,
+            "queuePosition": queue_position,
+            "waitTime": int(wait_time),
+            "contact": record.contact
+        })
+
+    return patient_list
+
+def serialize_pharmacy_queue():
+    load_queue_engine()
+
+    patient_list = []
+    for queue_position, record in queue_engine.pharmacy_queue():
+        patient_list.append({
+            "id": record.unique_id,
+            "name": record.name,
+            "queuePosition": queue_position,
+            "prescription": ", ".join(record.prescriptions),
+            "contact": record.contact
+        })
+
+    return patient_list
+
+def serialize_doctors(specialty=None):
+    load_queue_engine()
+    return [{
+        "id": doctor.id,
+        "name": doctor.name,
+        "queueLength": queue_engine.waiting_count(doctor.id),
+        "specialty": doctor.specialty
+    } for doctor in queue_engine.active_doctors(specialty)]
+
+def serialize_system_stats():
+    load_queue_engine()
+    stats = system_stats.snapshot()
+    
+    # Queue status
+    doctor_queue = stats["doctorQueue"]
+    pharmacy_queue = stats["pharmacyQueue"]
+    doctor_wait, pharmacy_wait = average_estimated_waits(pharmacy_queue)
+    
+    doctor_queue_status = "Normal"
+    if doctor_queue > 10:
+        doctor_queue_status = "Overloaded"
+    elif doctor_queue > 5:
+        doctor_queue_status = "Busy"
+    
+    pharmacy_queue_status = "Normal"
+    if pharmacy_queue > 10:
+        pharmacy_queue_status = "Overloaded"
+    elif pharmacy_queue > 5:
+        pharmacy_queue_status = "Busy"
+    
+    return {
+        "totalPatientsToday": stats["totalPatientsToday"],
+        "activePatients": stats["activePatients"],
+        "averageWaitTime": doctor_wait,
+        "systemStatus": "Operational",
+        "queues": [
+            {
+                "name": "Doctor Queue",
+                "patientsWaiting": doctor_queue,
+                "averageWaitTime": doctor_wait,
+                "status": doctor_queue_status
+            },
+            {
+                "name": "Pharmacy Queue",
+                "patientsWaiting": pharmacy_queue,
+                "averageWaitTime": pharmacy_wait,
+                "status": pharmacy_queue_status
+            }
+        ]
+    }
+
+def serialize_mutex_log(log):
+    return {
+        'id': log.id,
+        'node_id': log.node_id,
+        'event': log.event,
+        'timestamp': log.timestamp,
+        'target_node': log.target_node,
+        'created_at': log.created_at.strftime("%H:%M:%S")  # Format as HH:MM:SS
+    }
+
+def fetch_new_mutex_logs(last_id, limit=10):
+    """Return up to `limit` of the newest mutex logs after last_id, oldest first"""
+    new_logs = MutexLog.query.filter(MutexLog.id > last_id)\
+        .order_by(MutexLog.created_at.desc())\
+        .limit(limit).all()
+    return [serialize_mutex_log(log) for log in reversed(new_logs)]
+
+def sse_frame(data):
+    """Encoded Server-Sent Events frame carrying a JSON payload"""
+    return f"data: {data}\n\n".encode()
+
+def heartbeat_period():
+    """Number of the current heartbeat interval; views with time-dependent fields change with it"""
+    return int(time.time() // app.config['SSE_HEARTBEAT_SECONDS'])
+
+def queue_view_frames(topic, serialize, last_event_id, refresh_on_heartbeat=False):
+    """(frames, event id) bringing a subscriber of a queue view from the event
+    it last received to the view's current state (see queue_deltas).
+
+    The view is serialized and diffed once per publish on the topic, for every
+    subscriber; views with time-dependent fields are also rebuilt once per
+    heartbeat interval.
+    """
+    version = queue_bus.version(topic)
+    if refresh_on_heartbeat:
+        version = (version, heartbeat_period())
+    snapshot_cache.get(topic, version, lambda: queue_deltas.record(topic, serialize()))
+    return queue_deltas.frames_since(topic, last_event_id)
+
+def conditional_json(versions, serialize, private=True):
+    """jsonify(serialize()) tagged with an ETag made of the view's version counters.
+
+    versions is read before serializing, so a change published meanwhile
+    gives the next request a new ETag. A request whose If-None-Match holds
+    the current ETag gets 304 Not Modified without serialize() being called.
+    """
+    etag = ".".join(str(version) for version in (queue_bus.epoch, *versions))
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(serialize())
+    response.set_etag(etag)
+    # Revalidate on every poll; the staff views must not be shared between sessions
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
+
+def build_patient_event(unique_id, subscription):
+    """Build the SSE frame of a patient's status for their event stream.
+
+    Also points the subscription at the queue the patient is currently in, so
+    they follow it from the doctor's queue into the pharmacy queue.
+    """
+    record = find_patient_record(unique_id)
+    if not record:
+        return None
+    
+    if record.status == "Ready for Pharmacy":
+        queue = PHARMACY_TOPIC
+    else:
+        queue = doctor_topic(record.doctor_id)
+    subscription.update([patient_topic(unique_id), queue])
+    
+    return sse_frame(json.dumps(serialize_patient_status(record)))
+
+def queue_event_stream(subscription, build, refresh_on_heartbeat=False):
+    """Yield SSE frames from build() whenever the subscription fires.
+
+    build() returns the encoded frame, or None to end the stream. Between
+    changes only a keepalive comment is sent every SSE_HEARTBEAT_SECONDS so
+    disconnected clients are noticed; views with time-dependent fields set
+    refresh_on_heartbeat to rebuild on each heartbeat instead.
+    """
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    last_frame = None
+    changed = True
+    with subscription:
+        while True:
+            if changed or refresh_on_heartbeat:
+                frame = build()
+                if frame is None:
+                    return
+                if frame != last_frame:
+                    yield frame
+                    last_frame = frame
+                elif not changed:
+                    yield ": keepalive\n\n"
+            else:
+                yield ": keepalive\n\n"
+            changed = subscription.wait(heartbeat)
+
+def queue_delta_stream(subscription, topic, serialize, last_event_id=None, refresh_on_heartbeat=False):
+    """Yield a queue view's numbered events whenever the subscription fires.
+
+    A new client first gets a snapshot; a reconnecting one passes its
+    Last-Event-ID and gets the events it missed. Keepalives are sent as in
+    queue_event_stream().
+    """
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    changed = True
+    with subscription:
+        while True:
+            if changed or refresh_on_heartbeat:
+                frames, last_event_id = queue_view_frames(topic, serialize, last_event_id, refresh_on_heartbeat)
+                if frames:
+                    yield frames
+                elif not changed:
+                    yield ": keepalive\n\n"
+            else:
+                yield ": keepalive\n\n"
+            changed = subscription.wait(heartbeat)
 
 # Routes
 @app.route('/')
@@ -188,7 +964,17 @@ def login():
         password = data.get('password')
         
         user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password) and user.active:
+        # Don't hold a pooled connection while waiting for a password worker
+        db.session.close()
+        token = request.cookies.get(VERIFIED_LOGIN_COOKIE)
+        try:
+            verified = bool(user and user.active) and verify_login(user, password, token)
+        except LoginBusy:
+            logger.error(f"Login for {username} turned away: every password worker is busy")
+            response = jsonify({"success": False, "message": "Too many logins in progress, please try again"})
+            return response, 503, {"Retry-After": "1"}
+        
+        if verified:
             login_user(user)
             
             # Map roles to correct route paths
@@ -202,11 +988,17 @@ def login():
             # Get the correct route or default to role name
             redirect_path = role_routes.get(user.role, f'/{user.role}')
             
-            return jsonify({
+            response = jsonify({
                 "success": True, 
                 "role": user.role, 
                 "redirect": redirect_path
             })
+            # A fresh token each login; the one sent with this request is used up
+            token = verified_logins.issue(user.id, user.password_hash)
+            if token:
+                response.set_cookie(VERIFIED_LOGIN_COOKIE, token, max_age=int(verified_logins.ttl),
+                                    path=url_for('login'), httponly=True, samesite='Strict')
+            return response
         
         return jsonify({"success": False, "message": "Invalid credentials"}), 401
     
@@ -216,7 +1008,10 @@ def login():
 @login_required
 def logout():
     logout_user()
-    return jsonify({"success": True})
+    verified_logins.revoke(request.cookies.get(VERIFIED_LOGIN_COOKIE))
+    response = jsonify({"success": True})
+    response.delete_cookie(VERIFIED_LOGIN_COOKIE, path=url_for('login'))
+    return response
 
 @app.route('/patient')
 def patient_portal():
@@ -253,67 +1048,28 @@ def admin_portal():
 # Patient routes
 @app.route('/patient/status/<unique_id>')
 def patient_status(unique_id):
-    patient = Patient.query.filter_by(unique_4digit=unique_id).first()
-    if not patient:
+    patient_version = queue_bus.version(patient_topic(unique_id))
+    record = find_patient_record(unique_id)
+    if not record:
         return jsonify({"error": "Patient not found"}), 404
     
-    # Calculate estimated wait time based on queue position
-    estimated_wait_time = patient.queue_position * 5  # Assuming 5 minutes per patient
-    
-    prescriptions = [p.medicine for p in patient.prescriptions]
-    
-    return jsonify({
-        "patientName": patient.name,
-        "stage": patient.status,
-        "queuePosition": patient.queue_position,
-        "totalInQueue": Patient.query.filter_by(
-            assigned_doctor_id=patient.assigned_doctor_id,
-            status="Waiting for Doctor"
-        ).count(),
-        "estimatedWaitTime": estimated_wait_time,
-        "assignedDoctor": patient.assigned_doctor.name if patient.assigned_doctor else None,
-        "prescriptions": prescriptions
-    })
+    # The rank, queue size and wait estimate come from the doctor's and the pharmacy queues
+    versions = (patient_version, queue_bus.version(doctor_topic(record.doctor_id)), queue_bus.version(PHARMACY_TOPIC))
+    return conditional_json(versions, lambda: serialize_patient_status(record), private=False)
 
 @app.route('/patient/events/<unique_id>')
 def patient_events(unique_id):
-    def generate():
-        patient = Patient.query.filter_by(unique_4digit=unique_id).first()
-        if not patient:
+    if not find_patient_record(unique_id):
+        def not_found():
             yield f"data: {json.dumps({'error': 'Patient not found'})}\n\n"
-            return
-        
-        last_status = None
-        while True:
-            patient = Patient.query.filter_by(unique_4digit=unique_id).first()
-            if not patient:
-                yield f"data: {json.dumps({'error': 'Patient not found'})}\n\n"
-                break
-            
-            # Only send update if status changed
-            if patient.status != last_status:
-                estimated_wait_time = patient.queue_position * 5
-                prescriptions = [p.medicine for p in patient.prescriptions]
-                
-                data = {
-                    "patientName": patient.name,
-                    "stage": patient.status,
-                    "queuePosition": patient.queue_position,
-                    "totalInQueue": Patient.query.filter_by(
-                        assigned_doctor_id=patient.assigned_doctor_id,
-                        status="Waiting for Doctor"
-                    ).count(),
-                    "estimatedWaitTime": estimated_wait_time,
-                    "assignedDoctor": patient.assigned_doctor.name if patient.assigned_doctor else None,
-                    "prescriptions": prescriptions
-                }
-                
-                yield f"data: {json.dumps(data)}\n\n"
-                last_status = patient.status
-            
-            time.sleep(2)  # Check for updates every 2 seconds
+        return Response(not_found(), mimetype="text/event-stream")
+    
+    subscription = queue_bus.subscribe(patient_topic(unique_id))
     
-    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+    def build():
+        return build_patient_event(unique_id, subscription)
+    
+    return Response(stream_with_context(queue_event_stream(subscription, build)), mimetype="text/event-stream")
 
 # Receptionist routes
 @app.route('/api/receptionist/register', methods=['POST'])
@@ -339,55 +1095,78 @@ def register_patient():
             logger.error(f"Missing required fields: name={patient_name}, doctor_id={doctor_id}")
             return jsonify({"success": False, "error": "Missing required fields"}), 400
         
-        logger.info("Generating unique 4-digit ID...")
-        # Generate unique 4-digit ID directly
-        while True:
-            unique_id = str(random.randint(1000, 9999))
-            existing_patient = Patient.query.filter_by(unique_4digit=unique_id).first()
-            if not existing_patient:
-                logger.info(f"Generated unique ID: {unique_id}")
-                break
-        
-        # Calculate queue position
-        queue_position = Patient.query.filter_by(
-            assigned_doctor_id=doctor_id,
-            status="Waiting for Doctor"
-        ).count() + 1
-        logger.info(f"Queue position: {queue_position}")
-        
-        # Create new patient
-        new_patient = Patient(
-            unique_4digit=unique_id,
-            name=patient_name,
-            contact=patient_contact,
-            assigned_doctor_id=doctor_id,
-            queue_position=queue_position
-        )
-        
-        logger.info("Adding patient to database...")
-        db.session.add(new_patient)
-        db.session.commit()
-        logger.info(f"Patient {patient_name} registered successfully with ID {unique_id}")
+        if doctor_id == 'auto':
+            # The doctor who would see the patient soonest, optionally of the requested specialty
+            load_queue_engine()
+            doctor = queue_engine.least_loaded_doctor(data.get('specialty') or None)
+            if doctor is None:
+                logger.error(f"Cannot auto-assign patient: no active doctor for specialty {data.get('specialty')}")
+                return jsonify({"success": False, "error": "No doctor available"}), 503
+            doctor_id = doctor.id
+            logger.info(f"Auto-assigned doctor {doctor_id}")
         
-        # Log the action
-        log_entry = MutexLog(
-            node_id=node_id,
-            event="PATIENT_REGISTERED",
-            timestamp=logical_clock,
-            target_node=None
-        )
-        db.session.add(log_entry)
-        db.session.commit()
-        logger.info("Mutex log entry created")
+        try:
+            doctor_id = int(doctor_id)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "Invalid doctor ID"}), 400
         
-        doctor = User.query.get(doctor_id)
+        # Only active doctors take patients, as in the doctor list
+        load_queue_engine()
+        if not queue_engine.is_active_doctor(doctor_id):
+            logger.error(f"Cannot register patient: {doctor_id} is not an active doctor")
+            return jsonify({"success": False, "error": "Doctor not found"}), 404
         
+        # Allocation and the queue write are coordinated with the other nodes
+        with critical_section(ID_ALLOCATOR_RESOURCE, doctor_resource(doctor_id)):
+            logger.info("Allocating unique 4-digit ID...")
+            load_patient_id_pool()
+            try:
+                unique_id = patient_id_pool.allocate()
+            except PatientIdPoolExhausted as e:
+                logger.error(f"Cannot register patient: {str(e)}")
+                return jsonify({"success": False, "error": "No patient IDs available, please try again later"}), 503
+            logger.info(f"Allocated unique ID: {unique_id}")
+            
+            # Take the next sequence number in the doctor's queue
+            load_queue_engine()
+            queue_position = queue_engine.next_doctor_position(doctor_id)
+            logger.info(f"Queue sequence: {queue_position}")
+            
+            # Create new patient
+            new_patient = Patient(
+                unique_4digit=unique_id,
+                name=patient_name,
+                contact=patient_contact,
+                assigned_doctor_id=doctor_id,
+                queue_position=queue_position
+            )
+            
+            logger.info("Adding patient to database...")
+            db.session.add(new_patient)
+            try:
+                commit_patient_change(new_patient)
+            except IntegrityError:
+                # Another node holds this ID; leave it marked as taken
+                raise
+            except Exception:
+                patient_id_pool.reclaim(unique_id)
+                raise
+            logger.info(f"Patient {patient_name} registered successfully with ID {unique_id}")
+            
+            # Log the action
+            log_mutex_event("PATIENT_REGISTERED", doctor_resource(doctor_id))
+            
+            queue_bus.publish(patient_topic(unique_id), doctor_topic(doctor_id), WAITING_TOPIC)
+            
         return jsonify({
             "success": True,
             "patientId": unique_id,
-            "doctorName": doctor.name if doctor else "Unknown"
+            "doctorId": doctor_id,
+            "doctorName": queue_engine.staff_name(doctor_id) or "Unknown"
         })
     
+    except MutexTimeout:
+        raise
     except Exception as e:
         db.session.rollback()
         error_message = str(e)
@@ -396,29 +1175,143 @@ def register_patient():
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": error_message}), 500
 
+@app.route('/api/receptionist/register-batch', methods=['POST'])
+def register_patients_batch():
+    """Register a list of patients in one critical section and one transaction.
+
+    Takes {"patients": [{"name", "contact", "doctorId", "specialty"}, ...]}
+    with the fields of /api/receptionist/register, and returns a result per
+    patient in the same order. Invalid entries fail on their own; the valid
+    ones are committed together.
+    """
+    if not current_user.is_authenticated:
+        logger.error("Unauthenticated access attempt to register patients")
+        return jsonify({"success": False, "error": "Please log in first"}), 401
+
+    if current_user.role != 'receptionist':
+        logger.error(f"Unauthorized access attempt by {current_user.username} with role {current_user.role}")
+        return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+    data = request.get_json(silent=True) or {}
+    entries = data.get('patients')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"success": False, "error": "Missing patients"}), 400
+    if len(entries) > app.config['REGISTER_BATCH_MAX']:
+        return jsonify({"success": False,
+                        "error": f"At most {app.config['REGISTER_BATCH_MAX']} patients per batch"}), 400
+
+    load_queue_engine()
+    results = [None] * len(entries)
+    accepted = []  # (index, name, contact, doctor_id)
+    auto = []      # (index, name, contact, specialty)
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('name') or not entry.get('doctorId'):
+            results[index] = {"success": False, "error": "Missing required fields"}
+            continue
+        if entry['doctorId'] == 'auto':
+            auto.append((index, entry['name'], entry.get('contact'), entry.get('specialty') or None))
+            continue
+        try:
+            doctor_id = int(entry['doctorId'])
+        except (TypeError, ValueError):
+            results[index] = {"success": False, "error": "Invalid doctor ID"}
+            continue
+        if not queue_engine.is_active_doctor(doctor_id):
+            results[index] = {"success": False, "error": "Doctor not found"}
+            continue
+        accepted.append((index, entry['name'], entry.get('contact'), doctor_id))
+
+    # Spread the batch over the doctors as if its patients arrived one by one
+    assigned = queue_engine.assign_doctors([specialty for _, _, _, specialty in auto],
+                                           [doctor_id for _, _, _, doctor_id in accepted])
+    for (index, name, contact, specialty), doctor in zip(auto, assigned):
+        if doctor is None:
+            results[index] = {"success": False, "error": "No doctor available"}
+            continue
+        accepted.append((index, name, contact, doctor.id))
+    accepted.sort()
+
+    doctor_ids = sorted({doctor_id for _, _, _, doctor_id in accepted})
+    try:
+        with critical_section(ID_ALLOCATOR_RESOURCE, *[doctor_resource(doctor_id) for doctor_id in doctor_ids]):
+            load_patient_id_pool()
+            next_positions = {}
+            registered = []  # (index, patient)
+            for index, name, contact, doctor_id in accepted:
+                try:
+                    unique_id = patient_id_pool.allocate()
+                except PatientIdPoolExhausted:
+                    results[index] = {"success": False, "error": "No patient IDs available, please try again later"}
+                    continue
+                queue_position = next_positions.get(doctor_id) or queue_engine.next_doctor_position(doctor_id)
+                next_positions[doctor_id] = queue_position + 1
+                registered.append((index, Patient(
+                    unique_4digit=unique_id,
+                    name=name,
+                    contact=contact,
+                    assigned_doctor_id=doctor_id,
+                    queue_position=queue_position,
+                    prescriptions=[]
+                )))
+
+            # The committed rows are expired; read the patients back from their change states
+            states = []
+            if registered:
+                patients = [patient for _, patient in registered]
+                codes = [patient.unique_4digit for patient in patients]
+                db.session.add_all(patients)
+                try:
+                    states = [change["patient"] for change in commit_patient_changes(patients)]
+                except Exception as e:
+                    db.session.rollback()
+                    reclaim_patient_ids(codes, e)
+                    raise
+                
+                for state in states:
+                    log_mutex_event("PATIENT_REGISTERED", doctor_resource(state["doctorId"]))
+                queue_bus.publish(*{patient_topic(code) for code in codes},
+                                  *{doctor_topic(doctor_id) for doctor_id in doctor_ids}, WAITING_TOPIC)
+            logger.info(f"Registered {len(states)} of {len(entries)} patients in a batch")
+        
+        for (index, _), state in zip(registered, states):
+            results[index] = {
+                "success": True,
+                "patientId": state["uniqueId"],
+                "doctorId": state["doctorId"],
+                "doctorName": queue_engine.staff_name(state["doctorId"]) or "Unknown"
+            }
+        return jsonify({"success": True, "registered": len(states), "results": results})
+
+    except MutexTimeout:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        error_message = str(e)
+        logger.error(f"Error registering patients: {error_message}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": error_message}), 500
+
+def reclaim_patient_ids(codes, error):
+    """Return the IDs allocated for a failed registration to the pool. After an
+    IntegrityError the IDs already held by patients replicated from another
+    node stay marked as taken."""
+    held = set()
+    if isinstance(error, IntegrityError):
+        held = {code for code, in db.session.query(Patient.unique_4digit)
+                .filter(Patient.unique_4digit.in_(codes), Patient.status != "Checked Out")}
+    for code in codes:
+        if code not in held:
+            patient_id_pool.reclaim(code)
+
 @app.route('/api/receptionist/doctors')
 @login_required
 def get_doctors():
     if current_user.role != 'receptionist':
         return jsonify({"error": "Unauthorized"}), 403
     
-    doctors = User.query.filter_by(role='doctor', active=True).all()
-    doctor_list = []
-    
-    for doctor in doctors:
-        queue_length = Patient.query.filter_by(
-            assigned_doctor_id=doctor.id,
-            status="Waiting for Doctor"
-        ).count()
-        
-        doctor_list.append({
-            "id": doctor.id,
-            "name": doctor.name,
-            "queueLength": queue_length,
-            "specialty": "General Medicine"  # This would come from an additional field in the User model
-        })
-    
-    return jsonify(doctor_list)
+    specialty = request.args.get('specialty') or None
+    return jsonify(serialize_doctors(specialty))
 
 @app.route('/api/receptionist/waiting-patients')
 @login_required
@@ -426,24 +1319,7 @@ def get_waiting_patients():
     if current_user.role != 'receptionist':
         return jsonify({"error": "Unauthorized"}), 403
     
-    patients = Patient.query.filter(
-        Patient.status.in_(["Waiting for Doctor", "In Consultation"])
-    ).order_by(Patient.registration_time).all()
-    
-    patient_list = []
-    for patient in patients:
-        estimated_wait_time = patient.queue_position * 5
-        
-        patient_list.append({
-            "id": patient.unique_4digit,
-            "name": patient.name,
-            "assignedDoctor": patient.assigned_doctor.name if patient.assigned_doctor else "Unassigned",
-            "queuePosition": patient.queue_position,
-            "estimatedWaitTime": estimated_wait_time,
-            "status": patient.status
-        })
-    
-    return jsonify(patient_list)
+    return conditional_json((queue_bus.version(WAITING_TOPIC),), serialize_waiting_patients)
 
 @app.route('/api/receptionist/waiting-patients/events')
 @login_required
@@ -451,34 +1327,10 @@ def waiting_patients_events():
     if current_user.role != 'receptionist':
         return jsonify({"error": "Unauthorized"}), 403
     
-    def generate():
-        last_data = None
-        while True:
-            patients = Patient.query.filter(
-                Patient.status.in_(["Waiting for Doctor", "In Consultation"])
-            ).order_by(Patient.registration_time).all()
-            
-            patient_list = []
-            for patient in patients:
-                estimated_wait_time = patient.queue_position * 5
-                
-                patient_list.append({
-                    "id": patient.unique_4digit,
-                    "name": patient.name,
-                    "assignedDoctor": patient.assigned_doctor.name if patient.assigned_doctor else "Unassigned",
-                    "queuePosition": patient.queue_position,
-                    "estimatedWaitTime": estimated_wait_time,
-                    "status": patient.status
-                })
-            
-            current_data = json.dumps(patient_list)
-            if current_data != last_data:
-                yield f"data: {current_data}\n\n"
-                last_data = current_data
-            
-            time.sleep(2)
-    
-    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+    subscription = queue_bus.subscribe(WAITING_TOPIC)
+    stream = queue_delta_stream(subscription, WAITING_TOPIC, serialize_waiting_patients,
+                                request.headers.get('Last-Event-ID'))
+    return Response(stream_with_context(stream), mimetype="text/event-stream")
 
 # Doctor routes
 @app.route('/api/doctor/queue')
@@ -487,24 +1339,10 @@ def get_doctor_queue():
     if current_user.role != 'doctor':
         return jsonify({"error": "Unauthorized"}), 403
     
-    patients = Patient.query.filter_by(
-        assigned_doctor_id=current_user.id,
-        status="Waiting for Doctor"
-    ).order_by(Patient.queue_position).all()
-    
-    patient_list = []
-    for patient in patients:
-        wait_time = (datetime.utcnow() - patient.registration_time).total_seconds() // 60
-        
-        patient_list.append({
-            "id": patient.unique_4digit,
-            "name": patient.name,
-            "queuePosition": patient.queue_position,
-            "waitTime": int(wait_time),
-            "contact": patient.contact
-        })
-    
-    return jsonify(patient_list)
+    doctor_id = current_user.id
+    # waitTime ages with the clock, so the ETag also changes every heartbeat interval
+    versions = (doctor_id, queue_bus.version(doctor_topic(doctor_id)), heartbeat_period())
+    return conditional_json(versions, lambda: serialize_doctor_queue(doctor_id))
 
 @app.route('/api/doctor/queue/events')
 @login_required
@@ -512,34 +1350,12 @@ def doctor_queue_events():
     if current_user.role != 'doctor':
         return jsonify({"error": "Unauthorized"}), 403
     
-    def generate():
-        last_data = None
-        while True:
-            patients = Patient.query.filter_by(
-                assigned_doctor_id=current_user.id,
-                status="Waiting for Doctor"
-            ).order_by(Patient.queue_position).all()
-            
-            patient_list = []
-            for patient in patients:
-                wait_time = (datetime.utcnow() - patient.registration_time).total_seconds() // 60
-                
-                patient_list.append({
-                    "id": patient.unique_4digit,
-                    "name": patient.name,
-                    "queuePosition": patient.queue_position,
-                    "waitTime": int(wait_time),
-                    "contact": patient.contact
-                })
-            
-            current_data = json.dumps(patient_list)
-            if current_data != last_data:
-                yield f"data: {current_data}\n\n"
-                last_data = current_data
-            
-            time.sleep(2)
-    
-    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+    doctor_id = current_user.id
+    subscription = queue_bus.subscribe(doctor_topic(doctor_id))
+    # waitTime ages with the clock, so rebuild on heartbeats as well
+    stream = queue_delta_stream(subscription, doctor_topic(doctor_id), lambda: serialize_doctor_queue(doctor_id),
+                                request.headers.get('Last-Event-ID'), refresh_on_heartbeat=True)
+    return Response(stream_with_context(stream), mimetype="text/event-stream")
 
 @app.route('/api/doctor/start-consultation', methods=['POST'])
 @login_required
@@ -553,15 +1369,21 @@ def start_consultation():
     if not patient_id:
         return jsonify({"error": "Missing patient ID"}), 400
     
-    patient = Patient.query.filter_by(unique_4digit=patient_id).first()
-    if not patient:
-        return jsonify({"error": "Patient not found"}), 404
-    
-    if patient.assigned_doctor_id != current_user.id:
-        return jsonify({"error": "Patient not assigned to you"}), 403
-    
-    patient.status = "In Consultation"
-    db.session.commit()
+    with critical_section(doctor_resource(current_user.id)):
+        patient = find_patient(patient_id)
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+        
+        if patient.assigned_doctor_id != current_user.id:
+            return jsonify({"error": "Patient not assigned to you"}), 403
+        
+        if patient.status != "Waiting for Doctor":
+            return jsonify({"error": f"Patient is {patient.status}, not waiting for a doctor"}), 409
+        
+        patient.status = "In Consultation"
+        commit_patient_change(patient)
+        
+        queue_bus.publish(patient_topic(patient_id), doctor_topic(current_user.id), WAITING_TOPIC)
     
     return jsonify({"success": True})
 
@@ -578,39 +1400,36 @@ def complete_consultation():
     if not patient_id:
         return jsonify({"error": "Missing patient ID"}), 400
     
-    patient = Patient.query.filter_by(unique_4digit=patient_id).first()
-    if not patient:
-        return jsonify({"error": "Patient not found"}), 404
-    
-    if patient.assigned_doctor_id != current_user.id:
-        return jsonify({"error": "Patient not assigned to you"}), 403
-    
-    # Update patient status
-    patient.status = "Ready for Pharmacy"
-    
-    # Add prescription if provided
-    if prescription_text:
-        # Simple parsing of prescription text
-        medicines = [med.strip() for med in prescription_text.split(',')]
-        for medicine in medicines:
-            if medicine:
-                prescription = Prescription(patient_id=patient.id, medicine=medicine)
-                db.session.add(prescription)
-    
-    # Update queue positions for remaining patients
-    waiting_patients = Patient.query.filter_by(
-        assigned_doctor_id=current_user.id,
-        status="Waiting for Doctor"
-    ).order_by(Patient.queue_position).all()
-    
-    for i, p in enumerate(waiting_patients):
-        p.queue_position = i + 1
-    
-    # Set pharmacy queue position
-    pharmacy_count = Patient.query.filter_by(status="Ready for Pharmacy").count()
-    patient.queue_position = pharmacy_count + 1
-    
-    db.session.commit()
+    # The patient leaves the doctor's queue and joins the pharmacy queue
+    with critical_section(doctor_resource(current_user.id), PHARMACY_RESOURCE):
+        patient = find_patient(patient_id)
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+        
+        if patient.assigned_doctor_id != current_user.id:
+            return jsonify({"error": "Patient not assigned to you"}), 403
+        
+        if patient.status != "In Consultation":
+            return jsonify({"error": f"Patient is {patient.status}, not in consultation"}), 409
+        
+        # Move the patient to the back of the pharmacy queue; the rest of the
+        # doctor's queue moves up implicitly since positions are ranks
+        load_queue_engine()
+        patient.queue_position = queue_engine.next_pharmacy_position()
+        patient.status = "Ready for Pharmacy"
+        
+        # Add prescription if provided
+        if prescription_text:
+            # Simple parsing of prescription text
+            medicines = [med.strip() for med in prescription_text.split(',')]
+            for medicine in medicines:
+                if medicine:
+                    prescription = Prescription(patient_id=patient.id, medicine=medicine)
+                    db.session.add(prescription)
+        
+        commit_patient_change(patient)
+        
+        queue_bus.publish(patient_topic(patient_id), doctor_topic(current_user.id), PHARMACY_TOPIC, WAITING_TOPIC)
     
     return jsonify({"success": True})
 
@@ -621,22 +1440,7 @@ def get_pharmacy_queue():
     if current_user.role != 'pharmacist':
         return jsonify({"error": "Unauthorized"}), 403
     
-    patients = Patient.query.filter_by(status="Ready for Pharmacy").order_by(Patient.queue_position).all()
-    
-    patient_list = []
-    for patient in patients:
-        prescriptions = [p.medicine for p in patient.prescriptions]
-        prescription_text = ", ".join(prescriptions)
-        
-        patient_list.append({
-            "id": patient.unique_4digit,
-            "name": patient.name,
-            "queuePosition": patient.queue_position,
-            "prescription": prescription_text,
-            "contact": patient.contact
-        })
-    
-    return jsonify(patient_list)
+    return conditional_json((queue_bus.version(PHARMACY_TOPIC),), serialize_pharmacy_queue)
 
 @app.route('/api/pharmacy/queue/events')
 @login_required
@@ -644,32 +1448,10 @@ def pharmacy_queue_events():
     if current_user.role != 'pharmacist':
         return jsonify({"error": "Unauthorized"}), 403
     
-    def generate():
-        last_data = None
-        while True:
-            patients = Patient.query.filter_by(status="Ready for Pharmacy").order_by(Patient.queue_position).all()
-            
-            patient_list = []
-            for patient in patients:
-                prescriptions = [p.medicine for p in patient.prescriptions]
-                prescription_text = ", ".join(prescriptions)
-                
-                patient_list.append({
-                    "id": patient.unique_4digit,
-                    "name": patient.name,
-                    "queuePosition": patient.queue_position,
-                    "prescription": prescription_text,
-                    "contact": patient.contact
-                })
-            
-            current_data = json.dumps(patient_list)
-            if current_data != last_data:
-                yield f"data: {current_data}\n\n"
-                last_data = current_data
-            
-            time.sleep(2)
-    
-    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+    subscription = queue_bus.subscribe(PHARMACY_TOPIC)
+    stream = queue_delta_stream(subscription, PHARMACY_TOPIC, serialize_pharmacy_queue,
+                                request.headers.get('Last-Event-ID'))
+    return Response(stream_with_context(stream), mimetype="text/event-stream")
 
 @app.route('/api/pharmacy/complete', methods=['POST'])
 @login_required
@@ -683,22 +1465,27 @@ def complete_pharmacy():
     if not patient_id:
         return jsonify({"error": "Missing patient ID"}), 400
     
-    patient = Patient.query.filter_by(unique_4digit=patient_id).first()
-    if not patient:
-        return jsonify({"error": "Patient not found"}), 404
-    
-    # Update patient status
-    patient.status = "Checked Out"
-    patient.queue_position = 0
-    
-    # Update queue positions for remaining pharmacy patients
-    pharmacy_patients = Patient.query.filter_by(status="Ready for Pharmacy").order_by(Patient.queue_position).all()
-    
-    for i, p in enumerate(pharmacy_patients):
-        if p.id != patient.id:  # Skip the current patient
-            p.queue_position = i + 1
-    
-    db.session.commit()
+    with critical_section(PHARMACY_RESOURCE):
+        patient = find_patient(patient_id)
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+        
+        # Only patients in the pharmacy queue check out, so no doctor queue changes
+        if patient.status != "Ready for Pharmacy":
+            return jsonify({"error": f"Patient is {patient.status}, not ready for pharmacy"}), 409
+        
+        # Update patient status; the rest of the pharmacy queue moves up implicitly
+        patient.status = "Checked Out"
+        patient.queue_position = 0
+        patient.checkout_time = datetime.utcnow()
+        
+        commit_patient_change(patient)
+        
+        # The ID becomes reusable once the quiet period has passed
+        load_patient_id_pool()
+        patient_id_pool.release(patient_id, patient.checkout_time)
+        
+        queue_bus.publish(patient_topic(patient_id), PHARMACY_TOPIC)
     
     return jsonify({"success": True})
 
@@ -719,7 +1506,8 @@ def get_staff():
             "username": user.username,
             "role": user.role,
             "active": user.active,
-            "node_id": user.node_id
+            "node_id": user.node_id,
+            "specialty": user.specialty
         })
     
     return jsonify(staff_list)
@@ -737,6 +1525,7 @@ def create_staff():
         name = data.get('name')
         role = data.get('role')
         node_id = data.get('node_id') if role == 'receptionist' else None
+        specialty = (data.get('specialty') or None) if role == 'doctor' else None
         
         if not username or not password or not name or not role:
             return jsonify({"success": False, "error": "Missing required fields"}), 400
@@ -747,11 +1536,13 @@ def create_staff():
             return jsonify({"success": False, "error": "Username already exists"}), 400
         
         # Create new user
-        new_user = User(username=username, name=name, role=role, node_id=node_id)
+        new_user = User(username=username, name=name, role=role, node_id=node_id, specialty=specialty)
         new_user.set_password(password)
         
         db.session.add(new_user)
         db.session.commit()
+        user_cache.invalidate(new_user.id)
+        queue_engine.put_staff(staff_record(new_user))
         logger.info(f"Created new staff account: {username} with role {role}")
         
         return jsonify({"success": True})
@@ -768,61 +1559,32 @@ def get_system_stats():
     if current_user.role != 'admin':
         return jsonify({"error": "Unauthorized"}), 403
     
-    # Get total patients today
-    today = datetime.utcnow().date()
-    total_patients_today = Patient.query.filter(
-        db.func.date(Patient.registration_time) == today
-    ).count()
-    
-    # Get active patients
-    active_patients = Patient.query.filter(
-        Patient.status != "Checked Out"
-    ).count()
-    
-    # Calculate average wait time
-    waiting_patients = Patient.query.filter_by(status="Waiting for Doctor").all()
-    wait_times = []
-    for patient in waiting_patients:
-        wait_time = (datetime.utcnow() - patient.registration_time).total_seconds() // 60
-        wait_times.append(wait_time)
-    
-    average_wait_time = int(sum(wait_times) / len(wait_times)) if wait_times else 0
-    
-    # Queue status
-    doctor_queue = Patient.query.filter_by(status="Waiting for Doctor").count()
-    pharmacy_queue = Patient.query.filter_by(status="Ready for Pharmacy").count()
-    
-    doctor_queue_status = "Normal"
-    if doctor_queue > 10:
-        doctor_queue_status = "Overloaded"
-    elif doctor_queue > 5:
-        doctor_queue_status = "Busy"
-    
-    pharmacy_queue_status = "Normal"
-    if pharmacy_queue > 10:
-        pharmacy_queue_status = "Overloaded"
-    elif pharmacy_queue > 5:
-        pharmacy_queue_status = "Busy"
-    
+    return jsonify(serialize_system_stats())
+
+@app.route('/api/admin/service-times')
+@login_required
+def get_service_times():
+    """Measured consultation times per doctor and pharmacy service times, in minutes"""
+    if current_user.role != 'admin':
+        return jsonify({"error": "Unauthorized"}), 403
+
+    def minutes(seconds):
+        return round(seconds / 60, 1) if seconds is not None else None
+
+    def describe(estimate):
+        return {
+            "averageMinutes": minutes(estimate["mean"]),
+            "medianMinutes": minutes(estimate["median"]),
+            "p90Minutes": minutes(estimate["p90"]),
+            "samples": estimate["samples"]
+        }
+
+    load_queue_engine()
+    summary = service_times.summary()
     return jsonify({
-        "totalPatientsToday": total_patients_today,
-        "activePatients": active_patients,
-        "averageWaitTime": average_wait_time,
-        "systemStatus": "Operational",
-        "queues": [
-            {
-                "name": "Doctor Queue",
-                "patientsWaiting": doctor_queue,
-                "averageWaitTime": average_wait_time,
-                "status": doctor_queue_status
-            },
-            {
-                "name": "Pharmacy Queue",
-                "patientsWaiting": pharmacy_queue,
-                "averageWaitTime": 10,  # Placeholder
-                "status": pharmacy_queue_status
-            }
-        ]
+        "doctors": [dict(describe(estimate), id=doctor_id, name=queue_engine.staff_name(doctor_id))
+                    for doctor_id, estimate in sorted(summary["doctors"].items())],
+        "pharmacy": describe(summary["pharmacy"])
     })
 
 @app.route('/api/admin/system-stats/events')
@@ -835,64 +1597,7 @@ def system_stats_events():
         try:
             while True:
                 try:
-                    # Get total patients today
-                    today = datetime.utcnow().date()
-                    total_patients_today = Patient.query.filter(
-                        db.func.date(Patient.registration_time) == today
-                    ).count()
-                    
-                    # Get active patients
-                    active_patients = Patient.query.filter(
-                        Patient.status != "Checked Out"
-                    ).count()
-                    
-                    # Calculate average wait time
-                    waiting_patients = Patient.query.filter_by(status="Waiting for Doctor").all()
-                    wait_times = []
-                    for patient in waiting_patients:
-                        wait_time = (datetime.utcnow() - patient.registration_time).total_seconds() // 60
-                        wait_times.append(wait_time)
-                    
-                    average_wait_time = int(sum(wait_times) / len(wait_times)) if wait_times else 0
-                    
-                    # Queue status
-                    doctor_queue = Patient.query.filter_by(status="Waiting for Doctor").count()
-                    pharmacy_queue = Patient.query.filter_by(status="Ready for Pharmacy").count()
-                    
-                    doctor_queue_status = "Normal"
-                    if doctor_queue > 10:
-                        doctor_queue_status = "Overloaded"
-                    elif doctor_queue > 5:
-                        doctor_queue_status = "Busy"
-                    
-                    pharmacy_queue_status = "Normal"
-                    if pharmacy_queue > 10:
-                        pharmacy_queue_status = "Overloaded"
-                    elif pharmacy_queue > 5:
-                        pharmacy_queue_status = "Busy"
-                    
-                    data = {
-                        "totalPatientsToday": total_patients_today,
-                        "activePatients": active_patients,
-                        "averageWaitTime": average_wait_time,
-                        "systemStatus": "Operational",
-                        "queues": [
-                            {
-                                "name": "Doctor Queue",
-                                "patientsWaiting": doctor_queue,
-                                "averageWaitTime": average_wait_time,
-                                "status": doctor_queue_status
-                            },
-                            {
-                                "name": "Pharmacy Queue",
-                                "patientsWaiting": pharmacy_queue,
-                                "averageWaitTime": 10,  # Placeholder
-                                "status": pharmacy_queue_status
-                            }
-                        ]
-                    }
-                    
-                    yield f"data: {json.dumps(data)}\n\n"
+                    yield f"data: {json.dumps(serialize_system_stats())}\n\n"
                     time.sleep(5)  # Update every 5 seconds
                 except Exception as e:
                     logger.error(f"Error in system stats SSE: {str(e)}")
@@ -905,6 +1610,133 @@ def system_stats_events():
     
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
+@app.route('/api/admin/stream-stats')
+@login_required
+def get_stream_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    events = queue_deltas.stats()
+    views = []
+    for view, (hits, misses) in sorted(snapshot_cache.stats().items()):
+        last_event, buffered = events.get(view, (0, 0))
+        views.append({
+            "view": view,
+            "subscribers": queue_bus.subscriber_count(view),
+            "hits": hits,
+            "misses": misses,
+            "hitRate": round(hits / (hits + misses), 3),
+            "events": last_event,
+            "bufferedEvents": buffered
+        })
+    
+    return jsonify({
+        "subscribers": queue_bus.subscriber_count(),
+        "views": views
+    })
+
+@app.route('/api/admin/user-cache')
+@login_required
+def get_user_cache_stats():
+    """Hit and miss counts of the session user cache"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    stats = user_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    stats["hitRate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    return jsonify(stats)
+
+@app.route('/api/admin/patients/<unique_id>/history')
+@login_required
+def get_patient_history(unique_id):
+    """Lifecycle events of the patient currently holding an ID, oldest first"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    patient = find_patient(unique_id)
+    if not patient:
+        return jsonify({"error": "Patient not found"}), 404
+
+    events = PatientEvent.query.filter_by(patient_id=patient.id).order_by(PatientEvent.id).all()
+    return jsonify([{
+        "id": event.id,
+        "event": event.event_type,
+        "changes": json.loads(event.data),
+        "createdAt": event.created_at.isoformat()
+    } for event in events])
+
+def peer_authorized():
+    """Whether a request carries the shared PEER_TOKEN; without one only a node with no peers accepts it"""
+    token = app.config['PEER_TOKEN']
+    if not token:
+        return not app.config['PEERS']
+    return hmac.compare_digest(request.headers.get('X-Peer-Token', ''), token)
+
+@app.route('/api/mutex/message', methods=['POST'])
+def mutex_message():
+    """Receive a mutual exclusion protocol message from a peer node"""
+    if not peer_authorized():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    message = request.get_json(silent=True)
+    error = distributed_mutex.message_error(message)
+    if error:
+        return jsonify({"error": f"Invalid mutex message: {error}"}), 400
+    
+    distributed_mutex.receive(message)
+    return jsonify({"success": True}), 202
+
+@app.route('/api/replication/changes', methods=['POST'])
+def replication_changes():
+    """Apply patient changes pushed by a peer node"""
+    if not peer_authorized():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    body = request.get_json(silent=True)
+    if not body or body.get('sender') not in app.config['PEERS'] or not isinstance(body.get('changes'), list):
+        return jsonify({"error": "Invalid replication message"}), 400
+    
+    if not apply_remote_changes(body['changes']):
+        # Earlier changes from one of the origins are missing; fetch them
+        replicator.request_sync()
+    return jsonify({"success": True, "applied": change_log.applied()})
+
+@app.route('/api/replication/pull', methods=['POST'])
+def replication_pull():
+    """Hand a peer node the changes past its {origin: last applied sequence}, from every origin"""
+    if not peer_authorized():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    body = request.get_json(silent=True)
+    if not body or body.get('sender') not in app.config['PEERS'] or not isinstance(body.get('applied'), dict):
+        return jsonify({"error": "Invalid replication message"}), 400
+    
+    load_change_log()
+    limit = app.config['REPLICATION_BATCH_SIZE']
+    changes = []
+    more = False
+    for origin in sorted(change_log.applied()):
+        rows = PatientChange.query\
+            .filter(PatientChange.origin_node == origin, PatientChange.sequence > int(body['applied'].get(origin, 0)))\
+            .order_by(PatientChange.sequence).limit(limit - len(changes) + 1).all()
+        if len(changes) + len(rows) > limit:
+            rows = rows[:limit - len(changes)]
+            more = True
+        changes.extend(change_message(row) for row in rows)
+        if more:
+            break
+    
+    return jsonify({"changes": changes, "more": more})
+
+@app.route('/api/admin/mutex-status')
+@login_required
+def get_mutex_status():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify(distributed_mutex.status())
+
 @app.route('/api/admin/mutex-logs')
 @login_required
 def get_mutex_logs():
@@ -913,15 +1745,7 @@ def get_mutex_logs():
     
     try:
         logs = MutexLog.query.order_by(MutexLog.created_at.desc()).limit(100).all()
-        formatted_logs = [{
-            'id': log.id,
-            'node_id': log.node_id,
-            'event': log.event,
-            'timestamp': log.timestamp,
-            'target_node': log.target_node,
-            'created_at': log.created_at.strftime("%H:%M:%S")  # Format as HH:MM:SS
-        } for log in logs]
-        return jsonify(formatted_logs)
+        return jsonify([serialize_mutex_log(log) for log in logs])
     except Exception as e:
         logger.error(f"Error fetching mutex logs: {str(e)}")
         return jsonify({'error': 'Failed to fetch mutex logs'}), 500
@@ -938,24 +1762,13 @@ def mutex_logs_events():
             while True:
                 try:
                     # Get new logs since last check
-                    new_logs = MutexLog.query.filter(MutexLog.id > last_id)\
-                        .order_by(MutexLog.created_at.desc())\
-                        .limit(10).all()
+                    new_logs = fetch_new_mutex_logs(last_id)
                     
                     if new_logs:
                         # Update last_id to the most recent log
-                        last_id = new_logs[0].id
+                        last_id = new_logs[-1]['id']
                         
-                        # Format and yield new logs
-                        for log in reversed(new_logs):  # Send oldest first
-                            log_data = {
-                                'id': log.id,
-                                'node_id': log.node_id,
-                                'event': log.event,
-                                'timestamp': log.timestamp,
-                                'target_node': log.target_node,
-                                'created_at': log.created_at.strftime("%H:%M:%S")
-                            }
+                        for log_data in new_logs:
                             yield f"data: {json.dumps(log_data)}\n\n"
                     
                     time.sleep(1)  # Check every second
@@ -1027,11 +1840,21 @@ def update_staff(staff_id):
         else:
             staff.node_id = None
         
+        # Update specialty if role is doctor
+        if staff.role == 'doctor':
+            staff.specialty = data.get('specialty', staff.specialty) or None
+        else:
+            staff.specialty = None
+        
         # Update password if provided
         if 'password' in data and data['password']:
             staff.set_password(data['password'])
         
         db.session.commit()
+        user_cache.invalidate(staff_id)
+        queue_engine.put_staff(staff_record(staff))
+        # Doctor names are part of the patient status and waiting list views
+        queue_bus.publish(doctor_topic(staff_id), WAITING_TOPIC)
         logger.info(f"Updated staff account: {staff.username}")
         
         return jsonify({"success": True})
@@ -1062,6 +1885,8 @@ def toggle_staff_status(staff_id):
         
         staff.active = not staff.active
         db.session.commit()
+        user_cache.invalidate(staff_id)
+        queue_engine.put_staff(staff_record(staff))
         logger.info(f"Toggled staff status for {staff.username} to {staff.active}")
         
         return jsonify({"success": True})
@@ -1073,7 +1898,8 @@ def toggle_staff_status(staff_id):
 # Initialize database
 @app.before_first_request
 def initialize_database():
-    db.create_all()
+    # Tables created by older versions get the columns and indexes added since
+    upgrade_schema(db.engine, db.metadata, log=logger.info)
     
     # Check if admin user exists
     admin = User.query.filter_by(username='admin').first()
@@ -1101,6 +1927,11 @@ def initialize_database():
         db.session.commit()
         
         logger.info("Created default users")
+    
+    load_queue_engine()
+    load_patient_id_pool()
+    load_change_log()
+    replicator.start(sync_with_peers, app.config['REPLICATION_SYNC_SECONDS'])
 
 @app.route('/debug-info')
 def debug_info():
@@ -1119,7 +1950,9 @@ def debug_info():
     for rule in app.url_map.iter_rules():
         routes.append(f"{rule.endpoint}: {rule}")
     
-    config_items = {k: str(v) for k, v in app.config.items() if k not in ['SECRET_KEY']}
+    # Secrets stay out of the page: PEER_TOKEN authenticates mutex and replication messages
+    config_items = {k: str(v) for k, v in app.config.items() if k not in ['SECRET_KEY', 'PEER_TOKEN']}
+    config_items['SQLALCHEMY_DATABASE_URI'] = redacted_url(app.config['SQLALCHEMY_DATABASE_URI'])
     
     return f'''
     <!DOCTYPE html>
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Batch registration benchmark
+
+Registers patients one request at a time through /api/receptionist/register
+and in batches through /api/receptionist/register-batch, spread over the
+doctors, and reports registrations per second for each. Each run uses a
+fresh database in a temporary directory.
+
+Usage:
+    python benchmarks/bench_batch_registration.py [--patients 500] [--batch-sizes 10,50,500]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def login(hospital, username, password):
+    client = hospital.app.test_client()
+    response = client.post('/login', json={'username': username, 'password': password})
+    assert response.status_code == 200, response.data
+    return client
+
+def run_workload(args):
+    """Runs inside the child process on the database in DATABASE_URL"""
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.INFO)
+    import app as hospital
+    hospital.app.debug = False
+
+    hospital.app.test_client().get('/')  # runs initialize_database
+    admin = login(hospital, 'admin', 'admin123')
+    for i in range(args.doctors):
+        admin.post('/api/admin/create-staff', json={'username': f'bench_doctor_{i}', 'password': 'x',
+                                                    'name': f'Dr. Bench {i}', 'role': 'doctor'})
+    receptionist = login(hospital, 'reception', 'reception123')
+    doctor_ids = [doctor['id'] for doctor in receptionist.get('/api/receptionist/doctors').json]
+    patients = [{'name': f'Patient {i}', 'doctorId': doctor_ids[i % len(doctor_ids)]} for i in range(args.patients)]
+
+    started = time.perf_counter()
+    if args.batch_size == 1:
+        for patient in patients:
+            response = receptionist.post('/api/receptionist/register', json=patient)
+            assert response.status_code == 200, response.data
+    else:
+        for i in range(0, len(patients), args.batch_size):
+            response = receptionist.post('/api/receptionist/register-batch',
+                                         json={'patients': patients[i:i + args.batch_size]})
+            assert response.status_code == 200 and all(result['success'] for result in response.json['results']), \
+                response.data
+    elapsed = time.perf_counter() - started
+    hospital.mutex_log_writer.flush()
+    print(args.patients / elapsed)
+
+def run_batch_size(batch_size, args):
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    env = dict(os.environ, DATABASE_URL=url, PEERS='', REGISTER_BATCH_MAX=str(max(batch_size, 1)))
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--batch-size', str(batch_size),
+               '--patients', str(args.patients), '--doctors', str(args.doctors)]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"batch size {batch_size} failed:\n{result.stderr[-2000:]}")
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare single and batch patient registration throughput')
+    parser.add_argument('--patients', type=int, default=500, help='Patients registered per run (default: 500)')
+    parser.add_argument('--batch-sizes', default='10,50,500',
+                        help='Comma-separated batch sizes to compare with single requests (default: 10,50,500)')
+    parser.add_argument('--doctors', type=int, default=4, help='Extra doctors to spread the patients over (default: 4)')
+    parser.add_argument('--batch-size', type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_workload(args)
+        return
+
+    batch_sizes = [1] + [int(size) for size in args.batch_sizes.split(',')]
+    print(f"{args.patients} patients per run\n")
+    print(f"{'batch size':<12}{'registrations/s':>16}{'speedup':>10}")
+    baseline = None
+    for batch_size in batch_sizes:
+        rate = run_batch_size(batch_size, args)
+        if rate is None:
+            continue
+        baseline = baseline or rate
+        print(f"{batch_size:<12}{rate:>16.1f}{rate / baseline:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Login storm benchmark
+
+Staff poll the queue endpoints while a shift change logs many accounts in
+at once, and the script reports the pollers' latency percentiles and how
+the logins fared, with the password checks in the request threads and in
+the password worker pool (see password_pool.py).
+
+Configurations:
+    inline   PASSWORD_WORKERS=0 and an admission limit above the storm size:
+             every login hashes in its request thread (the behaviour before
+             password_pool.py)
+    pool     the default worker pool and admission queue
+
+Each configuration runs in a fresh process on a fresh database, with the
+verified-login cache disabled so every login hashes.
+
+Usage:
+    python benchmarks/bench_login_storm.py [--logins 100] [--pollers 4] [--workers 1]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGURATIONS = {
+    "inline": {"PASSWORD_WORKERS": "0", "PASSWORD_QUEUE_SIZE": "100000"},
+    "pool": {},
+}
+
+POLL_PATHS = ['/api/receptionist/waiting-patients', '/api/receptionist/doctors']
+
+def login(hospital, username, password):
+    client = hospital.app.test_client()
+    response = client.post('/login', json={'username': username, 'password': password})
+    return client, response.status_code
+
+def percentile(values, p):
+    values = sorted(values) or [0]
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+def run_workload(args):
+    """Runs inside the child process; the password settings come from the environment"""
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.INFO)
+    import app as hospital
+    hospital.app.debug = False
+
+    hospital.app.test_client().get('/')  # runs initialize_database
+    admin, _ = login(hospital, 'admin', 'admin123')
+    for i in range(args.logins):
+        admin.post('/api/admin/create-staff', json={'username': f'bench_staff_{i}', 'password': f'secret{i}',
+                                                    'name': f'Staff {i}', 'role': 'receptionist'})
+    pollers = [login(hospital, 'reception', 'reception123')[0] for _ in range(args.pollers)]
+    login(hospital, 'reception', 'wrong')  # starts the worker pool before measuring
+
+    stop = threading.Event()
+    latencies = []
+    lock = threading.Lock()
+
+    def poller(client):
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.get(POLL_PATHS[i % len(POLL_PATHS)])
+            elapsed = time.perf_counter() - started
+            assert response.status_code == 200, response.status_code
+            with lock:
+                latencies.append(elapsed)
+            i += 1
+            time.sleep(args.poll_interval)
+
+    login_times = []
+    statuses = []
+
+    def staff_login(i):
+        started = time.perf_counter()
+        _, status = login(hospital, f'bench_staff_{i}', f'secret{i}')
+        with lock:
+            login_times.append(time.perf_counter() - started)
+            statuses.append(status)
+
+    poll_threads = [threading.Thread(target=poller, args=(client,)) for client in pollers]
+    for thread in poll_threads:
+        thread.start()
+    time.sleep(1)
+    with lock:
+        baseline = list(latencies)
+        latencies.clear()
+
+    started = time.perf_counter()
+    storm = [threading.Thread(target=staff_login, args=(i,)) for i in range(args.logins)]
+    for thread in storm:
+        thread.start()
+    for thread in storm:
+        thread.join()
+    storm_seconds = time.perf_counter() - started
+    stop.set()
+    for thread in poll_threads:
+        thread.join()
+    hospital.password_verifier.shutdown()
+
+    print(json.dumps({
+        "idle_p99_ms": percentile(baseline, 0.99) * 1000,
+        "poll_p50_ms": percentile(latencies, 0.5) * 1000,
+        "poll_p99_ms": percentile(latencies, 0.99) * 1000,
+        "polls": len(latencies),
+        "storm_seconds": storm_seconds,
+        "login_p99_ms": percentile(login_times, 0.99) * 1000,
+        "logged_in": statuses.count(200),
+        "turned_away": statuses.count(503),
+    }))
+
+def run_configuration(name, args):
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    env = dict(os.environ, DATABASE_URL=url, PEERS='', VERIFIED_LOGIN_TTL_SECONDS='0', **CONFIGURATIONS[name])
+    if name == 'pool' and args.workers is not None:
+        env['PASSWORD_WORKERS'] = str(args.workers)
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--logins', str(args.logins),
+               '--pollers', str(args.pollers), '--poll-interval', str(args.poll_interval)]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"{name} failed:\n{result.stderr[-2000:]}")
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure queue endpoint latency during a login storm')
+    parser.add_argument('--logins', type=int, default=100, help='Accounts logging in at once (default: 100)')
+    parser.add_argument('--pollers', type=int, default=4, help='Threads polling the queues (default: 4)')
+    parser.add_argument('--poll-interval', type=float, default=0.01,
+                        help='Pause between polls of each thread, in seconds (default: 0.01)')
+    parser.add_argument('--workers', type=int, help='PASSWORD_WORKERS for the pool run (default: the app default)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_workload(args)
+        return
+
+    runs = [(name, run_configuration(name, args)) for name in CONFIGURATIONS]
+    print(f"{args.logins} logins at once, {args.pollers} pollers\n")
+    print(f"{'configuration':<14}{'idle p99':>10}{'poll p50':>10}{'poll p99':>10}{'polls':>8}"
+          f"{'storm s':>9}{'login p99':>11}{'ok':>6}{'503':>6}")
+    for name, result in runs:
+        if result is None:
+            print(f"{name:<14}{'(failed to run)':>30}")
+            continue
+        print(f"{name:<14}{result['idle_p99_ms']:>10.1f}{result['poll_p50_ms']:>10.1f}{result['poll_p99_ms']:>10.1f}"
+              f"{result['polls']:>8}{result['storm_seconds']:>9.1f}{result['login_p99_ms']:>11.0f}"
+              f"{result['logged_in']:>6}{result['turned_away']:>6}")
+    print("\nLatencies in ms")
+
+if __name__ == '__main__':
+    main()
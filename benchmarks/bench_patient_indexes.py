@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Patient index benchmark
+
+Builds a patients table with the pre-index schema, fills it with a large
+number of rows, and reports the SQLite query plan and latency of the hot
+queries before and after running migrate_db.migrate() on it.
+
+Usage:
+    python benchmarks/bench_patient_indexes.py [--rows 1000000] [--repeat 20]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+from migrate_db import migrate
+
+# Schema as created before the composite indexes were declared
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    username VARCHAR(80) NOT NULL UNIQUE,
+    password_hash VARCHAR(128) NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    role VARCHAR(20) NOT NULL,
+    node_id VARCHAR(10),
+    active BOOLEAN
+);
+CREATE TABLE patients (
+    id INTEGER NOT NULL PRIMARY KEY,
+    unique_4digit VARCHAR(4) NOT NULL UNIQUE,
+    name VARCHAR(100) NOT NULL,
+    contact VARCHAR(20),
+    status VARCHAR(20),
+    assigned_doctor_id INTEGER REFERENCES users (id),
+    registration_time DATETIME,
+    queue_position INTEGER
+);
+CREATE TABLE prescriptions (
+    id INTEGER NOT NULL PRIMARY KEY,
+    patient_id INTEGER NOT NULL REFERENCES patients (id),
+    medicine VARCHAR(200) NOT NULL,
+    dosage VARCHAR(100),
+    created_at DATETIME
+);
+"""
+
+DOCTORS = 50
+
+# (label, SQL, parameters) as issued by the app's hot paths
+HOT_QUERIES = [
+    ("doctor queue",
+     "SELECT * FROM patients WHERE assigned_doctor_id = ? AND status = ? ORDER BY queue_position",
+     (7, 'Waiting for Doctor')),
+    ("doctor queue length",
+     "SELECT count(*) FROM patients WHERE assigned_doctor_id = ? AND status = ?",
+     (7, 'Waiting for Doctor')),
+    ("pharmacy queue",
+     "SELECT * FROM patients WHERE status = ? ORDER BY queue_position",
+     ('Ready for Pharmacy',)),
+    ("status count",
+     "SELECT count(*) FROM patients WHERE status = ?",
+     ('Waiting for Doctor',)),
+    ("waiting list",
+     "SELECT * FROM patients WHERE status IN (?, ?) ORDER BY registration_time",
+     ('Waiting for Doctor', 'In Consultation')),
+    ("patients today (date())",
+     "SELECT count(*) FROM patients WHERE date(registration_time) = ?",
+     None),
+    ("patients today (range)",
+     "SELECT count(*) FROM patients WHERE registration_time >= ? AND registration_time < ?",
+     None),
+    ("prescriptions of patient",
+     "SELECT * FROM prescriptions WHERE patient_id = ?",
+     (123456,)),
+]
+
+def populate(conn, rows):
+    """Fill the tables; almost everyone is checked out, a few hundred are queued."""
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (id, username, password_hash, name, role, active) VALUES (?, ?, 'x', ?, 'doctor', 1)",
+        [(i, f"doctor{i}", f"Doctor {i}") for i in range(1, DOCTORS + 1)]
+    )
+
+    now = datetime.utcnow()
+    start = now - timedelta(days=365)
+    step = (now - start) / rows
+    rng = random.Random(42)
+
+    def patient_rows():
+        positions = {}
+        for i in range(rows):
+            registered = start + step * i
+            roll = rng.random()
+            if i > rows - 2000 and roll < 0.3:
+                status = 'Waiting for Doctor'
+            elif i > rows - 2000 and roll < 0.35:
+                status = 'In Consultation'
+            elif i > rows - 2000 and roll < 0.45:
+                status = 'Ready for Pharmacy'
+            else:
+                status = 'Checked Out'
+            doctor = rng.randint(1, DOCTORS)
+            position = 0
+            if status != 'Checked Out':
+                key = 'pharmacy' if status == 'Ready for Pharmacy' else doctor
+                positions[key] = positions.get(key, 0) + 1
+                position = positions[key]
+            yield (str(i), f"Patient {i}", None, status, doctor,
+                   registered.strftime('%Y-%m-%d %H:%M:%S.%f'), position)
+
+    conn.executemany(
+        "INSERT INTO patients (unique_4digit, name, contact, status, assigned_doctor_id, registration_time, queue_position) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        patient_rows()
+    )
+    conn.executemany(
+        "INSERT INTO prescriptions (patient_id, medicine) VALUES (?, ?)",
+        ((rng.randint(1, rows), "Paracetamol") for _ in range(rows // 2))
+    )
+    conn.commit()
+
+def run_queries(conn, repeat):
+    today = datetime.utcnow().date()
+    today_start = datetime.combine(today, datetime.min.time())
+    results = []
+    for label, sql, params in HOT_QUERIES:
+        if label == "patients today (date())":
+            params = (today.isoformat(),)
+        elif label == "patients today (range)":
+            params = (today_start.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                      (today_start + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S.%f'))
+
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        results.append((label, plan, timings[len(timings) // 2] * 1000))
+    return results
+
+def print_results(title, results):
+    print(f"\n{title}")
+    print("=" * len(title))
+    for label, plan, median_ms in results:
+        print(f"{label:<28} {median_ms:>10.3f} ms   {' | '.join(plan)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Patient hot queries before and after migration')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of patients (default: 1000000)')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query, median reported (default: 20)')
+    parser.add_argument('--db', help='Database file to use (default: a temporary file)')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_indexes.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    print(f"Populating {args.rows} patients in {db_path}...")
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    populate(conn, args.rows)
+    print(f"Populated in {time.perf_counter() - started:.1f} s")
+
+    before = run_queries(conn, args.repeat)
+    conn.close()
+
+    print("\nRunning migrate_db.migrate()...")
+    started = time.perf_counter()
+    migrate(create_engine(f"sqlite:///{db_path}"))
+    print(f"Migrated in {time.perf_counter() - started:.1f} s")
+
+    # No ANALYZE: the app never runs it, so measure the plans it actually gets
+    conn = sqlite3.connect(db_path)
+    after = run_queries(conn, args.repeat)
+    conn.close()
+
+    print_results("Before migration", before)
+    print_results("After migration", after)
+
+    print("\nSpeedup")
+    print("=======")
+    for (label, _, before_ms), (_, _, after_ms) in zip(before, after):
+        print(f"{label:<28} {before_ms / after_ms if after_ms else float('inf'):>8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Distributed mutex simulation
+
+Runs several nodes in one process, connected by the loopback transport,
+with a few worker threads per node entering the critical section
+repeatedly. Checks that no two workers are ever inside the same resource's
+critical section at the same time and reports messages per entry, the time
+from request to entry, and the synchronization delay (from one node leaving
+to the next one entering).
+
+With --resources above 1 each entry picks one of that many resources at
+random, like writes spread over several doctors' queues; entries on
+different resources run in parallel. --active limits the workers to the
+first few nodes, like a single reception desk registering a burst of
+patients while the other nodes are idle.
+
+Usage:
+    python benchmarks/simulate_mutex.py [--algorithm ricart-agrawala|maekawa|all] [--nodes 3]
+                                        [--active 3] [--workers 2] [--entries 50] [--resources 1]
+                                        [--log-db mutex.db]
+
+With --log-db the protocol events are written to a mutex_logs table, which
+mutex_analysis.py can read (e.g. with --compare to set two runs side by side).
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distributed_mutex import ALGORITHMS, LoopbackTransport, PartitionedMutex
+
+class EventLog:
+    """Collects protocol events in the MutexLog row format"""
+
+    def __init__(self):
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def for_node(self, node_id):
+        def log(event, timestamp, target_node=None, resource=None):
+            with self._lock:
+                self.rows.append((node_id, event, timestamp, target_node, resource, datetime.utcnow()))
+        return log
+
+    def save(self, path):
+        conn = sqlite3.connect(path)
+        conn.execute("DROP TABLE IF EXISTS mutex_logs")
+        conn.execute("CREATE TABLE mutex_logs (id INTEGER PRIMARY KEY, node_id VARCHAR(10) NOT NULL, "
+                     "event VARCHAR(20) NOT NULL, timestamp INTEGER NOT NULL, target_node VARCHAR(10), "
+                     "resource VARCHAR(50), created_at DATETIME NOT NULL)")
+        conn.executemany("INSERT INTO mutex_logs (node_id, event, timestamp, target_node, resource, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         [(node, event, timestamp, target, resource, created_at.strftime('%Y-%m-%d %H:%M:%S.%f'))
+                          for node, event, timestamp, target, resource, created_at in self.rows])
+        conn.commit()
+        conn.close()
+
+def build_nodes(algorithm, count, transport, event_log):
+    node_ids = [f"node_{i}" for i in range(1, count + 1)]
+    nodes = []
+    for node in node_ids:
+        mutex = PartitionedMutex(algorithm, node, node_ids, transport, log=event_log.for_node(node), timeout=30)
+        transport.register(node, mutex)
+        nodes.append(mutex)
+    return nodes
+
+def run(nodes, workers, entries, hold, resources):
+    inside = {resource: [] for resource in resources}
+    last_exit = dict.fromkeys(resources)
+    violations = []
+    delays = []
+    handoffs = []
+    lock = threading.Lock()
+
+    def worker(mutex):
+        for _ in range(entries):
+            resource = random.choice(resources)
+            started = time.perf_counter()
+            with mutex.critical_section(resource):
+                with lock:
+                    entered = time.perf_counter()
+                    delays.append(entered - started)
+                    # Synchronization delay: only when this request was already waiting for the last exit
+                    if last_exit[resource] is not None and started < last_exit[resource]:
+                        handoffs.append(entered - last_exit[resource])
+                    inside[resource].append(mutex.node_id)
+                    if len(inside[resource]) > 1:
+                        violations.append((resource, tuple(inside[resource])))
+                time.sleep(hold)
+                with lock:
+                    inside[resource].remove(mutex.node_id)
+                    last_exit[resource] = time.perf_counter()
+
+    threads = [threading.Thread(target=worker, args=(mutex,)) for mutex in nodes for _ in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, delays, handoffs, violations
+
+def simulate(algorithm, args):
+    transport = LoopbackTransport()
+    event_log = EventLog()
+    nodes = build_nodes(algorithm, args.nodes, transport, event_log)
+    resources = [f"resource_{i}" for i in range(args.resources)]
+    active = nodes[:args.active] if args.active else nodes
+    elapsed, delays, handoffs, violations = run(active, args.workers, args.entries, args.hold, resources)
+    if args.log_db:
+        path = args.log_db
+        if args.algorithm == 'all':
+            root, ext = os.path.splitext(path)
+            path = f"{root}_{algorithm}{ext or '.db'}"
+        event_log.save(path)
+        print(f"Wrote {len(event_log.rows)} events to {path}")
+
+    total_entries = len(delays)
+    messages = sum(transport.sent.values())
+    print(f"{algorithm}: {args.nodes} nodes ({len(active)} active), {args.resources} resources, {total_entries} entries in {elapsed:.2f} s "
+          f"({total_entries / elapsed:.0f}/s)")
+    print(f"  Messages: {messages} ({dict(transport.sent)})")
+    print(f"  Messages per entry: {messages / total_entries:.2f} (2(N-1) = {2 * (args.nodes - 1)})")
+    print(f"  Request to entry: median {statistics.median(delays) * 1000:.2f} ms, "
+          f"max {max(delays) * 1000:.2f} ms")
+    if handoffs:
+        print(f"  Synchronization delay: median {statistics.median(handoffs) * 1000:.2f} ms")
+    if violations:
+        print(f"  Mutual exclusion violated {len(violations)} times, e.g. {violations[0]}")
+    return not violations
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate distributed mutual exclusion over the loopback transport')
+    parser.add_argument('--algorithm', choices=list(ALGORITHMS) + ['all'], default='ricart-agrawala',
+                        help='Algorithm to run (default: ricart-agrawala)')
+    parser.add_argument('--nodes', type=int, default=3, help='Number of nodes (default: 3)')
+    parser.add_argument('--active', type=int, help='Nodes that enter the critical section (default: all)')
+    parser.add_argument('--workers', type=int, default=2, help='Worker threads per node (default: 2)')
+    parser.add_argument('--entries', type=int, default=50, help='Critical section entries per worker (default: 50)')
+    parser.add_argument('--hold', type=float, default=0.001, help='Seconds spent inside (default: 0.001)')
+    parser.add_argument('--resources', type=int, default=1,
+                        help='Independent resources the entries are spread over (default: 1)')
+    parser.add_argument('--log-db', help='Write the protocol events to this SQLite file')
+    args = parser.parse_args()
+
+    algorithms = list(ALGORITHMS) if args.algorithm == 'all' else [args.algorithm]
+    held = [simulate(algorithm, args) for algorithm in algorithms]
+
+    if not all(held):
+        print("\nMutual exclusion violated")
+        sys.exit(1)
+    print("\nMutual exclusion held")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,563 @@
+"""
+Distributed mutual exclusion between hospital nodes.
+
+Two algorithms are available, selected per deployment with
+MUTEX_ALGORITHM:
+
+RicartAgrawalaMutex ("ricart-agrawala"): a node that wants the critical
+section stamps a REQUEST with its Lamport clock and sends it to every peer
+at once, then enters only after all of them have sent a REPLY. A peer
+replies at once unless it holds the critical section or has an older
+outstanding request of its own, in which case the reply is deferred until
+it releases. 2(N-1) messages per entry at most: with the Roucairol-Carvalho
+optimization a node keeps the permission a peer granted until it replies
+to a request of that peer, so a node entering repeatedly while the others
+are idle asks nobody.
+
+MaekawaMutex ("maekawa"): nodes are laid out on a square grid and a node
+only asks its quorum, the nodes in its row and column (about 2*sqrt(N)).
+Any two quorums intersect, and each node votes for one request at a time,
+so two nodes can never both collect their full quorum. Deadlocks between
+overlapping quorums are broken with INQUIRE / RELINQUISH / FAILED: a voter
+whose vote is held by a younger request asks the holder to give it back,
+and the holder does once it knows it cannot win anyway. 3 to 5 messages
+per quorum member per entry.
+
+PartitionedMutex keeps one independent instance of either algorithm per
+resource key (a doctor's queue, the pharmacy queue, the ID allocator), each
+with its own state, clock and deferred replies, so writes to unrelated
+queues do not wait for each other. A write that needs several resources
+takes them in sorted key order, the same on every node, so two such writes
+cannot deadlock.
+
+Messages are plain dicts, delivered one way:
+
+    {"type": "REQUEST", "sender": "node_1", "timestamp": 12, "resource": "pharmacy"}
+    {"type": "REPLY", "sender": "node_2", "timestamp": 15, "request": 12, "resource": "pharmacy"}
+
+Every message but REQUEST echoes the timestamp of the request it concerns,
+so messages about a request that already timed out are recognized as stale.
+Both algorithms log the same MutexLog events (REQUEST, REPLY for a
+permission or vote, RECEIVED_REPLY, DEFER, CRITICAL_SECTION, RELEASE), with
+the target node set on every message sent; Maekawa adds FAILED, INQUIRE and
+RELINQUISH.
+
+Transports:
+
+    HttpTransport      POSTs messages to /api/mutex/message on the peer nodes
+    LoopbackTransport  delivers to mutex instances in the same process, for
+                       running several nodes on one machine without a network
+"""
+
+import functools
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+RELEASED = "RELEASED"
+WANTED = "WANTED"
+HELD = "HELD"
+
+
+class MutexTimeout(Exception):
+    """Raised when the critical section could not be entered in time."""
+
+
+def parse_peers(value):
+    """Parse "node_2=http://host:5001,node_3=http://host:5002" into {node_id: url}"""
+    peers = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        peer, _, url = item.partition('=')
+        peers[peer.strip()] = url.strip().rstrip('/')
+    return peers
+
+
+class Transport:
+    """Delivers protocol messages to peer nodes without waiting for an answer."""
+
+    def send(self, peer, message):
+        raise NotImplementedError
+
+
+class HttpTransport(Transport):
+    def __init__(self, peer_urls, token=None, timeout=5, workers=8):
+        self.peer_urls = dict(peer_urls)
+        self.token = token
+        self.timeout = timeout
+        # Sends to all peers go out in parallel
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mutex-transport')
+
+    def send(self, peer, message):
+        self._executor.submit(self._post, peer, message)
+
+    def _post(self, peer, message):
+        url = f"{self.peer_urls[peer]}/api/mutex/message"
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['X-Peer-Token'] = self.token
+        http_request = urllib.request.Request(url, data=json.dumps(message).encode(), headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+                response.read()
+        except Exception as e:
+            logger.error(f"Failed to send {message['type']} to {peer} at {url}: {str(e)}")
+
+
+class LoopbackTransport(Transport):
+    """In-process delivery between mutex instances registered on the same transport.
+
+    Messages are handed over on a thread pool, as they would arrive on a
+    server thread, so a sender never runs the receiver's handler itself.
+    """
+
+    def __init__(self, workers=16):
+        self._nodes = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mutex-loopback')
+        self.sent = Counter()  # message type -> number sent
+
+    def register(self, node_id, mutex):
+        self._nodes[node_id] = mutex
+
+    def send(self, peer, message):
+        self.sent[message['type']] += 1
+        self._executor.submit(self._deliver, peer, message)
+
+    def _deliver(self, peer, message):
+        try:
+            self._nodes[peer].receive(message)
+        except Exception as e:
+            logger.error(f"Failed to deliver {message['type']} to {peer}: {str(e)}")
+
+
+def grid_quorum(node_id, nodes):
+    """Nodes in the same row or column as node_id on a ceil(sqrt(N)) wide grid"""
+    nodes = sorted(set(nodes))
+    width = math.ceil(math.sqrt(len(nodes)))
+    row, column = divmod(nodes.index(node_id), width)
+    return tuple(node for index, node in enumerate(nodes)
+                 if index // width == row or index % width == column)
+
+
+class DistributedMutex:
+    """State and plumbing shared by the mutual exclusion algorithms."""
+
+    MESSAGE_TYPES = ()
+
+    def __init__(self, node_id, peers, transport, log=None, timeout=10.0, resource=None):
+        """log(event, timestamp, target_node, resource=...) records protocol events, e.g. as MutexLog rows."""
+        self.node_id = node_id
+        self.peers = tuple(peer for peer in peers if peer != node_id)
+        self.transport = transport
+        self.timeout = timeout
+        self.resource = resource
+        self._log = functools.partial(log or (lambda event, timestamp, target_node=None, resource=None: None),
+                                      resource=resource)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._local = threading.Lock()  # one thread of this node in the protocol at a time
+        self.clock = 0
+        self.state = RELEASED
+        self._request_timestamp = None
+
+    def tick(self):
+        """Advance the Lamport clock for a local event and return it"""
+        with self._lock:
+            self.clock += 1
+            return self.clock
+
+    @contextmanager
+    def critical_section(self, timeout=None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _enter_local(self, timeout):
+        if not self._local.acquire(timeout=timeout):
+            raise MutexTimeout(f"{self.node_id} is busy with another critical section")
+
+    def _wait_for_grant(self, granted, waiting_on, timeout, deadline):
+        """Wait until granted() holds and enter HELD, or withdraw the request and raise MutexTimeout"""
+        with self._lock:
+            if self._changed.wait_for(granted, max(deadline - time.monotonic(), 0)):
+                self.state = HELD
+                self.clock += 1
+                self._log("CRITICAL_SECTION", self.clock)
+                return
+            missing = sorted(waiting_on())
+
+        # Give up the request; anyone held up by it is answered now
+        self.release()
+        raise MutexTimeout(f"No reply from {', '.join(missing)} within {timeout:g}s")
+
+    def _message(self, message_type, request_timestamp=None):
+        message = {"type": message_type, "sender": self.node_id, "timestamp": self.clock}
+        if request_timestamp is not None:
+            message["request"] = request_timestamp
+        if self.resource is not None:
+            message["resource"] = self.resource
+        return message
+
+    def _dispatch(self, outbox):
+        """Send (peer, message) pairs; messages to this node are handled in place"""
+        for peer, message in outbox:
+            if peer == self.node_id:
+                self.receive(message)
+            else:
+                self.transport.send(peer, message)
+
+
+class RicartAgrawalaMutex(DistributedMutex):
+    MESSAGE_TYPES = ("REQUEST", "REPLY")
+
+    def __init__(self, node_id, peers, transport, log=None, timeout=10.0, resource=None):
+        super().__init__(node_id, peers, transport, log, timeout, resource)
+        # Peers whose REPLY we hold and have not answered a REQUEST of since
+        # (Roucairol-Carvalho); we can enter again without asking them
+        self._permissions = set()
+        self._deferred = []  # (peer, request timestamp)
+
+    def acquire(self, timeout=None):
+        """Block until every peer has granted permission, or raise MutexTimeout"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        self._enter_local(timeout)
+
+        with self._lock:
+            self.state = WANTED
+            self.clock += 1
+            self._request_timestamp = self.clock
+            request = self._message("REQUEST")
+            asked = [peer for peer in self.peers if peer not in self._permissions]
+            for peer in asked or (None,):
+                self._log("REQUEST", self._request_timestamp, peer)
+
+        self._dispatch((peer, request) for peer in asked)
+        self._wait_for_grant(lambda: self._permissions.issuperset(self.peers),
+                             lambda: set(self.peers) - self._permissions, timeout, deadline)
+
+    def release(self):
+        with self._lock:
+            self.state = RELEASED
+            self.clock += 1
+            self._log("RELEASE", self.clock)
+            replies = []
+            for peer, request_timestamp in self._deferred:
+                self.clock += 1
+                self._log("REPLY", self.clock, peer)
+                self._permissions.discard(peer)
+                replies.append((peer, self._message("REPLY", request_timestamp)))
+            self._deferred = []
+        self._local.release()
+        self._dispatch(replies)
+
+    def receive(self, message):
+        """Handle a REQUEST or REPLY from a peer"""
+        sender = message["sender"]
+        with self._lock:
+            self.clock = max(self.clock, message["timestamp"]) + 1
+
+            if message["type"] == "REPLY":
+                if self.state == WANTED and message.get("request") == self._request_timestamp:
+                    self._permissions.add(sender)
+                    self._log("RECEIVED_REPLY", self.clock, sender)
+                    self._changed.notify_all()
+                return
+
+            request_timestamp = message["timestamp"]
+            if self.state == HELD or (self.state == WANTED and
+                                      (self._request_timestamp, self.node_id) < (request_timestamp, sender)):
+                self._deferred.append((sender, request_timestamp))
+                self._log("DEFER", self.clock, sender)
+                return
+            self._log("REPLY", self.clock, sender)
+            outbox = [(sender, self._message("REPLY", request_timestamp))]
+            if self.state == WANTED and sender in self._permissions:
+                # The older request wins the permission we were going to reuse; ask for it back
+                self._log("REQUEST", self._request_timestamp, sender)
+                outbox.append((sender, dict(self._message("REQUEST"), timestamp=self._request_timestamp)))
+            self._permissions.discard(sender)
+
+        self._dispatch(outbox)
+
+    def status(self):
+        with self._lock:
+            return {
+                "algorithm": "ricart-agrawala",
+                "node_id": self.node_id,
+                "resource": self.resource,
+                "state": self.state,
+                "clock": self.clock,
+                "peers": list(self.peers),
+                "permissions": sorted(self._permissions),
+                "deferred": [peer for peer, _ in self._deferred]
+            }
+
+
+class MaekawaMutex(DistributedMutex):
+    MESSAGE_TYPES = ("REQUEST", "REPLY", "FAILED", "INQUIRE", "RELINQUISH", "RELEASE")
+
+    def __init__(self, node_id, peers, transport, log=None, timeout=10.0, resource=None):
+        super().__init__(node_id, peers, transport, log, timeout, resource)
+        self.quorum = grid_quorum(node_id, (node_id,) + self.peers)
+        # As a requester
+        self._granted = set()    # quorum members whose vote we hold
+        self._failed = False     # a voter told us an older request goes first
+        self._inquiries = set()  # voters that asked for their vote back
+        # As a voter; requests are (timestamp, node), smaller is older and wins
+        self._vote = None        # request holding this node's vote
+        self._inquired = False   # INQUIRE sent to the current vote holder
+        self._waiting = []       # heap of requests waiting for the vote
+        self._failed_sent = set()
+
+    def acquire(self, timeout=None):
+        """Block until every quorum member has voted for us, or raise MutexTimeout"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        self._enter_local(timeout)
+
+        with self._lock:
+            self.state = WANTED
+            self.clock += 1
+            self._request_timestamp = self.clock
+            self._granted = set()
+            self._failed = False
+            self._inquiries = set()
+            request = self._message("REQUEST")
+            for member in self._others(self.quorum) or (None,):
+                self._log("REQUEST", self._request_timestamp, member)
+
+        self._dispatch((member, request) for member in self.quorum)
+        self._wait_for_grant(lambda: self._granted.issuperset(self.quorum),
+                             lambda: set(self.quorum) - self._granted, timeout, deadline)
+
+    def release(self):
+        """Leave the critical section, or withdraw a request, and free the votes"""
+        with self._lock:
+            self.state = RELEASED
+            self.clock += 1
+            self._log("RELEASE", self.clock)
+            outbox = []
+            for member in self.quorum:
+                if member != self.node_id:
+                    self._log("RELEASE", self.clock, member)
+                outbox.append((member, self._message("RELEASE", self._request_timestamp)))
+        self._local.release()
+        self._dispatch(outbox)
+
+    def receive(self, message):
+        """Handle a message from a quorum member or a node whose quorum includes us"""
+        with self._lock:
+            self.clock = max(self.clock, message["timestamp"]) + 1
+            handler = getattr(self, f"_on_{message['type'].lower()}")
+            outbox = handler(message["sender"], message)
+        self._dispatch(outbox)
+
+    def status(self):
+        with self._lock:
+            return {
+                "algorithm": "maekawa",
+                "node_id": self.node_id,
+                "resource": self.resource,
+                "state": self.state,
+                "clock": self.clock,
+                "quorum": list(self.quorum),
+                "vote": self._vote[1] if self._vote else None,
+                "waiting": [node for _, node in sorted(self._waiting)]
+            }
+
+    # Requester side; each handler returns the messages to send
+
+    def _on_reply(self, voter, message):
+        if self.state != WANTED or message["request"] != self._request_timestamp:
+            # Vote for a request we already gave up; hand it straight back
+            return [self._send("RELEASE", voter, message["request"])]
+        self._granted.add(voter)
+        self._log_received("RECEIVED_REPLY", voter)
+        if self._failed and voter in self._inquiries:
+            # The voter's INQUIRE overtook its vote
+            return [self._relinquish(voter)]
+        self._changed.notify_all()
+        return []
+
+    def _on_failed(self, voter, message):
+        if self.state != WANTED or message["request"] != self._request_timestamp:
+            return []
+        self._failed = True
+        return [self._relinquish(inquirer) for inquirer in self._inquiries & self._granted]
+
+    def _on_inquire(self, voter, message):
+        if self.state != WANTED or message["request"] != self._request_timestamp:
+            return []  # Already inside; the vote comes back with our RELEASE
+        self._inquiries.add(voter)
+        if self._failed and voter in self._granted:
+            return [self._relinquish(voter)]
+        return []
+
+    def _relinquish(self, voter):
+        self._granted.discard(voter)
+        self._inquiries.discard(voter)
+        return self._send("RELINQUISH", voter, self._request_timestamp)
+
+    # Voter side
+
+    def _on_request(self, requester, message):
+        request = (message["timestamp"], requester)
+        if self._vote is None:
+            return [self._grant(request)]
+        heapq.heappush(self._waiting, request)
+        self._log_received("DEFER", requester)
+        return self._resolve_contention()
+
+    def _on_relinquish(self, requester, message):
+        if self._vote != (message["request"], requester):
+            return []
+        heapq.heappush(self._waiting, self._vote)
+        return [self._grant(heapq.heappop(self._waiting))]
+
+    def _on_release(self, requester, message):
+        request = (message["request"], requester)
+        if self._vote == request:
+            self._vote = None
+        elif request in self._waiting:
+            self._waiting.remove(request)
+            heapq.heapify(self._waiting)
+        self._failed_sent.discard(request)
+        if self._vote is None and self._waiting:
+            return [self._grant(heapq.heappop(self._waiting))]
+        return []
+
+    def _grant(self, request):
+        self._vote = request
+        self._inquired = False
+        self._failed_sent.discard(request)
+        return self._send("REPLY", request[1], request[0])
+
+    def _resolve_contention(self):
+        """Ask the vote holder to step aside for an older request, and tell every
+        other waiting request that it cannot win this vote yet"""
+        outbox = []
+        oldest = self._waiting[0]
+        for request in self._waiting:
+            if request == oldest and oldest < self._vote:
+                if not self._inquired:
+                    self._inquired = True
+                    outbox.append(self._send("INQUIRE", self._vote[1], self._vote[0]))
+            elif request not in self._failed_sent:
+                self._failed_sent.add(request)
+                outbox.append(self._send("FAILED", request[1], request[0]))
+        return outbox
+
+    def _send(self, message_type, target, request_timestamp):
+        if target != self.node_id:
+            self._log(message_type, self.clock, target)
+        return target, self._message(message_type, request_timestamp)
+
+    def _log_received(self, event, sender):
+        if sender != self.node_id:
+            self._log(event, self.clock, sender)
+
+    def _others(self, nodes):
+        return tuple(node for node in nodes if node != self.node_id)
+
+
+ALGORITHMS = {
+    "ricart-agrawala": RicartAgrawalaMutex,
+    "maekawa": MaekawaMutex,
+}
+
+
+def mutex_class(algorithm):
+    try:
+        return ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError(f"Unknown mutex algorithm {algorithm!r}, expected one of {', '.join(ALGORITHMS)}")
+
+
+def create_mutex(algorithm, node_id, peers, transport, log=None, timeout=10.0, resource=None):
+    return mutex_class(algorithm)(node_id, peers, transport, log=log, timeout=timeout, resource=resource)
+
+
+class PartitionedMutex:
+    """One independent mutex per resource key, created on first use by a local
+    write or by a message from a peer."""
+
+    def __init__(self, algorithm, node_id, peers, transport, log=None, timeout=10.0):
+        self.algorithm = algorithm
+        self.MESSAGE_TYPES = mutex_class(algorithm).MESSAGE_TYPES
+        self.node_id = node_id
+        self.peers = tuple(peer for peer in peers if peer != node_id)
+        self.timeout = timeout
+        self._create = functools.partial(create_mutex, algorithm, node_id, peers, transport, log=log, timeout=timeout)
+        self._mutexes = {}
+        self._lock = threading.Lock()
+
+    def mutex(self, resource):
+        with self._lock:
+            mutex = self._mutexes.get(resource)
+            if mutex is None:
+                mutex = self._mutexes[resource] = self._create(resource=resource)
+            return mutex
+
+    def tick(self, resource):
+        """Advance the resource's Lamport clock for a local event and return it"""
+        return self.mutex(resource).tick()
+
+    @contextmanager
+    def critical_section(self, *resources, timeout=None):
+        """Hold the critical sections of all the given resources, taken in sorted order"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        held = []
+        try:
+            for resource in sorted(set(resources)):
+                mutex = self.mutex(resource)
+                mutex.acquire(max(deadline - time.monotonic(), 0))
+                held.append(mutex)
+            yield
+        finally:
+            for mutex in reversed(held):
+                mutex.release()
+
+    def message_error(self, message):
+        """Why a message from a peer cannot be handled, or None if it is well formed"""
+        if not isinstance(message, dict):
+            return "not an object"
+        if message.get("type") not in self.MESSAGE_TYPES:
+            return f"unknown type {message.get('type')!r}"
+        if message.get("sender") not in self.peers:
+            return f"unknown sender {message.get('sender')!r}"
+        if not isinstance(message.get("resource"), str):
+            return "missing resource"
+        fields = ("timestamp",) if message["type"] == "REQUEST" else ("timestamp", "request")
+        for field in fields:
+            value = message.get(field)
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                return f"missing or invalid {field}"
+        return None
+
+    def receive(self, message):
+        self.mutex(message["resource"]).receive(message)
+
+    def status(self):
+        with self._lock:
+            mutexes = sorted(self._mutexes.items())
+        return {
+            "algorithm": self.algorithm,
+            "node_id": self.node_id,
+            "peers": list(self.peers),
+            "resources": {resource: mutex.status() for resource, mutex in mutexes}
+        }
@@ -0,0 +1,55 @@
+"""
+Index of the active doctors by predicted completion time.
+
+A patient assigned to a doctor now would be done after everyone in that
+doctor's queue, themselves included, has been seen:
+
+    (patients in the queue + 1) x the doctor's expected consultation time
+
+The index keeps a min-heap of that load for all doctors and one per
+specialty, so the least loaded doctor is found in O(log D) for D doctors.
+Updates push a new entry instead of moving the old one; entries left
+behind by later updates are skipped when they reach the top, and a heap
+is rebuilt once stale entries outnumber the live ones.
+"""
+
+import heapq
+
+
+class DoctorLoadIndex:
+    def __init__(self):
+        self._current = {}  # doctor id -> (version, load, groups)
+        self._heaps = {}    # group: None for every doctor, or a lower-cased specialty -> [(load, doctor id, version)]
+        self._version = 0
+
+    def set(self, doctor_id, load, groups):
+        """Record a doctor's load; groups are the heaps the doctor belongs to"""
+        self._version += 1
+        self._current[doctor_id] = (self._version, load, frozenset(groups))
+        for group in groups:
+            heap = self._heaps.setdefault(group, [])
+            heapq.heappush(heap, (load, doctor_id, self._version))
+            if len(heap) > 2 * len(self._current) + 16:
+                self._rebuild(group)
+
+    def discard(self, doctor_id):
+        """Stop assigning to a doctor, e.g. one who was deactivated"""
+        self._current.pop(doctor_id, None)
+
+    def least_loaded(self, group=None):
+        """(doctor id, load) of the least loaded doctor of a group, or None if it has none.
+        Ties go to the lowest doctor id."""
+        heap = self._heaps.get(group)
+        while heap:
+            load, doctor_id, version = heap[0]
+            current = self._current.get(doctor_id)
+            if current is not None and current[0] == version:
+                return doctor_id, load
+            heapq.heappop(heap)
+        return None
+
+    def _rebuild(self, group):
+        heap = [(load, doctor_id, version) for doctor_id, (version, load, groups) in self._current.items()
+                if group in groups]
+        heapq.heapify(heap)
+        self._heaps[group] = heap
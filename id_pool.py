@@ -0,0 +1,132 @@
+"""
+Pre-allocated pool of 4-digit patient IDs.
+
+Free codes are kept in a free-list with an index of their positions, so
+allocation pops a random slot in O(1) (IDs stay unpredictable) and a code
+taken by another node is removed in O(1) too. Codes of checked-out patients
+go into a cooling heap keyed by when their quiet period ends, and only
+return to the free-list after it, so a patient who just left never sees
+their code handed to someone else while they might still look it up.
+Checkouts may arrive out of order, e.g. replicated from a peer.
+"""
+
+import heapq
+import random
+import threading
+from datetime import datetime, timedelta
+
+MIN_PATIENT_ID = 1000
+MAX_PATIENT_ID = 9999
+
+
+class PatientIdPoolExhausted(Exception):
+    """Raised when every patient ID is in use or still cooling down."""
+
+
+class PatientIdPool:
+    def __init__(self, quiet_period=timedelta(hours=24), low=MIN_PATIENT_ID, high=MAX_PATIENT_ID):
+        self.quiet_period = quiet_period
+        self._low = low
+        self._high = high
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._random = random.SystemRandom()
+        self._free = []           # free codes in any order
+        self._positions = {}      # code -> index in _free
+        self._cooling = []        # heap of (available_at, code); entries not in _cooling_codes are stale
+        self._cooling_codes = {}  # code -> available_at
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, in_use, released):
+        """Rebuild the pool.
+
+        in_use: codes held by patients who have not checked out.
+        released: (code, checkout_time) for checked-out patients whose quiet
+        period may not have elapsed yet.
+        """
+        with self._lock:
+            in_use = set(in_use)
+            self._cooling_codes = {}
+            for code, checkout_time in released:
+                if code not in in_use:
+                    available_at = checkout_time + self.quiet_period
+                    self._cooling_codes[code] = max(available_at, self._cooling_codes.get(code, available_at))
+            self._cooling = [(available_at, code) for code, available_at in self._cooling_codes.items()]
+            heapq.heapify(self._cooling)
+            unavailable = in_use | set(self._cooling_codes)
+            self._free = [str(code) for code in range(self._low, self._high + 1) if str(code) not in unavailable]
+            self._positions = {code: index for index, code in enumerate(self._free)}
+            self._loaded = True
+
+    def load_once(self, loader):
+        """Load from loader() -> (in_use, released) unless already loaded"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.load(*loader())
+
+    def allocate(self):
+        """Hand out a random free code in O(1), or raise PatientIdPoolExhausted"""
+        with self._lock:
+            self._recycle(datetime.utcnow())
+            if not self._free:
+                raise PatientIdPoolExhausted(
+                    f"All {self._high - self._low + 1} patient IDs are in use or cooling down")
+            code = self._free[self._random.randrange(len(self._free))]
+            self._remove_free(code)
+            return code
+
+    def release(self, code, checkout_time=None):
+        """Start the quiet period for the code of a checked-out patient"""
+        available_at = (checkout_time or datetime.utcnow()) + self.quiet_period
+        with self._lock:
+            self._remove_free(code)
+            # A later checkout of the same code extends its quiet period; an earlier one arriving late does not
+            current = self._cooling_codes.get(code)
+            if current is None or available_at > current:
+                self._cooling_codes[code] = available_at
+                heapq.heappush(self._cooling, (available_at, code))
+
+    def take(self, code):
+        """Mark a code allocated elsewhere, e.g. by a patient registered on a peer node, as in use"""
+        with self._lock:
+            self._remove_free(code)
+            self._cooling_codes.pop(code, None)
+
+    def reclaim(self, code):
+        """Return a code that was allocated but never assigned to a patient"""
+        with self._lock:
+            if code not in self._cooling_codes:
+                self._put_free(code)
+
+    def available(self):
+        with self._lock:
+            self._recycle(datetime.utcnow())
+            return len(self._free)
+
+    def _recycle(self, now):
+        while self._cooling and self._cooling[0][0] <= now:
+            available_at, code = heapq.heappop(self._cooling)
+            if self._cooling_codes.get(code) == available_at:
+                del self._cooling_codes[code]
+                self._put_free(code)
+
+    def _put_free(self, code):
+        if code not in self._positions:
+            self._positions[code] = len(self._free)
+            self._free.append(code)
+
+    def _remove_free(self, code):
+        """Swap the code with the last free one and pop it"""
+        index = self._positions.pop(code, None)
+        if index is None:
+            return
+        last = self._free.pop()
+        if last != code:
+            self._free[index] = last
+            self._positions[last] = index
@@ -1,4 +1,5 @@
 from app import app, db, User
+from migrate_db import migrate
 import os
 
 def init_db():
@@ -15,6 +16,9 @@ def init_db():
         print("Creating database tables...")
         db.create_all()
         
+        # Bring tables created by older versions up to date
+        migrate()
+        
         # Check if admin user already exists
         if User.query.filter_by(username='admin').first() is None:
             print("Adding default users...")
@@ -0,0 +1,117 @@
+from sqlalchemy import inspect, MetaData, UniqueConstraint
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+def add_missing_columns(engine, table):
+    """Add columns declared on the model but missing from an existing table."""
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}")
+        added.append(column.name)
+    return added
+
+def add_missing_indexes(engine, table):
+    """Create indexes declared on the model but missing from an existing table."""
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+    added = []
+    for index in sorted(table.indexes, key=lambda i: i.name):
+        if index.name in existing:
+            continue
+        index.create(bind=engine)
+        added.append(index.name)
+    return added
+
+def model_unique_column_sets(table):
+    unique = {frozenset([column.name]) for column in table.columns if column.unique}
+    unique |= {frozenset(column.name for column in constraint.columns)
+               for constraint in table.constraints if isinstance(constraint, UniqueConstraint)}
+    return unique
+
+def database_unique_constraints(engine, table):
+    if engine.dialect.name != 'sqlite':
+        return inspect(engine).get_unique_constraints(table.name)
+    
+    # The inspector misses column-level UNIQUE clauses on SQLite; the backing
+    # autoindexes list every unique constraint
+    constraints = []
+    with engine.connect() as conn:
+        for index in conn.exec_driver_sql(f"PRAGMA index_list({table.name})").mappings():
+            if index['origin'] != 'u':
+                continue
+            columns = [row['name'] for row in conn.exec_driver_sql(f"PRAGMA index_info({index['name']})").mappings()]
+            constraints.append({'name': None, 'column_names': columns})
+    return constraints
+
+def drop_stale_unique_constraints(engine, table):
+    """Drop unique constraints the database has but the model no longer declares."""
+    stale = [constraint for constraint in database_unique_constraints(engine, table)
+             if frozenset(constraint['column_names']) not in model_unique_column_sets(table)]
+    if not stale:
+        return []
+    
+    if engine.dialect.name == 'sqlite':
+        rebuild_sqlite_table(engine, table)
+    else:
+        with engine.begin() as conn:
+            for constraint in stale:
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} DROP CONSTRAINT {constraint['name']}")
+    return [', '.join(constraint['column_names']) for constraint in stale]
+
+def rebuild_sqlite_table(engine, table):
+    """Recreate a table from the model and copy its rows over.
+
+    SQLite cannot drop constraints in place; this follows its documented
+    procedure of building a new table, copying, dropping and renaming.
+    Indexes are recreated afterwards by add_missing_indexes.
+    """
+    # Copy the other tables along so foreign keys of the new table resolve
+    metadata = MetaData()
+    for other in table.metadata.sorted_tables:
+        if other is not table:
+            other.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f"_{table.name}_new")
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    columns = ', '.join(column.name for column in table.columns if column.name in existing)
+    
+    with engine.begin() as conn:
+        conn.exec_driver_sql(str(CreateTable(new_table).compile(dialect=engine.dialect)))
+        conn.exec_driver_sql(f"INSERT INTO {new_table.name} ({columns}) SELECT {columns} FROM {table.name}")
+        conn.exec_driver_sql(f"DROP TABLE {table.name}")
+        conn.exec_driver_sql(f"ALTER TABLE {new_table.name} RENAME TO {table.name}")
+
+def upgrade_schema(engine, metadata, log=print):
+    """Bring an existing database up to the models in metadata without touching data.
+
+    Missing tables are created, missing columns and indexes are added to
+    existing tables, and unique constraints the models dropped are removed.
+    Safe to run repeatedly.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            log(f"Creating table {table.name}...")
+            table.create(bind=engine)
+            continue
+        
+        for column in add_missing_columns(engine, table):
+            log(f"Added column {table.name}.{column}")
+        for columns in drop_stale_unique_constraints(engine, table):
+            log(f"Dropped unique constraint on {table.name} ({columns})")
+        for index in add_missing_indexes(engine, table):
+            log(f"Added index {index} on {table.name}")
+
+def migrate(engine=None):
+    """upgrade_schema() for the app's database, or the given engine"""
+    # Imported here so app.py can run upgrade_schema() at startup
+    from app import app, db
+    with app.app_context():
+        upgrade_schema(engine if engine is not None else db.engine, db.metadata)
+
+if __name__ == "__main__":
+    print("Migrating database...")
+    migrate()
+    print("Database migration complete.")
@@ -19,6 +19,9 @@ from collections import defaultdict
 # Default database path
 DEFAULT_DB_PATH = 'hospital_queue.db'
 
+# Events logged by the sender of a protocol message (with target_node set)
+MESSAGE_EVENTS = ['REQUEST', 'REPLY', 'RELEASE', 'FAILED', 'INQUIRE', 'RELINQUISH']
+
 def connect_to_db(db_path):
     """Connect to the SQLite database and return the connection."""
     try:
@@ -32,11 +35,15 @@ def get_mutex_logs(conn):
     """Retrieve mutex logs from the database."""
     try:
         query = """
-        SELECT id, node_id, event, timestamp, target_node, created_at
+        SELECT *
         FROM mutex_logs
         ORDER BY created_at ASC
         """
-        return pd.read_sql_query(query, conn)
+        logs = pd.read_sql_query(query, conn)
+        if 'resource' not in logs:
+            # Logs written before locks were kept per resource
+            logs['resource'] = None
+        return logs
     except sqlite3.Error as e:
         print(f"Error retrieving mutex logs: {e}")
         exit(1)
@@ -53,6 +60,9 @@ def create_timeline_plot(logs):
         'RELEASE': 'purple',
         'DEFER': 'orange',
         'RECEIVED_REPLY': 'cyan',
+        'FAILED': 'brown',
+        'INQUIRE': 'olive',
+        'RELINQUISH': 'gray',
         'PATIENT_REGISTERED': 'magenta'
     }
     
@@ -161,6 +171,54 @@ def create_critical_section_plot(logs):
     plt.tight_layout()
     return fig
 
+def compute_metrics(logs):
+    """Compute messages per critical section entry and the synchronization delay.
+    
+    The synchronization delay is the time from a node leaving a resource's
+    critical section to the next node entering it, counted only when some
+    node was already waiting for that resource at the release.
+    """
+    entries = (logs['event'] == 'CRITICAL_SECTION').sum()
+    messages = (logs['event'].isin(MESSAGE_EVENTS) & logs['target_node'].notna()).sum()
+    
+    waiting = defaultdict(set)  # resource -> nodes with an outstanding request
+    last_release = {}
+    delays = []
+    for _, row in logs.sort_values('created_at', kind='stable').iterrows():
+        resource = row['resource'] if pd.notna(row['resource']) else None
+        if row['event'] == 'REQUEST':
+            waiting[resource].add(row['node_id'])
+        elif row['event'] == 'CRITICAL_SECTION':
+            waiting[resource].discard(row['node_id'])
+            released = last_release.pop(resource, None)
+            if released is not None:
+                delays.append((row['created_at'] - released).total_seconds())
+        elif row['event'] == 'RELEASE' and pd.isna(row['target_node']):
+            # Also ends a request that timed out before entering
+            waiting[resource].discard(row['node_id'])
+            last_release[resource] = row['created_at'] if waiting[resource] else None
+    
+    return {
+        'entries': int(entries),
+        'messages': int(messages),
+        'messages_per_entry': messages / entries if entries else float('nan'),
+        'sync_delay_ms': np.median(delays) * 1000 if delays else float('nan'),
+        'sync_samples': len(delays)
+    }
+
+def print_comparison(db_paths):
+    """Print the metrics of several mutex log databases side by side."""
+    print(f"{'database':<32}{'entries':>9}{'messages':>10}{'msg/entry':>11}{'sync delay (ms)':>17}")
+    for db_path in db_paths:
+        conn = connect_to_db(db_path)
+        logs = get_mutex_logs(conn)
+        conn.close()
+        logs['created_at'] = pd.to_datetime(logs['created_at'])
+        
+        metrics = compute_metrics(logs)
+        print(f"{os.path.basename(db_path):<32}{metrics['entries']:>9}{metrics['messages']:>10}"
+              f"{metrics['messages_per_entry']:>11.2f}{metrics['sync_delay_ms']:>17.2f}")
+
 def main():
     parser = argparse.ArgumentParser(description='Analyze mutex logs and generate visualizations')
     parser.add_argument('--db', default='hospital_queue.db',
@@ -169,9 +227,15 @@ def main():
     parser.add_argument('--plot', choices=['timeline', 'distribution', 'interaction',
                                          'clock', 'critical', 'all'],
                       default='all', help='Type of plot to generate')
+    parser.add_argument('--compare', nargs='+', metavar='DB',
+                      help='Print messages per entry and synchronization delay for each database instead of plotting')
     
     args = parser.parse_args()
     
+    if args.compare:
+        print_comparison(args.compare)
+        return
+    
     # Connect to database and get logs
     conn = connect_to_db(args.db)
     logs = get_mutex_logs(conn)
@@ -0,0 +1,96 @@
+"""
+Background writer for mutex log entries.
+
+The Ricart-Agrawala functions used to commit one MutexLog row per event
+while holding the global mutex, so every protocol step waited on a
+database fsync. They now only advance the Lamport clock and hand the entry
+to this writer, which drains a bounded queue on its own thread and inserts
+the entries in group commits of up to `batch_size` rows, at most
+`flush_interval` seconds after the first one arrived.
+
+When the queue is full, log() blocks until the writer catches up rather
+than dropping entries. Pending entries are flushed when the process exits.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MutexLogWriter:
+    def __init__(self, write_batch, batch_size=100, flush_interval=0.5, max_pending=10000):
+        """write_batch(entries) inserts a list of row dicts in one transaction."""
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def log(self, entry):
+        """Queue a row for the next group commit"""
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def flush(self):
+        """Block until every entry queued so far has been written"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Write out pending entries and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mutex-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            entry = self._queue.get()
+            if entry is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} mutex log entries: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
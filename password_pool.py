@@ -0,0 +1,117 @@
+"""
+Password verification off the request threads.
+
+A PBKDF2 check takes a few hundred milliseconds of CPU. When a whole shift
+logs in at once, hashing in the request threads takes every CPU and thread
+the queue endpoints need. PasswordVerifier runs the checks in a small
+process pool instead. At most `workers` checks run at a time, `queue_size`
+more wait for a worker, and further logins are turned away with LoginBusy
+after `admission_timeout` seconds rather than piling up.
+
+The pool uses the spawn start method, so its workers never inherit the
+server's threads or their locks, and it is started on the first login.
+With `workers=0` the checks run in the calling thread, still bounded by
+the admission limit.
+
+VerifiedLogins issues a random token after a successful check, which the
+client sends back with its next login within `ttl` seconds to skip the
+hash. Only a SHA-256 of each token is kept, never anything derived from
+the password. A token is used once (each login issues a new one) and only
+matches while the account's password hash is unchanged.
+"""
+
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash
+
+
+class LoginBusy(Exception):
+    """Raised when a password check was not admitted in time"""
+
+
+class PasswordVerifier:
+    def __init__(self, workers=2, queue_size=64, admission_timeout=5):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.admission_timeout = admission_timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def verify(self, password_hash, password):
+        """check_password_hash() in a worker; raises LoginBusy if every worker and queue slot stays taken"""
+        if not self._slots.acquire(timeout=self.admission_timeout):
+            raise LoginBusy()
+        try:
+            if self.workers == 0:
+                return check_password_hash(password_hash, password)
+            executor = self._pool()
+            try:
+                return executor.submit(check_password_hash, password_hash, password).result()
+            except BrokenProcessPool:
+                # A worker died; the next check starts a fresh pool
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                raise
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+
+class VerifiedLogins:
+    def __init__(self, ttl=300, max_size=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # SHA-256 of the token -> (user id, password hash, expires at)
+
+    def issue(self, user_id, password_hash):
+        """A new token for an account whose password was just checked, or None when disabled"""
+        if self.ttl <= 0:
+            return None
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._entries[self._key(token)] = (user_id, password_hash, self._clock() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return token
+
+    def check(self, token, user_id, password_hash):
+        """Whether the token was issued to this account, with this password hash, in the last ttl seconds; uses it up"""
+        if not token or self.ttl <= 0:
+            return False
+        with self._lock:
+            entry = self._entries.pop(self._key(token), None)
+        if entry is None or entry[2] <= self._clock():
+            return False
+        return entry[0] == user_id and hmac.compare_digest(entry[1], password_hash)
+
+    def revoke(self, token):
+        if token:
+            with self._lock:
+                self._entries.pop(self._key(token), None)
+
+    def _key(self, token):
+        return hashlib.sha256(token.encode()).digest()
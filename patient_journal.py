@@ -0,0 +1,163 @@
+"""
+Append-only journal of patient lifecycle events.
+
+Every committed patient change appends its events to the journal (the
+patient_events table) in the same transaction:
+
+    REGISTERED               a new patient; carries every field of the record
+    CONSULTATION_STARTED     the doctor called the patient in
+    CONSULTATION_COMPLETED   the patient moved to the pharmacy queue
+    PRESCRIBED               the patient's prescriptions changed
+    CHECKED_OUT              the pharmacy handed out the prescription
+    UPDATED                  any other change, e.g. one replicated from a peer
+
+Each event carries only the record fields it changed, and the in-memory
+views (the queue engine and the system statistics) are updated by folding
+the events onto the patient's previous record with apply_event().
+
+Every `snapshot_every` events the folded state of the patients still in
+the hospital is saved as a snapshot (the journal_snapshots table) along
+with the id of the last event it includes. A restarted node loads the
+latest snapshot and folds only the events after it, instead of querying
+every patient.
+"""
+
+import json
+import threading
+from datetime import datetime
+
+from queue_engine import PatientRecord
+
+REGISTERED = "REGISTERED"
+CONSULTATION_STARTED = "CONSULTATION_STARTED"
+CONSULTATION_COMPLETED = "CONSULTATION_COMPLETED"
+PRESCRIBED = "PRESCRIBED"
+CHECKED_OUT = "CHECKED_OUT"
+UPDATED = "UPDATED"
+
+EVENT_TYPES = (REGISTERED, CONSULTATION_STARTED, CONSULTATION_COMPLETED, PRESCRIBED, CHECKED_OUT, UPDATED)
+
+# The event a change of status is recorded as
+STATUS_EVENTS = {
+    "In Consultation": CONSULTATION_STARTED,
+    "Ready for Pharmacy": CONSULTATION_COMPLETED,
+    "Checked Out": CHECKED_OUT,
+}
+
+
+def _to_json(fields):
+    fields = dict(fields)
+    if 'registration_time' in fields:
+        fields['registration_time'] = fields['registration_time'].isoformat()
+    if 'prescriptions' in fields:
+        fields['prescriptions'] = list(fields['prescriptions'])
+    return fields
+
+
+def _from_json(fields):
+    if 'registration_time' in fields:
+        fields['registration_time'] = datetime.fromisoformat(fields['registration_time'])
+    if 'prescriptions' in fields:
+        fields['prescriptions'] = tuple(fields['prescriptions'])
+    return fields
+
+
+def encode_fields(fields):
+    """JSON for a dict of PatientRecord fields"""
+    return json.dumps(_to_json(fields))
+
+
+def decode_fields(data):
+    return _from_json(json.loads(data))
+
+
+def lifecycle_events(previous, current, registered=False):
+    """[(event type, changed fields)] taking a patient from the previous record to the current one.
+
+    previous is None for a patient without a record in the views: a newly
+    registered one, or e.g. a checked-out patient a peer changed again,
+    whose event then carries every field too.
+    """
+    if previous is None:
+        return [(REGISTERED if registered else UPDATED, current._asdict())]
+    changed = {field: value for field, value in current._asdict().items() if getattr(previous, field) != value}
+    prescriptions = changed.pop('prescriptions', None)
+    events = []
+    if changed:
+        event_type = STATUS_EVENTS.get(current.status, UPDATED) if 'status' in changed else UPDATED
+        events.append((event_type, changed))
+    if prescriptions is not None:
+        events.append((PRESCRIBED, {'prescriptions': prescriptions}))
+    return events
+
+
+def apply_event(record, event_type, fields):
+    """The patient record after an event; record is None before the first one"""
+    if event_type == REGISTERED or record is None:
+        return PatientRecord(**fields)
+    return record._replace(**fields)
+
+
+def encode_snapshot(records):
+    return json.dumps([_to_json(record._asdict()) for record in records])
+
+
+def decode_snapshot(payload):
+    return [PatientRecord(**_from_json(fields)) for fields in json.loads(payload)]
+
+
+def replay(records, events, today, observe=None):
+    """Fold journal events onto snapshot records.
+
+    events are (patient row id, event type, fields, time) in journal order,
+    and observe(previous, current, time), when given, is called with every
+    record an event changed. Returns the folded records by row id, the
+    number of today's registrations among the events, and the row ids of
+    patients whose events start before the snapshot (e.g. a checked-out
+    patient a peer changed again), which the caller has to load from their
+    rows.
+    """
+    records = {record.id: record for record in records}
+    registered_today = 0
+    missing = set()
+    for patient_id, event_type, fields, at in events:
+        if patient_id in missing:
+            continue
+        if patient_id not in records and len(fields) < len(PatientRecord._fields):
+            missing.add(patient_id)
+            continue
+        previous = records.get(patient_id)
+        records[patient_id] = apply_event(previous, event_type, fields)
+        if observe is not None:
+            observe(previous, records[patient_id], at)
+        if event_type == REGISTERED and fields['registration_time'].date() == today:
+            registered_today += 1
+    return records, registered_today, missing
+
+
+class PatientJournal:
+    """Position of the in-memory views in the journal, and when to snapshot them."""
+
+    def __init__(self, snapshot_every=500):
+        self.snapshot_every = snapshot_every
+        self.last_event_id = 0
+        self._since_snapshot = 0
+        self._lock = threading.Lock()
+
+    def loaded(self, last_event_id, replayed):
+        """The views were rebuilt up to last_event_id, replaying that many events past the latest snapshot"""
+        with self._lock:
+            self.last_event_id = last_event_id
+            self._since_snapshot = replayed
+
+    def advance(self, last_event_id, count):
+        """Record that count more events were folded into the views; returns whether a snapshot is due"""
+        with self._lock:
+            self.last_event_id = max(self.last_event_id, last_event_id)
+            self._since_snapshot += count
+            return self._since_snapshot >= self.snapshot_every
+
+    def snapshot_taken(self):
+        with self._lock:
+            self._since_snapshot = 0
+
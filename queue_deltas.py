@@ -0,0 +1,155 @@
+"""
+Numbered delta events for the queue views streamed over Server-Sent Events.
+
+A queue view (the receptionists' waiting list, the pharmacy queue, a
+doctor's queue) is a list of patient entries with an "id". Each time the
+view is rebuilt, record() compares it with the previous build and, if
+anything changed, appends a numbered event with only the differences:
+
+    event: delta
+    data: {"removed": [id, ...],
+           "updated": [{"id": id, <changed fields>}, ...],
+           "inserted": [[index, entry], ...]}
+
+A client applies a delta by dropping the removed entries, merging the
+updated fields, then inserting each new entry at its index in ascending
+order. Every `snapshot_every` events, and whenever entries that stayed in
+the view changed their relative order, the event is a full snapshot
+instead:
+
+    event: snapshot
+    data: [entry, ...]
+
+The last `buffer_size` events of each view are kept, so a client that
+reconnects with the id of the last event it saw (the Last-Event-ID
+header) is sent the events it missed. It gets a snapshot if those events
+are no longer buffered, if they would be larger than a snapshot, or if the
+id is from before a restart. Event ids are "<epoch>-<number>", with an
+epoch that is random per process.
+"""
+
+import json
+import threading
+import uuid
+from collections import deque
+
+DELTA = "delta"
+SNAPSHOT = "snapshot"
+
+
+def diff_entries(previous, current, key='id'):
+    """The delta from the previous list of entries to the current one, or
+    None if entries in both changed their relative order"""
+    before = {entry[key]: entry for entry in previous}
+    after = {entry[key]: entry for entry in current}
+    kept_before = [entry[key] for entry in previous if entry[key] in after]
+    kept_after = [entry[key] for entry in current if entry[key] in before]
+    if kept_before != kept_after:
+        return None
+
+    updated = []
+    inserted = []
+    for index, entry in enumerate(current):
+        old = before.get(entry[key])
+        if old is None:
+            inserted.append([index, entry])
+        elif old != entry:
+            changes = {field: value for field, value in entry.items() if old.get(field) != value}
+            updated.append(dict({key: entry[key]}, **changes))
+    return {"removed": [entry[key] for entry in previous if entry[key] not in after],
+            "updated": updated,
+            "inserted": inserted}
+
+
+class _ViewLog:
+    def __init__(self, buffer_size):
+        self.lock = threading.Lock()
+        self.entries = None
+        self.number = 0
+        self.events = deque(maxlen=buffer_size)  # (number, kind, frame)
+        self.since_snapshot = 0
+        self.snapshot = None                     # (number, frame) of the current entries
+
+
+class QueueDeltaLog:
+    def __init__(self, snapshot_every=100, buffer_size=256, key='id'):
+        self.snapshot_every = snapshot_every
+        self.buffer_size = buffer_size
+        self.key = key
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._views = {}  # view -> _ViewLog
+
+    def record(self, view, entries):
+        """Append an event for the view if entries differ from its last build; returns the latest event number"""
+        log = self._view(view)
+        with log.lock:
+            if log.entries is not None and entries == log.entries:
+                return log.number
+            delta = None
+            if log.entries is not None and log.since_snapshot + 1 < self.snapshot_every:
+                delta = diff_entries(log.entries, entries, self.key)
+
+            log.number += 1
+            log.entries = entries
+            log.snapshot = None
+            if delta is None:
+                log.since_snapshot = 0
+                log.events.append((log.number, SNAPSHOT, self._snapshot_frame(log)))
+            else:
+                log.since_snapshot += 1
+                log.events.append((log.number, DELTA, self._frame(log.number, DELTA, delta)))
+            return log.number
+
+    def frames_since(self, view, last_event_id):
+        """(frames, event id) taking a client from the event id it last saw (None
+        for a new client) to the view's latest event; frames is empty if it is
+        up to date"""
+        log = self._view(view)
+        with log.lock:
+            if log.entries is None:
+                return b'', last_event_id
+            current = f"{self.epoch}-{log.number}"
+            number = self._parse(last_event_id)
+            if number == log.number:
+                return b'', current
+
+            if number is not None and number < log.number and log.events and log.events[0][0] <= number + 1:
+                missed = [(kind, frame) for n, kind, frame in log.events if n > number]
+                snapshots = [i for i, (kind, _) in enumerate(missed) if kind == SNAPSHOT]
+                if snapshots:
+                    missed = missed[snapshots[-1]:]
+                frames = b''.join(frame for _, frame in missed)
+                snapshot = self._snapshot_frame(log)
+                if len(frames) <= len(snapshot):
+                    return frames, current
+                return snapshot, current
+            return self._snapshot_frame(log), current
+
+    def stats(self):
+        """{view: (latest event number, buffered events)}"""
+        with self._lock:
+            views = list(self._views.items())
+        return {view: (log.number, len(log.events)) for view, log in views}
+
+    def _parse(self, event_id):
+        epoch, _, number = (event_id or '').partition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def _snapshot_frame(self, log):
+        """Snapshot of the current entries; called with the view's lock held"""
+        if log.snapshot is None or log.snapshot[0] != log.number:
+            log.snapshot = (log.number, self._frame(log.number, SNAPSHOT, log.entries))
+        return log.snapshot[1]
+
+    def _frame(self, number, kind, payload):
+        return f"id: {self.epoch}-{number}\nevent: {kind}\ndata: {json.dumps(payload)}\n\n".encode()
+
+    def _view(self, view):
+        with self._lock:
+            log = self._views.get(view)
+            if log is None:
+                log = self._views[view] = _ViewLog(self.buffer_size)
+            return log
@@ -0,0 +1,280 @@
+"""
+In-memory queue engine.
+
+Holds an authoritative copy of every queued patient, one ordered queue per
+doctor plus one for the pharmacy, and the staff roster. It is loaded from the
+database once at startup and written through on every transition, after the
+database commit succeeds, so queue reads never touch the database.
+
+Queues are ordered by (queue_position, id), where queue_position is the
+sequence number stored on the patient row; a patient's displayed position is
+their rank in that order.
+
+Active doctors are also indexed by predicted completion time for automatic
+assignment (see doctor_load), updated whenever a doctor's queue or roster
+entry changes.
+"""
+
+import threading
+from collections import Counter, namedtuple
+
+from sortedcontainers import SortedKeyList
+
+from doctor_load import DoctorLoadIndex
+
+DOCTOR_QUEUE_STATUSES = ("Waiting for Doctor", "In Consultation")
+
+PatientRecord = namedtuple('PatientRecord', [
+    'id',                 # patients.id
+    'unique_id',          # unique_4digit
+    'name',
+    'contact',
+    'status',
+    'doctor_id',
+    'queue_position',     # sequence number within the current queue
+    'registration_time',
+    'prescriptions',      # tuple of medicine names
+])
+
+StaffRecord = namedtuple('StaffRecord', ['id', 'name', 'role', 'active', 'specialty'])
+
+
+def _queue_key(record):
+    return (record.queue_position, record.id)
+
+
+class PatientQueue:
+    """Patients ordered by sequence number, with O(log n) insert, remove and rank."""
+
+    def __init__(self):
+        self._records = SortedKeyList(key=_queue_key)
+
+    def add(self, record):
+        self._records.add(record)
+
+    def remove(self, record):
+        self._records.remove(record)
+
+    def rank(self, record):
+        """1-based position of a record in the queue"""
+        return self._records.bisect_key_left(_queue_key(record)) + 1
+
+    def next_position(self):
+        return self._records[-1].queue_position + 1 if self._records else 1
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class QueueEngine:
+    def __init__(self, consultation_seconds=None):
+        """consultation_seconds(doctor_id) is a doctor's expected consultation time"""
+        self._consultation_seconds = consultation_seconds or (lambda doctor_id: 1)
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._patients = {}        # unique_id -> PatientRecord
+        self._doctor_queues = {}   # doctor_id -> PatientQueue (waiting and in consultation)
+        self._waiting_counts = {}  # doctor_id -> number of patients still waiting
+        self._pharmacy_queue = PatientQueue()
+        self._staff = {}           # user id -> StaffRecord
+        self._doctors = None       # specialty (lower-cased, None for all) -> active doctors, rebuilt after staff changes
+        self._doctor_load = DoctorLoadIndex()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, patients, staff):
+        """Replace the engine contents with the given patient and staff records"""
+        with self._lock:
+            self._patients = {}
+            self._doctor_queues = {}
+            self._waiting_counts = {}
+            self._pharmacy_queue = PatientQueue()
+            self._staff = {record.id: record for record in staff}
+            self._doctors = None
+            for record in patients:
+                self._insert(record)
+            self._doctor_load = DoctorLoadIndex()
+            for record in staff:
+                self._update_load(record.id)
+            self._loaded = True
+
+    def load_once(self, loader):
+        """Load from loader() -> (patients, staff) unless already loaded"""
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self.load(*loader())
+
+    # Staff roster
+
+    def put_staff(self, record):
+        with self._lock:
+            self._staff[record.id] = record
+            self._doctors = None
+            self._update_load(record.id)
+
+    def staff_name(self, user_id):
+        record = self._staff.get(user_id)
+        return record.name if record else None
+
+    def is_active_doctor(self, user_id):
+        """Whether user_id is one of active_doctors()"""
+        record = self._staff.get(user_id)
+        return record is not None and record.role == 'doctor' and record.active
+
+    def active_doctors(self, specialty=None):
+        """Active doctors ordered by id, optionally only those of one specialty (case-insensitive)"""
+        with self._lock:
+            if self._doctors is None:
+                doctors = [record for record in sorted(self._staff.values(), key=lambda r: r.id)
+                           if record.role == 'doctor' and record.active]
+                self._doctors = {None: tuple(doctors)}
+                for record in doctors:
+                    key = (record.specialty or '').lower()
+                    self._doctors[key] = self._doctors.get(key, ()) + (record,)
+            key = specialty.lower() if specialty is not None else None
+            return self._doctors.get(key, ())
+
+    # Patients
+
+    def put_patient(self, record):
+        """Insert a patient or apply a transition to an existing one.
+
+        Returns the record it replaced, or None for a new patient.
+        """
+        with self._lock:
+            previous = self._patients.get(record.unique_id)
+            if previous is not None:
+                self._remove(previous)
+            self._insert(record)
+            for doctor_id in {record.doctor_id, previous.doctor_id if previous is not None else None}:
+                self._update_load(doctor_id)
+            return previous
+
+    def get_patient(self, unique_id):
+        return self._patients.get(unique_id)
+
+    def active_patients(self):
+        """Records of every patient who has not checked out"""
+        with self._lock:
+            return [record for record in self._patients.values() if record.status != "Checked Out"]
+
+    def next_doctor_position(self, doctor_id):
+        with self._lock:
+            queue = self._doctor_queues.get(doctor_id)
+            return queue.next_position() if queue else 1
+
+    def next_pharmacy_position(self):
+        with self._lock:
+            return self._pharmacy_queue.next_position()
+
+    def rank(self, record):
+        """1-based position of the patient in their current queue, or 0 if not queued"""
+        with self._lock:
+            queue = self._queue_for(record)
+            return queue.rank(record) if queue is not None else 0
+
+    def waiting_count(self, doctor_id):
+        return self._waiting_counts.get(doctor_id, 0)
+
+    def doctor_queue_sizes(self):
+        """{doctor_id: (patients in the queue, of whom still waiting)} for every non-empty doctor queue"""
+        with self._lock:
+            return {doctor_id: (len(queue), self._waiting_counts.get(doctor_id, 0))
+                    for doctor_id, queue in self._doctor_queues.items()}
+
+    def doctor_queue(self, doctor_id):
+        """[(position, record)] for the doctor's queue, including the patient in consultation"""
+        with self._lock:
+            queue = self._doctor_queues.get(doctor_id)
+            return list(enumerate(queue, start=1)) if queue else []
+
+    def waiting_list(self):
+        """[(position, record)] for every patient in a doctor's queue, ordered by registration time"""
+        with self._lock:
+            entries = [(position, record) for queue in self._doctor_queues.values()
+                       for position, record in enumerate(queue, start=1)]
+        entries.sort(key=lambda entry: (entry[1].registration_time, entry[1].id))
+        return entries
+
+    def pharmacy_queue(self):
+        with self._lock:
+            return list(enumerate(self._pharmacy_queue, start=1))
+
+    # Automatic assignment
+
+    def least_loaded_doctor(self, specialty=None):
+        """The active doctor, optionally of one specialty (case-insensitive), who
+        would see a new patient soonest, or None; O(log doctors)"""
+        return self.assign_doctors([specialty])[0]
+
+    def assign_doctors(self, specialties, assigned=()):
+        """least_loaded_doctor() for a series of new patients, each counted in the
+        load of their doctor when picking for the next one; assigned are the
+        doctor ids of new patients who already have one, counted from the start"""
+        with self._lock:
+            planned = Counter(assigned)
+            for doctor_id in planned:
+                self._update_load(doctor_id, planned[doctor_id])
+            doctors = []
+            for specialty in specialties:
+                entry = self._doctor_load.least_loaded(specialty.lower() if specialty is not None else None)
+                if entry is None:
+                    doctors.append(None)
+                    continue
+                doctor_id = entry[0]
+                planned[doctor_id] += 1
+                self._update_load(doctor_id, planned[doctor_id])
+                doctors.append(self._staff[doctor_id])
+            # The patients are not queued yet; put_patient counts them once they are
+            for doctor_id in planned:
+                self._update_load(doctor_id)
+            return doctors
+
+    def refresh_doctor_load(self, doctor_id):
+        """Re-index a doctor whose expected consultation time changed"""
+        with self._lock:
+            self._update_load(doctor_id)
+
+    def _update_load(self, doctor_id, planned=0):
+        record = self._staff.get(doctor_id)
+        if record is None or record.role != 'doctor' or not record.active:
+            self._doctor_load.discard(doctor_id)
+            return
+        queue = self._doctor_queues.get(doctor_id)
+        load = ((len(queue) if queue else 0) + planned + 1) * self._consultation_seconds(doctor_id)
+        self._doctor_load.set(doctor_id, load, (None, (record.specialty or '').lower()))
+
+    def _queue_for(self, record, create=False):
+        if record.status in DOCTOR_QUEUE_STATUSES:
+            queue = self._doctor_queues.get(record.doctor_id)
+            if queue is None and create:
+                queue = self._doctor_queues[record.doctor_id] = PatientQueue()
+            return queue
+        if record.status == "Ready for Pharmacy":
+            return self._pharmacy_queue
+        return None
+
+    def _insert(self, record):
+        self._patients[record.unique_id] = record
+        queue = self._queue_for(record, create=True)
+        if queue is not None:
+            queue.add(record)
+        if record.status == "Waiting for Doctor":
+            self._waiting_counts[record.doctor_id] = self._waiting_counts.get(record.doctor_id, 0) + 1
+
+    def _remove(self, record):
+        del self._patients[record.unique_id]
+        queue = self._queue_for(record)
+        if queue is not None:
+            queue.remove(record)
+            if not queue and queue is not self._pharmacy_queue:
+                del self._doctor_queues[record.doctor_id]
+        if record.status == "Waiting for Doctor":
+            self._waiting_counts[record.doctor_id] -= 1
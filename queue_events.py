@@ -0,0 +1,146 @@
+"""
+In-process publish/subscribe bus for queue change notifications.
+
+Write paths publish the topics they touched after committing, and the
+Server-Sent Events generators block on a subscription instead of polling
+the database on a timer.
+
+Each publish also bumps a per-topic version counter, which identifies the
+state of a view for caching (see snapshot_cache) and in the ETags of the
+polled endpoints. The counters start over with the process, so the bus
+also has a random epoch to tell its versions from those of an earlier run.
+
+Topics are plain strings:
+
+    patient:<unique_4digit>   a single patient's record changed
+    doctor:<doctor_id>        a doctor's waiting queue changed
+    pharmacy                  the pharmacy queue changed
+    waiting                   the receptionist's waiting list changed
+"""
+
+import asyncio
+import threading
+import uuid
+
+
+def patient_topic(unique_id):
+    return f"patient:{unique_id}"
+
+
+def doctor_topic(doctor_id):
+    return f"doctor:{doctor_id}"
+
+
+PHARMACY_TOPIC = "pharmacy"
+WAITING_TOPIC = "waiting"
+
+
+class Subscription:
+    """A set of topics a single listener is waiting on."""
+
+    def __init__(self, bus, topics):
+        self._bus = bus
+        self._event = threading.Event()
+        self.topics = frozenset()
+        self.update(topics)
+
+    def update(self, topics):
+        """Replace the subscribed topics (e.g. when a patient changes queue)."""
+        self._bus._resubscribe(self, frozenset(topics))
+
+    def wait(self, timeout=None):
+        """Block until one of the topics is published or the timeout expires.
+
+        Returns True if a change was published since the last call.
+        """
+        fired = self._event.wait(timeout)
+        self._event.clear()
+        return fired
+
+    def notify(self):
+        self._event.set()
+
+    def close(self):
+        self._bus._resubscribe(self, frozenset())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AsyncSubscription(Subscription):
+    """Subscription awaited from an asyncio event loop.
+
+    Publishers run on ordinary threads, so the wake-up is handed to the
+    loop with call_soon_threadsafe.
+    """
+
+    def __init__(self, bus, topics, loop):
+        self._loop = loop
+        self._async_event = asyncio.Event()
+        super().__init__(bus, topics)
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._async_event.wait(), timeout)
+            fired = True
+        except asyncio.TimeoutError:
+            fired = False
+        self._async_event.clear()
+        return fired
+
+    def notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._async_event.set)
+        except RuntimeError:
+            pass  # Loop already closed during shutdown
+
+
+class QueueEventBus:
+    """Fan-out of topic notifications to blocked subscribers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # topic -> set of Subscription
+        self._versions = {}     # topic -> number of publishes
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def subscribe(self, *topics):
+        return Subscription(self, topics)
+
+    def subscribe_async(self, loop, *topics):
+        return AsyncSubscription(self, topics, loop)
+
+    def publish(self, *topics):
+        """Wake every subscriber listening on any of the given topics."""
+        with self._lock:
+            targets = set()
+            for topic in topics:
+                self._versions[topic] = self._versions.get(topic, 0) + 1
+                targets.update(self._subscribers.get(topic, ()))
+        for subscription in targets:
+            subscription.notify()
+
+    def version(self, topic):
+        """Number of times the topic has been published"""
+        return self._versions.get(topic, 0)
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._subscribers.get(topic, ()))
+            return len({s for subs in self._subscribers.values() for s in subs})
+
+    def _resubscribe(self, subscription, topics):
+        with self._lock:
+            for topic in subscription.topics - topics:
+                subs = self._subscribers.get(topic)
+                if subs is not None:
+                    subs.discard(subscription)
+                    if not subs:
+                        del self._subscribers[topic]
+            for topic in topics - subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+            subscription.topics = topics
@@ -0,0 +1,185 @@
+"""
+Log-based replication of patient changes between nodes.
+
+Each node keeps its own database. Every committed patient change is
+appended to the node's change log (the patient_changes table) in the same
+transaction, numbered with the next sequence number of its origin node and
+stamped with a Lamport timestamp. The change carries the patient's whole
+state after the write, so applying it on another node is an upsert.
+
+Changes reach the peers two ways:
+
+    push  right after the commit, while the writer still holds the queue's
+          critical section, so the next node to enter already has it
+    pull  a background sync that asks each peer for everything past the
+          last sequence applied from every origin, to catch up after a
+          node was down or unreachable, or when a push arrives out of order
+
+A node applies the changes of one origin strictly in sequence order and
+relays them too: the pull hands out changes from every origin, not only
+the peer's own.
+
+Concurrent updates to the same patient are resolved last-writer-wins on
+(Lamport timestamp, origin node): a change only overwrites the patient row
+when it is newer than every change already applied to that patient, so
+all nodes converge on the same state whatever order the changes arrive in.
+"""
+
+import json
+import logging
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# What remote_change() tells the caller to do with a change
+APPLY = "apply"  # the next change from its origin
+SEEN = "seen"    # already applied
+GAP = "gap"      # earlier changes from its origin are missing; catch up first
+
+
+class ChangeLog:
+    """Lamport clock and per-origin sequence numbers of the local change log."""
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.clock = 0
+        self._sequences = {}  # origin node -> last sequence applied
+        # One change at a time, local or remote, so sequences are assigned in commit order
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, rows):
+        """Rebuild from (origin node, last sequence, highest Lamport timestamp) per origin"""
+        with self._lock:
+            self._sequences = {origin: sequence for origin, sequence, _ in rows}
+            self.clock = max((lamport for _, _, lamport in rows), default=0)
+            self._loaded = True
+
+    def load_once(self, loader):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self.load(loader())
+
+    def applied(self):
+        """{origin node: last sequence applied}"""
+        with self._lock:
+            return dict(self._sequences)
+
+    @contextmanager
+    def local_change(self):
+        """Number a local change as (sequence, lamport).
+
+        The caller adds the change to its transaction and commits inside
+        the block; the numbers are only used up if the block completes.
+        """
+        with self.local_changes(1) as numbers:
+            yield numbers[0]
+
+    @contextmanager
+    def local_changes(self, count):
+        """Number count local changes committed in one transaction, as [(sequence, lamport)]"""
+        with self._lock:
+            sequence = self._sequences.get(self.node_id, 0)
+            numbers = [(sequence + i, self.clock + i) for i in range(1, count + 1)]
+            yield numbers
+            if numbers:
+                self._sequences[self.node_id], self.clock = numbers[-1]
+
+    @contextmanager
+    def remote_change(self, change):
+        """Yield APPLY, SEEN or GAP for a change from a peer.
+
+        On APPLY the caller applies and commits the change inside the block,
+        which then marks it applied and advances the clock past it.
+        """
+        with self._lock:
+            expected = self._sequences.get(change["origin"], 0) + 1
+            if change["sequence"] < expected:
+                yield SEEN
+            elif change["sequence"] > expected:
+                yield GAP
+            else:
+                yield APPLY
+                self._sequences[change["origin"]] = change["sequence"]
+                self.clock = max(self.clock, change["lamport"])
+
+
+def newer(change, latest):
+    """Last-writer-wins order between a change and the latest (lamport, origin) applied to the same patient"""
+    return latest is None or (change["lamport"], change["origin"]) > tuple(latest)
+
+
+class PeerReplicator:
+    """Pushes changes to the peer nodes and pulls the ones this node missed."""
+
+    def __init__(self, node_id, peer_urls, token=None, timeout=2.0, workers=8):
+        self.node_id = node_id
+        self.peer_urls = dict(peer_urls)
+        self.token = token
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replication')
+        self._sync_requested = threading.Event()
+        self._thread = None
+
+    def push(self, changes):
+        """Send changes to every peer at once and wait up to the timeout for them
+        to be applied; peers that miss them catch up with the next sync"""
+        if not self.peer_urls:
+            return set()
+        futures = {self._executor.submit(self._post, peer, '/api/replication/changes',
+                                         {"sender": self.node_id, "changes": changes}): peer
+                   for peer in self.peer_urls}
+        done, _ = wait(futures, timeout=self.timeout)
+        delivered = {futures[future] for future in done if future.result() is not None}
+        if len(delivered) < len(self.peer_urls):
+            self.request_sync()
+        return delivered
+
+    def pull(self, peer, applied):
+        """Changes the peer has beyond the given {origin: sequence}, and whether it has more"""
+        response = self._post(peer, '/api/replication/pull', {"sender": self.node_id, "applied": applied})
+        if response is None:
+            return [], False
+        return response["changes"], response["more"]
+
+    def start(self, sync, interval):
+        """Run sync() on a background thread every interval seconds, and soon after request_sync()"""
+        if self._thread is not None or not self.peer_urls:
+            return
+        self._thread = threading.Thread(target=self._run, args=(sync, interval), name='replication-sync', daemon=True)
+        self._thread.start()
+        self.request_sync()
+
+    def request_sync(self):
+        self._sync_requested.set()
+
+    def _run(self, sync, interval):
+        while True:
+            self._sync_requested.wait(interval)
+            self._sync_requested.clear()
+            try:
+                sync()
+            except Exception as e:
+                logger.error(f"Replication sync failed: {str(e)}")
+
+    def _post(self, peer, path, body):
+        url = f"{self.peer_urls[peer]}{path}"
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['X-Peer-Token'] = self.token
+        http_request = urllib.request.Request(url, data=json.dumps(body).encode(), headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except Exception as e:
+            logger.error(f"Replication request to {peer} at {url} failed: {str(e)}")
+            return None
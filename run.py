@@ -1,10 +1,21 @@
 import os
 import sys
-from app import app
-import init_db
 
-def run_node(node_id, port):
+def run_node(node_id, port, database_url=None):
+    # The app module reads its node ID and database on import, so set them first;
+    # the node runs alone unless PEERS is set
     os.environ['NODE_ID'] = node_id
+    if database_url:
+        os.environ.setdefault('DATABASE_URL', database_url)
+    
+    from app import app
+    import init_db
+    
+    # Initialize the database
+    print("Initializing database...")
+    init_db.init_db()
+    print("Database initialization complete.\n")
+    
     print(f"\nStarting application as {node_id} on port {port}...\n")
     app.run(host='0.0.0.0', port=port, debug=True)
 
@@ -12,11 +23,6 @@ if __name__ == "__main__":
     print("Hospital Queue Management System")
     print("===============================\n")
     
-    # Initialize the database
-    print("Initializing database...")
-    init_db.init_db()
-    print("Database initialization complete.\n")
-    
     # Node selection
     print("Select a node to run:")
     print("1. Node 1 (Port 5000)")
@@ -31,13 +37,14 @@ if __name__ == "__main__":
                 run_node('node_1', 5000)
                 break
             elif choice == "2":
-                run_node('node_2', 5001)
+                # Each node has its own database, as in run_node2.py and run_node3.py
+                run_node('node_2', 5001, 'sqlite:///hospital_queue_node2.db')
                 break
             elif choice == "3":
-                run_node('node_3', 5002)
+                run_node('node_3', 5002, 'sqlite:///hospital_queue_node3.db')
                 break
             else:
                 print("Invalid choice. Please enter 1, 2, or 3.")
         except KeyboardInterrupt:
             print("\nExiting...")
-            sys.exit(0) 
\ No newline at end of file
+            sys.exit(0)
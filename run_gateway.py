@@ -0,0 +1,36 @@
+import os
+import sys
+
+# Set the node ID before the app module reads it
+os.environ.setdefault('NODE_ID', 'node_1')
+
+from app import app
+import init_db
+from sse_gateway import SSEGateway
+
+def raise_open_file_limit():
+    """Each open event stream is a socket; lift the soft fd limit to the hard limit"""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+if __name__ == "__main__":
+    port = int(os.environ.get('PORT', 5000))
+    workers = int(os.environ.get('GATEWAY_WORKERS', 32))
+    
+    print(f"Hospital Queue Management System - {os.environ['NODE_ID']} (asyncio SSE gateway)")
+    print("Initializing database...")
+    init_db.init_db()
+    
+    raise_open_file_limit()
+    
+    print(f"\nStarting gateway on port {port} with {workers} worker threads...\n")
+    try:
+        SSEGateway(app, port=port, workers=workers).run()
+    except OSError as e:
+        print(f"ERROR: {str(e)}")
+        sys.exit(1)
@@ -1,10 +1,11 @@
 import os
+
+# Set the node ID before the app module reads it; the node runs alone unless PEERS is set
+os.environ.setdefault('NODE_ID', 'node_1')
+
 from app import app
 import init_db
 
-# Set the node ID
-os.environ['NODE_ID'] = 'node_1'
-
 if __name__ == "__main__":
     print("Hospital Queue Management System - Node 1")
     print("Initializing database...")
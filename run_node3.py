@@ -1,8 +1,11 @@
 import os
-from app import app
 
-# Set the node ID
-os.environ['NODE_ID'] = 'node_3'
+# Set the node ID and its own database before the app module reads them;
+# the node runs alone unless PEERS is set
+os.environ.setdefault('NODE_ID', 'node_3')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///hospital_queue_node3.db')
+
+from app import app
 
 if __name__ == "__main__":
     print("Hospital Queue Management System - Node 3")
@@ -0,0 +1,205 @@
+"""
+Streaming service-time estimates for the wait time predictions.
+
+Each doctor and the pharmacy get an estimator fed with every completed
+service, in O(1) time and memory:
+
+    consultation  from CONSULTATION_STARTED to CONSULTATION_COMPLETED
+    pharmacy      from the later of the patient reaching the pharmacy and
+                  the previous checkout, to the patient's checkout (the
+                  pharmacy has no explicit start)
+
+The estimate used for ETAs is an exponentially weighted moving average,
+seeded with a default so the first few services only nudge it; the median
+and 90th percentile are tracked alongside with the P² algorithm (Jain and
+Chlamtac, 1985) for the admin dashboard, without storing the samples.
+
+Services longer than MAX_SERVICE_SECONDS, e.g. a consultation left open
+overnight, are not counted.
+"""
+
+import bisect
+import threading
+from datetime import datetime
+
+MAX_SERVICE_SECONDS = 2 * 60 * 60
+
+QUANTILES = (0.5, 0.9)
+
+
+class P2Quantile:
+    """Running estimate of one quantile from five markers."""
+
+    def __init__(self, p):
+        self.p = p
+        self._heights = []  # the first five samples, sorted, until the markers are set up
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def observe(self, x):
+        q = self._heights
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+        elif x > q[4]:
+            q[4] = x
+        k = min(max(bisect.bisect_right(q, x) - 1, 0), 3)  # cell with q[k] <= x < q[k + 1]
+
+        n = self._positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        q = self._heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[round(self.p * (len(q) - 1))]
+        return q[2]
+
+    def _parabolic(self, i, d):
+        q, n = self._heights, self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def state(self):
+        return [self._heights, self._positions, self._desired]
+
+    def load(self, state):
+        self._heights, self._positions, self._desired = (list(values) for values in state)
+
+
+class ServiceTimeEstimator:
+    """EWMA and quantiles of one server's service times, in seconds."""
+
+    def __init__(self, default, alpha):
+        self.alpha = alpha
+        self.mean = float(default)
+        self.count = 0
+        self._quantiles = {p: P2Quantile(p) for p in QUANTILES}
+
+    def observe(self, seconds):
+        if not 0 <= seconds <= MAX_SERVICE_SECONDS:
+            return
+        self.mean += self.alpha * (seconds - self.mean)
+        self.count += 1
+        for quantile in self._quantiles.values():
+            quantile.observe(seconds)
+
+    def quantile(self, p):
+        return self._quantiles[p].value()
+
+    def state(self):
+        return {"mean": self.mean, "count": self.count,
+                "quantiles": [[p, quantile.state()] for p, quantile in self._quantiles.items()]}
+
+    def load(self, state):
+        self.mean = state["mean"]
+        self.count = state["count"]
+        for p, quantile_state in state["quantiles"]:
+            self._quantiles[p].load(quantile_state)
+
+
+class ServiceTimes:
+    """Service-time estimators for every doctor and the pharmacy, fed with patient transitions."""
+
+    def __init__(self, consultation_seconds=300, pharmacy_seconds=300, alpha=0.2):
+        self._consultation_default = consultation_seconds
+        self._alpha = alpha
+        self._lock = threading.Lock()
+        self._doctors = {}  # doctor id -> ServiceTimeEstimator
+        self._pharmacy = ServiceTimeEstimator(pharmacy_seconds, alpha)
+        self._consultations = {}      # patient row id -> when their consultation started
+        self._pharmacy_arrivals = {}  # patient row id -> when they reached the pharmacy queue
+        self._last_checkout = None
+
+    def observe(self, previous, current, at):
+        """Account for a patient moving from the previous record to the current one at the given time.
+
+        Returns the id of the doctor whose consultation time was updated, if any.
+        """
+        before = previous.status if previous is not None else None
+        if current.status == before:
+            return None
+        updated = None
+        with self._lock:
+            if before == "In Consultation":
+                started = self._consultations.pop(current.id, None)
+                if started is not None and current.status == "Ready for Pharmacy":
+                    self._doctor(previous.doctor_id).observe((at - started).total_seconds())
+                    updated = previous.doctor_id
+            elif before == "Ready for Pharmacy":
+                arrived = self._pharmacy_arrivals.pop(current.id, None)
+                if arrived is not None and current.status == "Checked Out":
+                    started = max(arrived, self._last_checkout or arrived)
+                    self._pharmacy.observe((at - started).total_seconds())
+                    self._last_checkout = at
+
+            if current.status == "In Consultation":
+                self._consultations[current.id] = at
+            elif current.status == "Ready for Pharmacy":
+                self._pharmacy_arrivals[current.id] = at
+        return updated
+
+    def consultation_seconds(self, doctor_id):
+        estimator = self._doctors.get(doctor_id)
+        return estimator.mean if estimator is not None else self._consultation_default
+
+    def pharmacy_seconds(self):
+        return self._pharmacy.mean
+
+    def summary(self):
+        """{"doctors": {doctor id: estimator}, "pharmacy": estimator} as dicts of
+        the mean, median and 90th percentile in seconds, and the sample count"""
+        def describe(estimator):
+            return {"mean": estimator.mean, "median": estimator.quantile(0.5),
+                    "p90": estimator.quantile(0.9), "samples": estimator.count}
+        with self._lock:
+            return {"doctors": {doctor_id: describe(estimator) for doctor_id, estimator in self._doctors.items()},
+                    "pharmacy": describe(self._pharmacy)}
+
+    def state(self):
+        """JSON-serializable state, for load() after a restart"""
+        with self._lock:
+            return {
+                "doctors": [[doctor_id, estimator.state()] for doctor_id, estimator in self._doctors.items()],
+                "pharmacy": self._pharmacy.state(),
+                "consultations": [[patient_id, at.isoformat()] for patient_id, at in self._consultations.items()],
+                "pharmacyArrivals": [[patient_id, at.isoformat()] for patient_id, at in self._pharmacy_arrivals.items()],
+                "lastCheckout": self._last_checkout.isoformat() if self._last_checkout else None,
+            }
+
+    def load(self, state):
+        with self._lock:
+            self._doctors = {}
+            for doctor_id, estimator_state in state["doctors"]:
+                self._doctor(doctor_id).load(estimator_state)
+            self._pharmacy.load(state["pharmacy"])
+            self._consultations = {patient_id: datetime.fromisoformat(at) for patient_id, at in state["consultations"]}
+            self._pharmacy_arrivals = {patient_id: datetime.fromisoformat(at)
+                                       for patient_id, at in state["pharmacyArrivals"]}
+            self._last_checkout = datetime.fromisoformat(state["lastCheckout"]) if state["lastCheckout"] else None
+
+    def _doctor(self, doctor_id):
+        estimator = self._doctors.get(doctor_id)
+        if estimator is None:
+            estimator = self._doctors[doctor_id] = ServiceTimeEstimator(self._consultation_default, self._alpha)
+        return estimator
@@ -0,0 +1,57 @@
+"""
+Shared builds of the queue views streamed over Server-Sent Events.
+
+Every subscriber to the same view (the receptionists' waiting list, the
+pharmacy queue, a doctor's queue) receives the same events, so the view is
+built once per version and the result (the number of the view's latest
+event, see queue_deltas) is handed to all of them. The version is the queue
+event bus counter of the view's topic, read before building, so a change
+published mid-build only makes the next reader rebuild.
+
+Builds of one view are serialized: when a publish wakes many subscribers at
+once, the first rebuilds and the rest wait for it and reuse its result.
+"""
+
+import threading
+
+
+class SnapshotCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}      # view -> (version, result of build())
+        self._build_locks = {}  # view -> Lock
+        self._hits = {}         # view -> builds served from the cache
+        self._misses = {}       # view -> builds
+
+    def get(self, view, version, build):
+        """Return the build of the view at the given version, calling build() only if it is not cached"""
+        entry = self._entries.get(view)
+        if entry is not None and entry[0] == version:
+            self._count(self._hits, view)
+            return entry[1]
+
+        with self._build_lock(view):
+            entry = self._entries.get(view)
+            if entry is not None and entry[0] == version:
+                self._count(self._hits, view)
+                return entry[1]
+            result = build()
+            self._entries[view] = (version, result)
+            self._count(self._misses, view)
+            return result
+
+    def stats(self):
+        """{view: (hits, misses)} for every view built so far"""
+        with self._lock:
+            return {view: (self._hits.get(view, 0), misses) for view, misses in self._misses.items()}
+
+    def _build_lock(self, view):
+        with self._lock:
+            lock = self._build_locks.get(view)
+            if lock is None:
+                lock = self._build_locks[view] = threading.Lock()
+            return lock
+
+    def _count(self, counter, view):
+        with self._lock:
+            counter[view] = counter.get(view, 0) + 1
@@ -0,0 +1,377 @@
+"""
+Asyncio gateway that holds the Server-Sent Events streams as coroutines.
+
+The Werkzeug server pins one thread per open event stream, so the number of
+patients watching their status is capped by the thread count. The gateway
+accepts every connection on a single event loop instead: the */events routes
+are served as coroutines that wait on the queue event bus, and all other
+requests are handed to the Flask WSGI app on a small thread pool. Database
+work for a stream (building its JSON payload) also runs on that pool, so an
+idle stream costs a socket and a coroutine, not a thread.
+
+Payloads are produced by the same serializers the Flask routes use, so
+clients see identical JSON whichever server they are connected to, and
+queue views send the same numbered delta events (see queue_deltas),
+resuming from the Last-Event-ID header.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from flask_login import current_user
+
+from app import (queue_bus, build_patient_event, queue_view_frames, serialize_waiting_patients,
+                 serialize_doctor_queue, serialize_pharmacy_queue, serialize_system_stats, fetch_new_mutex_logs,
+                 find_patient_record)
+from queue_events import patient_topic, doctor_topic, PHARMACY_TOPIC, WAITING_TOPIC
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = (
+    "Content-Type: text/event-stream\r\n"
+    "Cache-Control: no-cache\r\n"
+    "X-Accel-Buffering: no\r\n"
+    "Connection: close\r\n"
+)
+
+# Headers the gateway sets itself on proxied WSGI responses
+HOP_BY_HOP_HEADERS = {'content-length', 'connection', 'transfer-encoding', 'keep-alive'}
+
+
+class HttpRequest:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.path, _, self.query_string = target.partition('?')
+        self.version = version
+        self.headers = headers  # lower-cased names
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+
+class SSEGateway:
+    """Single-process HTTP front end for the Flask app with coroutine SSE streams."""
+
+    def __init__(self, flask_app, host='0.0.0.0', port=5000, workers=32):
+        self.app = flask_app
+        self.host = host
+        self.port = port
+        self.heartbeat = flask_app.config['SSE_HEARTBEAT_SECONDS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sse-gateway')
+        self._open_streams = 0
+
+        # path -> (required role, stream coroutine); patient streams match by prefix
+        self._routes = {
+            '/api/receptionist/waiting-patients/events': ('receptionist', self._waiting_patients_stream),
+            '/api/doctor/queue/events': ('doctor', self._doctor_queue_stream),
+            '/api/pharmacy/queue/events': ('pharmacist', self._pharmacy_queue_stream),
+            '/api/admin/system-stats/events': ('admin', self._system_stats_stream),
+            '/api/admin/mutex-logs/events': ('admin', self._mutex_logs_stream),
+        }
+
+    @property
+    def open_streams(self):
+        return self._open_streams
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"SSE gateway listening on {self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            logger.info("SSE gateway stopped")
+
+    # Connection handling
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                http_request = await self._read_request(reader)
+                if http_request is None:
+                    break
+
+                if http_request.method == 'GET' and self._is_stream(http_request.path):
+                    await self._serve_stream(http_request, reader, writer)
+                    break
+
+                await self._serve_wsgi(http_request, writer)
+                if not http_request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Error in SSE gateway connection: {str(e)}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None  # Client closed the connection between requests
+        except asyncio.LimitOverrunError:
+            logger.error("Request headers too large")
+            return None
+
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+        body = b''
+        content_length = int(headers.get('content-length') or 0)
+        if content_length:
+            body = await reader.readexactly(content_length)
+
+        return HttpRequest(method, target, version, headers, body)
+
+    async def _run(self, fn, *args):
+        """Run blocking work (DB access) on the worker pool inside an app context."""
+        def call():
+            with self.app.app_context():
+                return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    # Plain requests are passed through to the Flask app
+
+    async def _serve_wsgi(self, http_request, writer):
+        environ = self._build_environ(http_request, writer)
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(self._executor, self._call_wsgi, environ)
+
+        head = [f"HTTP/1.1 {status}\r\n"]
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                head.append(f"{name}: {value}\r\n")
+        head.append(f"Content-Length: {len(body)}\r\n")
+        head.append(f"Connection: {'keep-alive' if http_request.keep_alive else 'close'}\r\n\r\n")
+
+        writer.write(''.join(head).encode('latin-1') + body)
+        await writer.drain()
+
+    def _call_wsgi(self, environ):
+        response = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        try:
+            for chunk in result:
+                chunks.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return response['status'], response['headers'], b''.join(chunks)
+
+    def _build_environ(self, http_request, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': http_request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(http_request.path, encoding='latin-1'),
+            'QUERY_STRING': http_request.query_string,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': http_request.version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(http_request.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in http_request.headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    # Event streams
+
+    def _is_stream(self, path):
+        return path in self._routes or path.startswith('/patient/events/')
+
+    def _resolve_user(self, http_request, peer):
+        """Look up the logged-in user from the Flask session cookie"""
+        headers = {name: http_request.headers[name] for name in ('cookie', 'user-agent') if name in http_request.headers}
+        with self.app.test_request_context('/', headers=headers, environ_base={'REMOTE_ADDR': peer[0]}):
+            if not current_user.is_authenticated:
+                return None
+            return current_user.id, current_user.role
+
+    async def _serve_stream(self, http_request, reader, writer):
+        if http_request.path.startswith('/patient/events/'):
+            unique_id = unquote(http_request.path[len('/patient/events/'):])
+            stream = self._patient_stream(writer, unique_id)
+        else:
+            role, stream_factory = self._routes[http_request.path]
+            peer = writer.get_extra_info('peername') or ('', 0)
+            user = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._resolve_user, http_request, peer)
+            if user is None:
+                await self._send_error(writer, "401 UNAUTHORIZED", "Please log in first")
+                return
+            if user[1] != role:
+                await self._send_error(writer, "403 FORBIDDEN", "Unauthorized")
+                return
+            stream = stream_factory(writer, user[0], http_request.headers.get('last-event-id'))
+
+        writer.write(f"HTTP/1.1 200 OK\r\n{SSE_HEADERS}\r\n".encode('latin-1'))
+        await writer.drain()
+
+        self._open_streams += 1
+        stream_task = asyncio.ensure_future(stream)
+        disconnect_task = asyncio.ensure_future(self._wait_for_disconnect(reader))
+        try:
+            await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._open_streams -= 1
+            for task in (stream_task, disconnect_task):
+                task.cancel()
+            await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+
+    async def _send_error(self, writer, status, message):
+        body = json.dumps({"error": message}).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    async def _wait_for_disconnect(self, reader):
+        while await reader.read(1024):
+            pass
+
+    async def _send(self, writer, frame):
+        await self._write(writer, frame.encode())
+
+    async def _write(self, writer, data):
+        writer.write(data)
+        await writer.drain()
+
+    async def _queue_stream(self, writer, subscription, build, refresh_on_heartbeat=False):
+        """Coroutine twin of app.queue_event_stream"""
+        last_frame = None
+        changed = True
+        try:
+            while True:
+                if changed or refresh_on_heartbeat:
+                    frame = await self._run(build)
+                    if frame is None:
+                        return
+                    if frame != last_frame:
+                        await self._write(writer, frame)
+                        last_frame = frame
+                    elif not changed:
+                        await self._send(writer, ": keepalive\n\n")
+                else:
+                    await self._send(writer, ": keepalive\n\n")
+                changed = await subscription.wait(self.heartbeat)
+        finally:
+            subscription.close()
+
+    async def _queue_delta_stream(self, writer, subscription, topic, serialize, last_event_id,
+                                  refresh_on_heartbeat=False):
+        """Coroutine twin of app.queue_delta_stream"""
+        changed = True
+        try:
+            while True:
+                if changed or refresh_on_heartbeat:
+                    frames, last_event_id = await self._run(queue_view_frames, topic, serialize, last_event_id,
+                                                            refresh_on_heartbeat)
+                    if frames:
+                        await self._write(writer, frames)
+                    elif not changed:
+                        await self._send(writer, ": keepalive\n\n")
+                else:
+                    await self._send(writer, ": keepalive\n\n")
+                changed = await subscription.wait(self.heartbeat)
+        finally:
+            subscription.close()
+
+    async def _patient_stream(self, writer, unique_id):
+        # The same lookup as app.patient_events: the ID's current holder, from the queue engine
+        record = await self._run(lambda: find_patient_record(unique_id))
+        if record is None:
+            await self._send(writer, f"data: {json.dumps({'error': 'Patient not found'})}\n\n")
+            return
+
+        subscription = queue_bus.subscribe_async(asyncio.get_running_loop(), patient_topic(unique_id))
+        await self._queue_stream(writer, subscription, lambda: build_patient_event(unique_id, subscription))
+
+    async def _waiting_patients_stream(self, writer, user_id, last_event_id):
+        subscription = queue_bus.subscribe_async(asyncio.get_running_loop(), WAITING_TOPIC)
+        await self._queue_delta_stream(writer, subscription, WAITING_TOPIC, serialize_waiting_patients, last_event_id)
+
+    async def _doctor_queue_stream(self, writer, user_id, last_event_id):
+        subscription = queue_bus.subscribe_async(asyncio.get_running_loop(), doctor_topic(user_id))
+        # waitTime ages with the clock, so rebuild on heartbeats as well
+        await self._queue_delta_stream(writer, subscription, doctor_topic(user_id),
+                                       lambda: serialize_doctor_queue(user_id), last_event_id,
+                                       refresh_on_heartbeat=True)
+
+    async def _pharmacy_queue_stream(self, writer, user_id, last_event_id):
+        subscription = queue_bus.subscribe_async(asyncio.get_running_loop(), PHARMACY_TOPIC)
+        await self._queue_delta_stream(writer, subscription, PHARMACY_TOPIC, serialize_pharmacy_queue, last_event_id)
+
+    async def _system_stats_stream(self, writer, user_id, last_event_id):
+        while True:
+            try:
+                data = await self._run(serialize_system_stats)
+            except Exception as e:
+                logger.error(f"Error in system stats SSE: {str(e)}")
+                await self._send(writer, f"data: {json.dumps({'error': 'Failed to fetch system stats'})}\n\n")
+                return
+            await self._send(writer, f"data: {json.dumps(data)}\n\n")
+            await asyncio.sleep(5)  # Update every 5 seconds
+
+    async def _mutex_logs_stream(self, writer, user_id, last_event_id):
+        last_id = 0
+        while True:
+            try:
+                new_logs = await self._run(fetch_new_mutex_logs, last_id)
+            except Exception as e:
+                logger.error(f"Error in mutex logs SSE: {str(e)}")
+                await self._send(writer, f"data: {json.dumps({'error': 'Failed to fetch mutex logs'})}\n\n")
+                return
+            if new_logs:
+                last_id = new_logs[-1]['id']
+                for log_data in new_logs:
+                    await self._send(writer, f"data: {json.dumps(log_data)}\n\n")
+            await asyncio.sleep(1)  # Check every second
@@ -0,0 +1,12 @@
+// Applies a "delta" event of a queue view stream (see queue_deltas.py) to the
+// current list of patients: drop the removed ones, merge the updated fields,
+// then insert the new patients at their indexes in ascending order.
+function applyQueueDelta(patients, delta) {
+    const removed = new Set(delta.removed);
+    const updated = new Map(delta.updated.map(changes => [changes.id, changes]));
+    const result = patients
+        .filter(patient => !removed.has(patient.id))
+        .map(patient => updated.has(patient.id) ? Object.assign({}, patient, updated.get(patient.id)) : patient);
+    delta.inserted.forEach(([index, patient]) => result.splice(index, 0, patient));
+    return result;
+}
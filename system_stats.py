@@ -0,0 +1,85 @@
+"""
+Incrementally maintained system statistics.
+
+Counters for the admin dashboard are updated from every patient transition
+instead of being recomputed with table scans, so reading them is O(1) no
+matter how many patients the database holds. They are rebuilt from the
+database once at startup.
+"""
+
+import threading
+from collections import Counter
+from datetime import datetime
+
+
+class SystemStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._status_counts = Counter()
+        self._day = None
+        self._patients_today = 0
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self, records, patients_today, day):
+        """Rebuild from the patients still in the hospital and today's registration count"""
+        with self._lock:
+            self._status_counts = Counter()
+            for record in records:
+                self._add(record)
+            self._day = day
+            self._patients_today = patients_today
+            self._loaded = True
+
+    def apply(self, previous, current):
+        """Account for a patient moving from the previous record to the current one.
+
+        previous is None for a newly registered patient, or the record of an
+        earlier holder of a reissued ID, who is replaced in the views.
+        """
+        with self._lock:
+            if previous is not None:
+                self._remove(previous)
+            if current is not None:
+                self._add(current)
+                registered = previous is None or previous.id != current.id
+                if registered and current.status != "Checked Out":
+                    self._count_registration(current.registration_time.date())
+
+    def snapshot(self, now=None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._roll_day(now.date())
+            return {
+                "totalPatientsToday": self._patients_today,
+                "activePatients": sum(count for status, count in self._status_counts.items()
+                                      if status != "Checked Out"),
+                "doctorQueue": self._status_counts["Waiting for Doctor"],
+                "pharmacyQueue": self._status_counts["Ready for Pharmacy"],
+            }
+
+    def registrations(self, now=None):
+        """(day, patients registered that day) for today"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            self._roll_day(now.date())
+            return self._day, self._patients_today
+
+    def _add(self, record):
+        self._status_counts[record.status] += 1
+
+    def _remove(self, record):
+        self._status_counts[record.status] -= 1
+
+    def _roll_day(self, day):
+        if self._day is None or day > self._day:
+            self._day = day
+            self._patients_today = 0
+
+    def _count_registration(self, day):
+        self._roll_day(day)
+        if day == self._day:
+            self._patients_today += 1
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A single node on a throwaway database; the app module reads these on import
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ['PEERS'] = ''
+os.environ['PASSWORD_WORKERS'] = '0'
+
+@pytest.fixture(scope='session')
+def hospital():
+    import logging
+    logging.disable(logging.INFO)
+    import app as hospital
+    hospital.app.debug = False
+    hospital.app.test_client().get('/')  # runs initialize_database
+    return hospital
+
+@pytest.fixture
+def login(hospital):
+    def login(username, password):
+        client = hospital.app.test_client()
+        response = client.post('/login', json={'username': username, 'password': password})
+        assert response.status_code == 200, response.data
+        return client
+    return login
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from distributed_mutex import ALGORITHMS, LoopbackTransport, create_mutex
+
+
+def cluster(algorithm, size):
+    transport = LoopbackTransport()
+    nodes = [f"node_{i}" for i in range(1, size + 1)]
+    mutexes = {}
+    for node in nodes:
+        mutexes[node] = create_mutex(algorithm, node, nodes, transport, timeout=10)
+        transport.register(node, mutexes[node])
+    return transport, mutexes
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def queued_at(algorithm, holder, node):
+    """Whether the holder has put node's request on hold"""
+    status = holder.status()
+    return node in (status['deferred'] if algorithm == 'ricart-agrawala' else status['waiting'])
+
+
+@pytest.mark.parametrize('algorithm, size', [('ricart-agrawala', 3), ('maekawa', 3), ('maekawa', 9)])
+def test_one_node_at_a_time(algorithm, size):
+    transport, mutexes = cluster(algorithm, size)
+    inside = []
+    overlaps = []
+    entries = []
+
+    def work(node):
+        for _ in range(5):
+            with mutexes[node].critical_section():
+                inside.append(node)
+                if len(inside) > 1:
+                    overlaps.append(tuple(inside))
+                time.sleep(0.001)
+                entries.append(node)
+                inside.remove(node)
+
+    threads = [threading.Thread(target=work, args=(node,)) for node in mutexes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not overlaps
+    assert sorted(entries) == sorted(list(mutexes) * 5)
+
+
+@pytest.mark.parametrize('algorithm', sorted(ALGORITHMS))
+def test_waiting_requests_are_granted_oldest_first(algorithm):
+    transport, mutexes = cluster(algorithm, 3)
+    holder = mutexes['node_1']
+    holder.acquire()
+
+    order = []
+    requested = {}
+
+    def enter(node):
+        mutex = mutexes[node]
+        mutex.acquire()
+        order.append(node)
+        mutex.release()
+
+    threads = []
+    for node in ['node_3', 'node_2']:
+        threads.append(threading.Thread(target=enter, args=(node,)))
+        threads[-1].start()
+        wait_until(lambda: queued_at(algorithm, holder, node))
+        requested[node] = (mutexes[node]._request_timestamp, node)
+
+    holder.release()
+    for thread in threads:
+        thread.join(10)
+    assert order == sorted(requested, key=requested.get)
+
+
+def test_maekawa_asks_only_its_quorum():
+    transport, mutexes = cluster('maekawa', 9)
+    assert mutexes['node_5'].quorum == ('node_2', 'node_4', 'node_5', 'node_6', 'node_8')
+    with mutexes['node_5'].critical_section():
+        pass
+    assert transport.sent['REQUEST'] == 4
+
+
+def test_ricart_agrawala_reuses_permissions_while_the_others_are_idle():
+    transport, mutexes = cluster('ricart-agrawala', 3)
+    for _ in range(5):
+        with mutexes['node_1'].critical_section():
+            pass
+    assert transport.sent['REQUEST'] == 2
+
+    # node_2 takes node_1's permission, so node_1 asks node_2 alone next time
+    with mutexes['node_2'].critical_section():
+        pass
+    wait_until(lambda: mutexes['node_1'].status()['permissions'] == ['node_3'])
+    sent = transport.sent['REQUEST']
+    with mutexes['node_1'].critical_section():
+        pass
+    assert transport.sent['REQUEST'] == sent + 1
@@ -0,0 +1,76 @@
+import time
+from datetime import datetime, timedelta
+
+from id_pool import PatientIdPool, PatientIdPoolExhausted
+
+HOUR = timedelta(hours=1)
+
+
+def small_pool(in_use=(), released=()):
+    pool = PatientIdPool(quiet_period=HOUR, low=1000, high=1004)
+    pool.load(in_use, released)
+    return pool
+
+
+def allocate_all(pool):
+    codes = set()
+    while True:
+        try:
+            codes.add(pool.allocate())
+        except PatientIdPoolExhausted:
+            return codes
+
+
+def test_allocates_every_free_code_once():
+    pool = small_pool(in_use=['1001'])
+    assert pool.available() == 4
+    assert allocate_all(pool) == {'1000', '1002', '1003', '1004'}
+    pool.reclaim('1003')
+    pool.reclaim('1003')
+    assert allocate_all(pool) == {'1003'}
+
+
+def test_released_codes_cool_down_before_reuse():
+    now = datetime.utcnow()
+    pool = small_pool(in_use=['1000', '1001', '1002'], released=[('1003', now - 2 * HOUR), ('1004', now)])
+    assert pool.available() == 1
+    assert allocate_all(pool) == {'1003'}
+
+    pool.release('1000', now - 2 * HOUR)
+    pool.release('1001', now)
+    assert allocate_all(pool) == {'1000'}
+
+
+def test_out_of_order_releases_expire_independently():
+    now = datetime.utcnow()
+    pool = small_pool()
+    allocate_all(pool)
+    pool.release('1000', now)            # still cooling
+    pool.release('1001', now - 2 * HOUR)  # replicated late, already past its quiet period
+    assert allocate_all(pool) == {'1001'}
+
+
+def test_a_later_checkout_extends_the_quiet_period():
+    now = datetime.utcnow()
+    pool = small_pool()
+    allocate_all(pool)
+    pool.release('1000', now - 2 * HOUR)
+    pool.release('1000', now)
+    pool.release('1000', now - 3 * HOUR)
+    assert allocate_all(pool) == set()
+
+
+def test_taken_codes_are_not_handed_out():
+    pool = small_pool()
+    pool.take('1002')
+    assert allocate_all(pool) == {'1000', '1001', '1003', '1004'}
+
+
+def test_a_code_taken_while_cooling_stays_taken():
+    pool = PatientIdPool(quiet_period=timedelta(milliseconds=50), low=1000, high=1001)
+    pool.load(['1000'], [])
+    allocate_all(pool)
+    pool.release('1001')
+    pool.take('1001')  # reissued by a peer while cooling here
+    time.sleep(0.1)
+    assert allocate_all(pool) == set()
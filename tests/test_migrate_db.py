@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+from sqlalchemy import create_engine, inspect
+
+from migrate_db import upgrade_schema
+
+# The tables as the first release created them
+OLD_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password_hash VARCHAR(128) NOT NULL,
+        name VARCHAR(100) NOT NULL, role VARCHAR(20) NOT NULL, node_id VARCHAR(10), active BOOLEAN,
+        PRIMARY KEY (id), UNIQUE (username))""",
+    """CREATE TABLE patients (
+        id INTEGER NOT NULL, unique_4digit VARCHAR(4) NOT NULL, name VARCHAR(100) NOT NULL,
+        contact VARCHAR(20), status VARCHAR(20), assigned_doctor_id INTEGER, registration_time DATETIME,
+        queue_position INTEGER, PRIMARY KEY (id), UNIQUE (unique_4digit),
+        FOREIGN KEY(assigned_doctor_id) REFERENCES users (id))""",
+    "INSERT INTO users (id, username, password_hash, name, role, active) VALUES (1, 'doctor', 'x', 'Dr. Smith', 'doctor', 1)",
+    "INSERT INTO patients (id, unique_4digit, name, status, assigned_doctor_id) VALUES (1, '1234', 'Patient', 'Waiting for Doctor', 1)",
+]
+
+
+def test_upgrade_schema_brings_an_old_database_up_to_date(hospital):
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'old.db')}")
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA:
+            conn.exec_driver_sql(statement)
+
+    upgrade_schema(engine, hospital.db.metadata, log=lambda message: None)
+
+    inspector = inspect(engine)
+    for table in hospital.db.metadata.sorted_tables:
+        assert {column['name'] for column in inspector.get_columns(table.name)} == set(table.columns.keys())
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT unique_4digit, specialty FROM patients JOIN users "
+                                    "ON users.id = patients.assigned_doctor_id").all() == [('1234', None)]
+
+    upgrade_schema(engine, hospital.db.metadata, log=lambda message: None)  # safe to run again
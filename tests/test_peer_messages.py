@@ -0,0 +1,55 @@
+import pytest
+
+PEERS = {'node_2': 'http://localhost:5001'}
+
+
+@pytest.fixture
+def peered(hospital, monkeypatch):
+    """The app as a node with one peer, node_2"""
+    monkeypatch.setitem(hospital.app.config, 'PEERS', PEERS)
+    monkeypatch.setattr(hospital.distributed_mutex, 'peers', tuple(PEERS))
+    return hospital
+
+
+def post(hospital, path, body, token=None):
+    headers = {'X-Peer-Token': token} if token else {}
+    return hospital.app.test_client().post(path, json=body, headers=headers)
+
+
+def test_mutex_messages_need_the_peer_token(peered, monkeypatch):
+    reply = {'type': 'REPLY', 'sender': 'node_2', 'resource': 'test', 'timestamp': 1, 'request': 1}
+    assert post(peered, '/api/mutex/message', reply).status_code == 403
+
+    monkeypatch.setitem(peered.app.config, 'PEER_TOKEN', 'secret')
+    assert post(peered, '/api/mutex/message', reply).status_code == 403
+    assert post(peered, '/api/mutex/message', reply, token='wrong').status_code == 403
+    assert post(peered, '/api/mutex/message', reply, token='secret').status_code == 202
+
+
+@pytest.mark.parametrize('message', [
+    {'type': 'REQUEST', 'sender': 'node_2', 'resource': 'test'},
+    {'type': 'REQUEST', 'sender': 'node_2', 'resource': 'test', 'timestamp': '1'},
+    {'type': 'REPLY', 'sender': 'node_2', 'resource': 'test', 'timestamp': 1},
+    {'type': 'REPLY', 'sender': 'node_3', 'resource': 'test', 'timestamp': 1, 'request': 1},
+    {'type': 'GRANT', 'sender': 'node_2', 'resource': 'test', 'timestamp': 1},
+    {'type': 'REQUEST', 'sender': 'node_2', 'timestamp': 1},
+    ['REQUEST'],
+])
+def test_malformed_mutex_messages_are_rejected(peered, monkeypatch, message):
+    monkeypatch.setitem(peered.app.config, 'PEER_TOKEN', 'secret')
+    response = post(peered, '/api/mutex/message', message, token='secret')
+    assert response.status_code == 400
+    assert response.json['error'].startswith("Invalid mutex message")
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/replication/changes', {'sender': 'node_2', 'changes': []}),
+    ('/api/replication/pull', {'sender': 'node_2', 'applied': {}}),
+])
+def test_replication_messages_need_the_peer_token(peered, monkeypatch, path, body):
+    assert post(peered, path, body).status_code == 403
+
+    monkeypatch.setitem(peered.app.config, 'PEER_TOKEN', 'secret')
+    assert post(peered, path, body).status_code == 403
+    assert post(peered, path, body, token='wrong').status_code == 403
+    assert post(peered, path, body, token='secret').status_code == 200
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from queue_engine import QueueEngine
+from system_stats import SystemStats
+
+# Queries per request once the queue engine and the session user are loaded
+WARM_QUERIES = {
+    ("receptionist", "/api/receptionist/doctors"): 0,
+    ("receptionist", "/api/receptionist/waiting-patients"): 0,
+    ("doctor", "/api/doctor/queue"): 0,
+    ("pharmacist", "/api/pharmacy/queue"): 0,
+    ("admin", "/api/admin/system-stats"): 0,
+    ("patient", "/patient/status/{patient_id}"): 0,
+}
+
+# Queries for the first patient status request after a restart, which loads the queue engine
+COLD_QUERIES = 3
+
+CREDENTIALS = {
+    "receptionist": ("reception", "reception123"),
+    "doctor": ("doctor", "doctor123"),
+    "pharmacist": ("pharmacy", "pharmacy123"),
+    "admin": ("admin", "admin123"),
+}
+
+
+class QueryCounter:
+    """Counts the statements of the test's thread; the test client runs requests on it, while
+    background work such as the mutex log writer's flushes runs on threads of its own"""
+
+    def __init__(self):
+        self.count = 0
+        self.thread = threading.get_ident()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+
+@pytest.fixture
+def counter(hospital):
+    counter = QueryCounter()
+    with hospital.app.app_context():
+        engine = hospital.db.engine
+    event.listen(engine, 'before_cursor_execute', counter.before_cursor_execute)
+    yield counter
+    event.remove(engine, 'before_cursor_execute', counter.before_cursor_execute)
+
+
+def fill_queues(clients, doctor_id, count):
+    """Register patients; send every third one through consultation to the pharmacy"""
+    patient_ids = []
+    for i in range(count):
+        response = clients["receptionist"].post('/api/receptionist/register',
+                                                json={'name': f'Patient {i}', 'doctorId': doctor_id})
+        patient_ids.append(response.json['patientId'])
+    for patient_id in patient_ids[::3]:
+        clients["doctor"].post('/api/doctor/start-consultation', json={'patientId': patient_id})
+        clients["doctor"].post('/api/doctor/complete-consultation',
+                               json={'patientId': patient_id, 'prescription': 'Paracetamol, Ibuprofen'})
+    return patient_ids
+
+
+@pytest.mark.parametrize('size', [10, 60])
+def test_queue_endpoint_query_counts(hospital, login, counter, size):
+    clients = {role: login(*credentials) for role, credentials in CREDENTIALS.items()}
+    clients["patient"] = hospital.app.test_client()
+    doctor_id = clients["receptionist"].get('/api/receptionist/doctors').json[0]['id']
+    for role in CREDENTIALS:
+        clients[role].get('/api/receptionist/doctors')  # caches the session user (see user_cache)
+
+    # The last patient is still waiting, so its status depends on the whole queue
+    patient_id = fill_queues(clients, doctor_id, size)[-1]
+    counts = {}
+    for role, path in WARM_QUERIES:
+        counter.count = 0
+        response = clients[role].get(path.format(patient_id=patient_id))
+        assert response.status_code == 200, (path, response.status_code)
+        counts[role, path] = counter.count
+    assert counts == WARM_QUERIES
+
+    # Cold start: fresh in-memory views that the first request has to load
+    hospital.queue_engine = QueueEngine()
+    hospital.system_stats = SystemStats()
+    counter.count = 0
+    assert clients["patient"].get(f'/patient/status/{patient_id}').status_code == 200
+    assert counter.count == COLD_QUERIES
@@ -0,0 +1,27 @@
+def staff_ids(admin):
+    return {staff['username']: staff['id'] for staff in admin.get('/api/admin/staff').json}
+
+
+def test_only_active_doctors_take_patients(hospital, login):
+    admin = login('admin', 'admin123')
+    response = admin.post('/api/admin/create-staff', json={'username': 'test_inactive_doctor', 'password': 'secret',
+                                                           'name': 'Dr. Inactive', 'role': 'doctor'})
+    assert response.json['success']
+    ids = staff_ids(admin)
+    assert admin.post(f"/api/admin/staff/{ids['test_inactive_doctor']}/toggle").json['success']
+
+    reception = login('reception', 'reception123')
+    for username in ['reception', 'pharmacy', 'test_inactive_doctor']:
+        response = reception.post('/api/receptionist/register', json={'name': 'Patient', 'doctorId': ids[username]})
+        assert response.status_code == 404
+        assert response.json['error'] == "Doctor not found"
+
+    response = reception.post('/api/receptionist/register-batch', json={'patients': [
+        {'name': 'Patient', 'doctorId': ids['reception']},
+        {'name': 'Patient', 'doctorId': ids['test_inactive_doctor']},
+        {'name': 'Patient', 'doctorId': ids['doctor']},
+    ]})
+    results = response.json['results']
+    assert [result['success'] for result in results] == [False, False, True]
+    assert results[0]['error'] == results[1]['error'] == "Doctor not found"
+    assert results[2]['doctorId'] == ids['doctor']
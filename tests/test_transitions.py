@@ -0,0 +1,28 @@
+def register(reception, doctor_id):
+    response = reception.post('/api/receptionist/register', json={'name': 'Patient', 'doctorId': doctor_id})
+    assert response.json['success']
+    return response.json['patientId']
+
+
+def test_transitions_require_the_previous_status(hospital, login):
+    reception = login('reception', 'reception123')
+    doctor = login('doctor', 'doctor123')
+    pharmacy = login('pharmacy', 'pharmacy123')
+    doctor_id = next(staff['id'] for staff in login('admin', 'admin123').get('/api/admin/staff').json
+                     if staff['username'] == 'doctor')
+    patient_id = register(reception, doctor_id)
+    waiting_id = register(reception, doctor_id)
+
+    assert doctor.post('/api/doctor/complete-consultation', json={'patientId': patient_id}).status_code == 409
+    assert pharmacy.post('/api/pharmacy/complete', json={'patientId': patient_id}).status_code == 409
+    assert doctor.post('/api/doctor/start-consultation', json={'patientId': patient_id}).status_code == 200
+    assert doctor.post('/api/doctor/start-consultation', json={'patientId': patient_id}).status_code == 409
+    assert doctor.post('/api/doctor/complete-consultation', json={'patientId': patient_id}).status_code == 200
+    assert pharmacy.post('/api/pharmacy/complete', json={'patientId': patient_id}).status_code == 200
+
+    # A checked out patient stays out of the doctor's queue
+    position = hospital.app.test_client().get(f'/patient/status/{waiting_id}').json['queuePosition']
+    assert doctor.post('/api/doctor/start-consultation', json={'patientId': patient_id}).status_code == 409
+    assert pharmacy.post('/api/pharmacy/complete', json={'patientId': patient_id}).status_code == 409
+    assert hospital.app.test_client().get(f'/patient/status/{waiting_id}').json['queuePosition'] == position
+    assert hospital.app.test_client().get(f'/patient/status/{patient_id}').json['stage'] == "Checked Out"
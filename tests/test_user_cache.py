@@ -0,0 +1,19 @@
+def test_deactivated_staff_lose_access_immediately(hospital, login):
+    admin = login('admin', 'admin123')
+    response = admin.post('/api/admin/create-staff', json={'username': 'test_deactivated_doctor', 'password': 'secret',
+                                                           'name': 'Dr. Deactivated', 'role': 'doctor'})
+    assert response.json['success']
+    staff_id = next(staff['id'] for staff in admin.get('/api/admin/staff').json
+                    if staff['username'] == 'test_deactivated_doctor')
+
+    doctor = login('test_deactivated_doctor', 'secret')
+    assert doctor.get('/api/doctor/queue').status_code == 200  # the session user is now cached
+    assert doctor.get('/api/doctor/queue').status_code == 200
+
+    assert admin.post(f'/api/admin/staff/{staff_id}/toggle').json['success']
+
+    # login_required redirects the now anonymous session to the login page
+    response = doctor.get('/api/doctor/queue')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+    assert doctor.post('/login', json={'username': 'test_deactivated_doctor', 'password': 'secret'}).status_code == 401
@@ -0,0 +1,42 @@
+from password_pool import VerifiedLogins
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_tokens_are_single_use_and_bound_to_the_account():
+    clock = Clock()
+    logins = VerifiedLogins(ttl=60, clock=clock)
+    token = logins.issue(1, 'hash')
+    assert not logins.check(token, 2, 'hash')  # a failed check uses the token up too
+    token = logins.issue(1, 'hash')
+    assert not logins.check(token, 1, 'new hash')
+    token = logins.issue(1, 'hash')
+    assert logins.check(token, 1, 'hash')
+    assert not logins.check(token, 1, 'hash')
+
+    token = logins.issue(1, 'hash')
+    clock.now = 61
+    assert not logins.check(token, 1, 'hash')
+    assert not logins.check('made-up', 1, 'hash')
+    assert VerifiedLogins(ttl=0).issue(1, 'hash') is None
+
+
+def test_login_with_a_verified_token_skips_the_hash(hospital, login, monkeypatch):
+    client = login('reception', 'reception123')
+    hashed = []
+    monkeypatch.setattr(hospital.password_verifier, 'verify', lambda password_hash, password: hashed.append(1))
+
+    for _ in range(2):  # each login hands out the next token
+        response = client.post('/login', json={'username': 'reception', 'password': 'reception123'})
+        assert response.status_code == 200
+    assert not hashed
+
+    # The token only stands in for the password of the account it was issued to
+    assert client.post('/login', json={'username': 'doctor', 'password': 'doctor123'}).status_code == 401
+    assert hashed
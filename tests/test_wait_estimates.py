@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+class FixedServiceTimes:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def consultation_seconds(self, doctor_id):
+        return self.seconds
+
+    def pharmacy_seconds(self):
+        return self.seconds
+
+
+@pytest.mark.parametrize('seconds, position, minutes', [
+    (240.003, 1, 4),    # 4.00005 minutes of averaging noise is still 4
+    (240.6, 1, 5),      # 4.01 minutes is a started fifth minute
+    (300, 3, 15),
+    (59.9999, 10, 10),
+    (300, 0, 0),
+])
+def test_estimated_wait_rounds_up_whole_minutes(hospital, monkeypatch, seconds, position, minutes):
+    monkeypatch.setattr(hospital, 'service_times', FixedServiceTimes(seconds))
+    for status in ["Waiting for Doctor", "Ready for Pharmacy"]:
+        record = SimpleNamespace(status=status, doctor_id=1)
+        assert hospital.estimated_wait_minutes(record, position) == minutes
@@ -22,6 +22,7 @@ export interface StaffMember {
   username: string
   role: string
   active: boolean
+  specialty?: string | null
 }
 
 export interface QueueStatus {
@@ -0,0 +1,87 @@
+"""
+Cache of the staff accounts behind logged-in sessions.
+
+Flask-Login loads the session's user on every authenticated request:
+every poll of a dashboard and every SSE connection. The cache keeps an
+immutable copy of each recently seen account, so the role checks on those
+requests issue no query.
+
+Entries are evicted least recently used beyond `max_size`, and reloaded
+after `ttl` seconds so changes made outside this process (another worker,
+init_db.py) are picked up. The staff routes invalidate an account as soon
+as they change it, so a deactivated account is logged out on its next
+request. A load that started before an invalidation is not cached.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask_login import UserMixin
+
+_MISSING = object()
+
+
+class SessionUser(namedtuple('SessionUser', 'id username name role node_id specialty active'), UserMixin):
+    """Read-only copy of a User row, used as current_user"""
+    __slots__ = ()
+
+    @property
+    def is_active(self):
+        return self.active
+
+
+def session_user(user):
+    """SessionUser for a User row, or None"""
+    if user is None:
+        return None
+    return SessionUser(id=user.id, username=user.username, name=user.name, role=user.role,
+                       node_id=user.node_id, specialty=user.specialty, active=bool(user.active))
+
+
+class UserCache:
+    def __init__(self, max_size=1024, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user id -> (expires at, SessionUser or None)
+        self._generation = 0           # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, load):
+        """The cached account, or load(user_id) on a miss; None for an unknown id is cached too"""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(user_id, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        user = load(user_id)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxSize": self.max_size,
+                    "hits": self.hits, "misses": self.misses}